@@ -0,0 +1,166 @@
+"""
+Orders the bot placed on every account, written in batches.
+
+Stop-loss jobs used to save the order IDs of every account onto the one
+`Signals` row, two `save()` calls per account that overwrote each other.
+Jobs now hand their order to `order_writer`, which keeps the latest row
+per (signal, account, role) in memory and upserts all pending rows with
+a few bulk statements when a fan-out ends or on a short interval.
+"""
+
+import configparser
+import datetime
+import logging
+import threading
+from typing import Dict, Optional, Tuple
+
+from models import AccountOrders
+
+logger = logging.getLogger(__name__)
+
+ENTRY = 'entry'
+STOPLOSS = 'stoploss'
+
+# statuses of orders that can no longer be canceled
+CLOSED_STATUSES = ('CANCELED', 'EXPIRED', 'FILLED')
+
+# rows per INSERT, well below SQLite's bound-parameter limit
+CHUNK_SIZE = 100
+
+
+def target_role(number: int) -> str:
+    """Role of the take-profit order of target `number` (1-based)."""
+    return f"target{number}"
+
+
+class OrderWriter:
+    """
+    Write-coalescing buffer in front of the `AccountOrders` table.
+
+    Args:
+        batch_size: Pending rows that trigger a flush from add()
+    """
+
+    def __init__(self, batch_size: int = 500):
+        self.batch_size = batch_size
+        self._pending: Dict[Tuple[str, str, str], dict] = {}
+        self._lock = threading.Lock()
+        self.flushes = 0
+        self.rows_written = 0
+
+    def add(
+        self,
+        signal_id: str,
+        account_name: str,
+        role: str,
+        order: Optional[dict] = None,
+        status: Optional[str] = None
+    ) -> None:
+        """
+        Record the latest order of an account for a signal.
+
+        Args:
+            signal_id: Signal the order belongs to
+            account_name: Account the order was placed on
+            role: ENTRY, STOPLOSS or target_role(number)
+            order: Binance order response (orderId, clientOrderId, status)
+            status: Status overriding the one in `order`
+        """
+        order = order or {}
+        row = {
+            'signal': signal_id,
+            'account': account_name,
+            'role': role,
+            'order_id': order.get('orderId'),
+            'client_order_id': order.get('clientOrderId'),
+            'status': status or order.get('status'),
+            'updated_at': datetime.datetime.now(),
+        }
+        with self._lock:
+            # a later write of the same order replaces the pending one
+            self._pending[(signal_id, account_name, role)] = row
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self.flush()
+
+    def get(self, signal_id: str, account_name: str, role: str) -> Optional[dict]:
+        """Latest row of an account's order, pending writes included."""
+        with self._lock:
+            row = self._pending.get((signal_id, account_name, role))
+        if row is not None:
+            return row
+        record = AccountOrders.get_or_none(
+            (AccountOrders.signal == signal_id)
+            & (AccountOrders.account == account_name)
+            & (AccountOrders.role == role)
+        )
+        if record is None:
+            return None
+        return {
+            'order_id': record.order_id,
+            'client_order_id': record.client_order_id,
+            'status': record.status,
+        }
+
+    def open_order(self, signal_id: str, account_name: str, role: str = STOPLOSS) -> Optional[dict]:
+        """
+        IDs of an account's order the bot has not seen closed.
+
+        Returns:
+            REST-shaped {'orderId', 'clientOrderId'}, None when the order
+            is unknown locally or already closed
+        """
+        row = self.get(signal_id, account_name, role)
+        if row is None or row['order_id'] is None or row['status'] in CLOSED_STATUSES:
+            return None
+        return {'orderId': row['order_id'], 'clientOrderId': row['client_order_id']}
+
+    def client_order_id(self, signal, account_name: str, role: str = STOPLOSS) -> Optional[str]:
+        """
+        Client order ID of an account's order for a signal.
+
+        Signals placed before per-account rows existed fall back to the
+        ID stored on the signal itself.
+        """
+        row = self.get(signal.id_signal, account_name, role)
+        if row is not None and row['client_order_id']:
+            return row['client_order_id']
+        return signal.client_id_stoploss if role == STOPLOSS else None
+
+    def flush(self) -> int:
+        """
+        Upsert every pending row.
+
+        Returns:
+            Number of rows written
+        """
+        with self._lock:
+            pending = dict(self._pending)
+        if not pending:
+            return 0
+
+        rows = list(pending.values())
+        for start in range(0, len(rows), CHUNK_SIZE):
+            AccountOrders.insert_many(rows[start:start + CHUNK_SIZE]).on_conflict(
+                conflict_target=[AccountOrders.signal, AccountOrders.account, AccountOrders.role],
+                preserve=[AccountOrders.order_id, AccountOrders.client_order_id,
+                          AccountOrders.status, AccountOrders.updated_at]
+            ).execute()
+
+        with self._lock:
+            # rows replaced while writing stay pending for the next flush
+            for key, row in pending.items():
+                if self._pending.get(key) is row:
+                    del self._pending[key]
+            self.flushes += 1
+            self.rows_written += len(rows)
+        logger.debug(f"Wrote {len(rows)} account orders")
+        return len(rows)
+
+
+config = configparser.ConfigParser()
+config.optionxform = str
+config.read('config/bot.ini')
+
+order_writer = OrderWriter(
+    batch_size=config.getint('ACCOUNT_ORDERS', 'batch_size', fallback=500))
@@ -0,0 +1,168 @@
+"""
+Account roster: every configured account with its assigned proxy.
+
+`[ACCOUNTS]` and `[PROXIES]` are parsed once at startup into an immutable
+tuple of `Account` records, and every fan-out iterates that tuple instead
+of re-splitting the config strings. The proxy from the roster is the
+account's home proxy; `proxy_pool` may route it elsewhere while the home
+proxy is degraded.
+
+Proxies may carry an optional capacity after a comma (`IP:PORT,3`), used
+by the `weighted` and `least_loaded` strategies. Strategies
+(`[ROSTER] strategy`):
+
+    block        - contiguous blocks of accounts per proxy (default, the
+                   historical assignment, keeps IP whitelists valid)
+    round_robin  - account i goes to proxy i % len(proxies)
+    least_loaded - each account goes to the proxy with the most free
+                   capacity left
+    weighted     - accounts are spread proportionally to capacity
+"""
+
+import configparser
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from binance_api import Binance, get_binance
+from proxy_pool import proxy_pool
+
+
+class Account:
+    """One configured account and the proxy it trades through."""
+
+    __slots__ = ('name', 'key', 'secret', 'proxy')
+
+    def __init__(self, name: str, key: str, secret: str, proxy: Optional[str]):
+        object.__setattr__(self, 'name', name)
+        object.__setattr__(self, 'key', key)
+        object.__setattr__(self, 'secret', secret)
+        object.__setattr__(self, 'proxy', proxy)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Account records are immutable")
+
+    @property
+    def current_proxy(self) -> Optional[str]:
+        """Home proxy, or a healthy replacement while it is degraded."""
+        return proxy_pool.route(self.proxy)
+
+    @property
+    def binance(self) -> Binance:
+        """Pooled client of this account, through its current proxy."""
+        return get_binance(key=self.key, secret=self.secret, proxy=self.current_proxy)
+
+    def __repr__(self) -> str:
+        return f"<Account {self.name} via {self.proxy}>"
+
+
+def parse_proxies(section) -> List[Tuple[str, float]]:
+    """
+    Parse `[PROXIES]` values of the form `IP:PORT` or `IP:PORT,capacity`.
+
+    Returns:
+        List of (proxy, capacity) tuples
+
+    Raises:
+        ValueError: A capacity is not a number greater than 0
+    """
+    proxies = []
+    for value in section.values():
+        parts = [part.strip() for part in value.split(",")]
+        capacity = float(parts[1]) if len(parts) > 1 else 1.0
+        if not capacity > 0:
+            raise ValueError(f"Proxy capacity must be greater than 0: {value}")
+        proxies.append((parts[0], capacity))
+    return proxies
+
+
+def _block(count: int, proxies: Sequence[Tuple[str, float]]) -> List[str]:
+    accounts_per_proxy = max(1, count // len(proxies))
+    return [
+        proxies[min(idx // accounts_per_proxy, len(proxies) - 1)][0]
+        for idx in range(count)
+    ]
+
+
+def _round_robin(count: int, proxies: Sequence[Tuple[str, float]]) -> List[str]:
+    return [proxies[idx % len(proxies)][0] for idx in range(count)]
+
+
+def _least_loaded(count: int, proxies: Sequence[Tuple[str, float]]) -> List[str]:
+    loads = [0] * len(proxies)
+    assignment = []
+    for _ in range(count):
+        idx = max(range(len(proxies)), key=lambda i: proxies[i][1] - loads[i])
+        loads[idx] += 1
+        assignment.append(proxies[idx][0])
+    return assignment
+
+
+def _weighted(count: int, proxies: Sequence[Tuple[str, float]]) -> List[str]:
+    loads = [0] * len(proxies)
+    assignment = []
+    for _ in range(count):
+        idx = min(range(len(proxies)), key=lambda i: (loads[i] + 1) / proxies[i][1])
+        loads[idx] += 1
+        assignment.append(proxies[idx][0])
+    return assignment
+
+
+STRATEGIES: Dict[str, Callable[[int, Sequence[Tuple[str, float]]], List[str]]] = {
+    'block': _block,
+    'round_robin': _round_robin,
+    'least_loaded': _least_loaded,
+    'weighted': _weighted,
+}
+
+
+def load_roster(config: configparser.ConfigParser) -> Tuple[Account, ...]:
+    """
+    Build the account roster from the bot config.
+
+    Args:
+        config: Parsed bot.ini
+
+    Returns:
+        Immutable tuple of accounts in config order
+    """
+    credentials = [
+        (name, *[part.strip() for part in value.split(",")])
+        for name, value in config["ACCOUNTS"].items()
+    ]
+    proxies = parse_proxies(config["PROXIES"]) if config.has_section("PROXIES") else []
+
+    strategy = config.get('ROSTER', 'strategy', fallback='block')
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Unknown roster strategy: {strategy}")
+
+    if proxies:
+        assignment = STRATEGIES[strategy](len(credentials), proxies)
+    else:
+        assignment = [None] * len(credentials)
+
+    return tuple(
+        Account(name, key, secret, proxy)
+        for (name, key, secret), proxy in zip(credentials, assignment)
+    )
+
+
+def roster_jobs(accounts: Sequence[Account], *args) -> List[tuple]:
+    """
+    Build fan-out jobs that call `job(account, *args)` for every account.
+
+    Returns:
+        (account_name, proxy, args) tuples for FanOut.submit/run
+    """
+    return [
+        (account.name, account.current_proxy, [account, *args])
+        for account in accounts
+    ]
+
+
+config = configparser.ConfigParser()
+config.optionxform = str
+config.read('config/bot.ini')
+
+roster = load_roster(config) if config.has_section("ACCOUNTS") else ()
+
+if config.has_section("PROXIES"):
+    proxy_pool.add(proxy for proxy, _ in parse_proxies(config["PROXIES"]))
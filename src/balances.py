@@ -0,0 +1,163 @@
+"""
+USDT wallet balance of every account, kept in memory for position sizing.
+
+Balances are pushed by ACCOUNT_UPDATE events of user data streams and
+reconciled for every account over REST on a schedule, so sizing a "Max"
+or "%" signal is an in-memory computation. A balance older than
+`max_age` is read through REST once before it is used.
+"""
+
+import configparser
+import logging
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from accounts import roster_jobs
+
+logger = logging.getLogger(__name__)
+
+STREAM = 'stream'
+REST = 'rest'
+FALLBACK = 'fallback'
+
+
+class BalanceCache:
+    """
+    Latest balance of every account plus staleness metrics.
+
+    Args:
+        max_age: Seconds a balance may be used for sizing without a REST read
+    """
+
+    def __init__(self, max_age: float = 300.0):
+        self.max_age = max_age
+        # account name -> (balance, monotonic time of the update, source)
+        self._balances: Dict[str, Tuple[float, float, str]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.updates = {STREAM: 0, REST: 0, FALLBACK: 0}
+        self.max_drift = 0.0
+
+    def update(self, account_name: str, balance: float, source: str = REST) -> None:
+        with self._lock:
+            previous = self._balances.get(account_name)
+            if source == REST and previous is not None:
+                # how far the cached value was off when REST caught up
+                self.max_drift = max(self.max_drift, abs(balance - previous[0]))
+            self._balances[account_name] = (balance, time.monotonic(), source)
+            self.updates[source] += 1
+
+    def age(self, account_name: str) -> Optional[float]:
+        entry = self._balances.get(account_name)
+        if entry is None:
+            return None
+        return time.monotonic() - entry[1]
+
+    def _read_fallback(self, account) -> float:
+        balance = account.binance.get_balance()
+        self.update(account.name, balance, FALLBACK)
+        return balance
+
+    def is_fresh(self, account_name: str) -> bool:
+        age = self.age(account_name)
+        return age is not None and age <= self.max_age
+
+    def get_many(self, accounts, fan_out) -> List[float]:
+        """
+        Balances of many accounts for sizing.
+
+        Missing or stale balances are read concurrently through `fan_out`
+        first; accounts whose balance cannot be read get 0.
+
+        Args:
+            accounts: Account records
+            fan_out: FanOut used for the REST reads
+
+        Returns:
+            USDT balance per account, in the order of `accounts`
+        """
+        stale = [account for account in accounts if not self.is_fresh(account.name)]
+        self.hits += len(accounts) - len(stale)
+        self.misses += len(stale)
+        if stale:
+            report = fan_out.run(self._read_fallback, roster_jobs(stale))
+            for result in report.failed:
+                logger.warning(f"Balance of {result.account_name} unavailable: {result.error}")
+
+        balances = []
+        for account in accounts:
+            entry = self._balances.get(account.name)
+            balances.append(entry[0] if entry is not None else 0.0)
+        return balances
+
+    def on_account_update(self, account_name: str, update: dict) -> None:
+        """
+        Apply the `a` payload of an ACCOUNT_UPDATE event.
+
+        Args:
+            account_name: Account the stream belongs to
+            update: Payload with the changed balances under `B`
+        """
+        for balance in update.get('B', []):
+            if balance['a'] == 'USDT':
+                self.update(account_name, float(balance['wb']), STREAM)
+
+    def refresh(self, account) -> float:
+        """Read the balance of one account over REST (reconciliation job)."""
+        balance = account.binance.get_balance()
+        self.update(account.name, balance, REST)
+        return balance
+
+    def stats(self, account_names: Iterable[str] = ()) -> dict:
+        """
+        Staleness metrics.
+
+        Args:
+            account_names: Accounts expected in the cache, missing ones
+                are counted
+
+        Returns:
+            Dict of counts and ages in seconds
+        """
+        now = time.monotonic()
+        with self._lock:
+            ages = sorted(now - entry[1] for entry in self._balances.values())
+            known = set(self._balances)
+        missing = [name for name in account_names if name not in known]
+        return {
+            'accounts': len(ages),
+            'missing': len(missing),
+            'stale': sum(1 for age in ages if age > self.max_age),
+            'median_age': ages[len(ages) // 2] if ages else None,
+            'max_age': ages[-1] if ages else None,
+            'hits': self.hits,
+            'misses': self.misses,
+            'stream_updates': self.updates[STREAM],
+            'rest_updates': self.updates[REST],
+            'fallback_updates': self.updates[FALLBACK],
+            'max_drift': self.max_drift,
+        }
+
+    def summary(self, account_names: Iterable[str] = ()) -> str:
+        stats = self.stats(account_names)
+        if not stats['accounts']:
+            return f"No balances cached yet ({stats['missing']} accounts missing)"
+        return (
+            f"Balances cached: {stats['accounts']} "
+            f"(missing {stats['missing']}, stale {stats['stale']})\n"
+            f"Age: median {stats['median_age']:.0f}s, max {stats['max_age']:.0f}s\n"
+            f"Sizing reads: {stats['hits']} cached, {stats['misses']} REST\n"
+            f"Updates: {stats['stream_updates']} stream, {stats['rest_updates']} "
+            f"reconcile, {stats['fallback_updates']} fallback\n"
+            f"Max reconcile drift: {stats['max_drift']:.2f} USDT"
+        )
+
+
+config = configparser.ConfigParser()
+config.optionxform = str
+config.read('config/bot.ini')
+
+balance_cache = BalanceCache(
+    max_age=config.getfloat('BALANCES', 'max_age', fallback=300.0))
@@ -5,9 +5,31 @@ from lib2to3.pygram import Symbols
 # from binance.futures import Futures as Client
 from binance.um_futures import UMFutures as Client
 import logging
-from binance.lib.utils import config_logging
+from binance.lib.utils import config_logging, get_timestamp
 from binance.error import ClientError
 import decimal
+from fanout import LANES
+from market import price_feed, symbol_cache
+from proxy_pool import proxy_pool
+from rate_limit import rate_limiter
+from signing import OrderTemplate, RequestSigner
+from tracing import NETWORK, SIGNING, span
+import threading
+import time
+import configparser
+import requests
+
+
+# futures batchOrders accepts at most 5 orders per request
+BATCH_ORDERS_LIMIT = 5
+
+config = configparser.ConfigParser()
+config.optionxform = str
+config.read('config/bot.ini')
+
+# kept-alive connections per proxy, one per fan-out job in flight: every
+# lane runs up to max_per_proxy jobs through a proxy at the same time
+POOL_SIZE = len(LANES) * config.getint('EXECUTION', 'max_per_proxy', fallback=20)
 
 
 class Order():
@@ -21,6 +43,9 @@ class Order():
     TYPE_TRAILING_STOP_MARKET = 'TRAILING_STOP_MARKET'
     TYPE_MARKET = 'MARKET'
 
+    # trigger on the mark price, the price STOP/TAKE_PROFIT are chosen by
+    WORKING_MARK_PRICE = 'MARK_PRICE'
+
 
 class Binance():
 
@@ -34,10 +59,51 @@ class Binance():
             self.client = Client(base_url=base_url)
         else:
             base_url = None
-            self.client = Client(key, secret, proxies=proxies)
+            self.client = Client(key, secret, proxies=proxies,
+                                 timeout=proxy_pool.request_timeout,
+                                 show_limit_usage=True)
+
+        # HMAC keyed once instead of on every signed request
+        self.signer = None
+        if secret:
+            self.signer = RequestSigner(secret)
+            self.client._get_sign = self.signer.sign
+
+        # every REST call waits for the rate limiter and reports its
+        # latency and outcome to the proxy pool
+        self.proxy = proxy
+        self._send_request = self.client.send_request
+        self.client.send_request = self._timed_request
 
         self.order = Order()
 
+    def _timed_request(self, http_method, url_path, payload=None, special=False):
+        rate_limiter.acquire(self.proxy, self.client.key, http_method, url_path, payload)
+
+        start_time = time.perf_counter()
+        try:
+            response = self._send_request(http_method, url_path, payload, special)
+        except ClientError as error:
+            elapsed = time.perf_counter() - start_time
+            if error.status_code in (429, 418):
+                retry_after = (error.header or {}).get('Retry-After')
+                retry_after = float(retry_after) if retry_after else None
+                proxy_pool.record(self.proxy, elapsed, error, error.status_code, retry_after)
+                rate_limiter.penalize(self.proxy, retry_after or proxy_pool.ban_seconds)
+            else:
+                # other 4xx answers are about the request, not the proxy
+                proxy_pool.record(self.proxy, elapsed)
+            raise
+        except Exception as error:
+            proxy_pool.record(self.proxy, time.perf_counter() - start_time, error)
+            raise
+        proxy_pool.record(self.proxy, time.perf_counter() - start_time)
+
+        if self.client.show_limit_usage:
+            rate_limiter.update(self.proxy, self.client.key, response['limit_usage'])
+            return response['data']
+        return response
+
     def get_balance(self):
         response = self.client.balance()
         for asset in response:
@@ -45,18 +111,11 @@ class Binance():
                 balance = asset['balance']
         return float(balance)
 
-    def min_amount_trade(self, symbol):
-        response = self.client.exchange_info()
-
-        # Get all symbols
-        symbols = response['symbols']
-        # Get one symbol
-        symbol = [_symbol for _symbol in symbols if _symbol['symbol'] == symbol][0]
-        # Choose LOT_SIZE filter and get stepSize
-        step_size = [_filter for _filter in symbol['filters']
-                     if _filter['filterType'] == 'LOT_SIZE'][0]['stepSize']
+    def can_trade(self):
+        return bool(self.client.futures_account_configuration()['canTrade'])
 
-        return float(step_size)
+    def min_amount_trade(self, symbol):
+        return symbol_cache.get(symbol, self.client).step_size
 
     def min_amount_trade_usdt(self, symbol):
         min_amount_trade = self.min_amount_trade(symbol)
@@ -65,6 +124,30 @@ class Binance():
         return price*min_amount_trade
 
     def get_order(self, symbol, ClientOrderId):
+        if not ClientOrderId:
+            return None
+        try:
+            # single-order endpoint (weight 1) instead of allOrders (weight 5)
+            return self.client.query_order(
+                symbol=symbol,
+                origClientOrderId=ClientOrderId)
+        except ClientError as error:
+            # -2013: order does not exist. Binance drops canceled/expired
+            # orders without fills from this endpoint after a few days, so
+            # fall back to the order history before giving up.
+            if error.error_code != -2013:
+                raise
+        return self.get_order_from_history(symbol, ClientOrderId)
+
+    def get_open_orders(self, symbol):
+        """Open orders of one symbol (weight 1)."""
+        return self.client.get_orders(symbol=symbol)
+
+    def get_recent_orders(self, symbol, limit=1000):
+        """Orders of one symbol from the last 7 days, any status (weight 5)."""
+        return self.client.get_all_orders(symbol=symbol, limit=limit)
+
+    def get_order_from_history(self, symbol, ClientOrderId):
         response = self.client.get_all_orders(
             symbol=symbol,
         )
@@ -123,7 +206,7 @@ class Binance():
         return response
 
     def stoplimit_long(self, symbol, stop_price, price, size, ClientOrderId=None):
-        price_now = self.get_price(symbol)
+        price_now = price_feed.get_price(symbol, self.client)
         # choose STOP or TAKE_PROFIT type for BUY
         if price_now < stop_price:
             type = self.order.TYPE_STOP
@@ -136,6 +219,7 @@ class Binance():
             "type": type,
             "price": price,
             "stopPrice": stop_price,
+            "workingType": self.order.WORKING_MARK_PRICE,
             "quantity": size,
             "newClientOrderId": ClientOrderId
         }
@@ -144,7 +228,7 @@ class Binance():
         return response
 
     def stoplimit_short(self, symbol, stop_price, price, size, ClientOrderId=None):
-        price_now = self.get_price(symbol)
+        price_now = price_feed.get_price(symbol, self.client)
         # choose STOP or TAKE_PROFIT type for BUY
         if price_now > stop_price:
             type = self.order.TYPE_STOP
@@ -157,6 +241,7 @@ class Binance():
             "type": type,
             "price": price,
             "stopPrice": stop_price,
+            "workingType": self.order.WORKING_MARK_PRICE,
             "quantity": size,
             "newClientOrderId": ClientOrderId
         }
@@ -188,25 +273,58 @@ class Binance():
         response = self.client.new_order(**params)
         return response
 
-    def limit_long(self, symbol, price, size, ClientOrderId=None):
+    def entry_template(self, kind, symbol, price, ClientOrderId=None):
+        """
+        Entry order of a signal without quantity, shared by every account.
+
+        A price of 0 opens at market, any other price places a STOP or
+        TAKE_PROFIT order like stoplimit_long/stoplimit_short, chosen by
+        and triggered on the mark price.
+        """
+        side = self.order.BUY if kind == "long" else self.order.SELL
+        if price == 0:
+            params = {
+                "symbol": symbol,
+                "side": side,
+                "type": self.order.TYPE_MARKET,
+                "newClientOrderId": ClientOrderId
+            }
+            return OrderTemplate(params)
+
+        price_now = price_feed.get_price(symbol, self.client)
+        if side == self.order.BUY:
+            triggers_above = price_now < price
+        else:
+            triggers_above = price_now > price
+        if triggers_above:
+            type = self.order.TYPE_STOP
+        else:
+            type = self.order.TYPE_TAKE_PROFIT
+
         params = {
             "symbol": symbol,
-            "side": self.order.BUY,
-            "type": self.order.TYPE_LIMIT,
+            "side": side,
+            "type": type,
             "price": price,
-            "reduceOnly": "true",
-            "timeInForce": "GTC",
-            "quantity": size,
+            "stopPrice": price,
+            "workingType": self.order.WORKING_MARK_PRICE,
             "newClientOrderId": ClientOrderId
         }
-
-        response = self.client.new_order(**params)
-        return response
-
-    def limit_short(self, symbol, price, size, ClientOrderId=None):
+        return OrderTemplate(params)
+
+    def new_order_from_template(self, template, size):
+        """Send an order template with this account's quantity, signed here."""
+        with span(SIGNING):
+            query = template.query(quantity=size, timestamp=get_timestamp())
+            url_path = ("/fapi/v1/order?" + query
+                        + "&signature=" + self.signer.sign(query))
+        with span(NETWORK):
+            return self.client.send_request("POST", url_path)
+
+    def limit_params(self, side, symbol, price, size, ClientOrderId=None):
         params = {
             "symbol": symbol,
-            "side": self.order.SELL,
+            "side": side,
             "type": self.order.TYPE_LIMIT,
             "price": price,
             "reduceOnly": "true",
@@ -214,14 +332,26 @@ class Binance():
             "quantity": size,
             "newClientOrderId": ClientOrderId
         }
+        return params
+
+    def limit_long(self, symbol, price, size, ClientOrderId=None):
+        params = self.limit_params(
+            self.order.BUY, symbol, price, size, ClientOrderId)
 
         response = self.client.new_order(**params)
         return response
 
-    def stoploss_long(self, symbol, stop_price, ClientOrderId=None):
+    def limit_short(self, symbol, price, size, ClientOrderId=None):
+        params = self.limit_params(
+            self.order.SELL, symbol, price, size, ClientOrderId)
+
+        response = self.client.new_order(**params)
+        return response
+
+    def stoploss_params(self, side, symbol, stop_price, ClientOrderId=None):
         params = {
             "symbol": symbol,
-            "side": self.order.BUY,
+            "side": side,
             "type": self.order.TYPE_STOP_MARKET,
             "stopPrice": stop_price,
             "timeInForce": "GTC",
@@ -229,25 +359,42 @@ class Binance():
             "priceProtect": 'true',
             "newClientOrderId": ClientOrderId
         }
+        return params
+
+    def stoploss_long(self, symbol, stop_price, ClientOrderId=None):
+        params = self.stoploss_params(
+            self.order.BUY, symbol, stop_price, ClientOrderId)
 
         response = self.client.new_order(**params)
         return response
 
     def stoploss_short(self, symbol, stop_price, ClientOrderId=None):
-        params = {
-            "symbol": symbol,
-            "side": self.order.SELL,
-            "type": self.order.TYPE_STOP_MARKET,
-            "stopPrice": stop_price,
-            "timeInForce": "GTC",
-            "closePosition": 'true',
-            "priceProtect": 'true',
-            "newClientOrderId": ClientOrderId
-        }
+        params = self.stoploss_params(
+            self.order.SELL, symbol, stop_price, ClientOrderId)
 
         response = self.client.new_order(**params)
         return response
 
+    def batch_orders(self, orders):
+        # One response per order, in order: either the order itself or
+        # {"code": ..., "msg": ...} when that single order was rejected or
+        # its whole request failed (network, signature, timestamp errors),
+        # so the orders of the other requests are still reported.
+        responses = []
+        for i in range(0, len(orders), BATCH_ORDERS_LIMIT):
+            batch = [
+                {key: str(value) for key, value in order.items() if value is not None}
+                for order in orders[i:i + BATCH_ORDERS_LIMIT]
+            ]
+            try:
+                responses.extend(self.client.new_batch_order(batchOrders=batch))
+            except ClientError as error:
+                responses.extend(
+                    {'code': error.error_code, 'msg': error.error_message} for _ in batch)
+            except Exception as error:
+                responses.extend({'code': None, 'msg': repr(error)} for _ in batch)
+        return responses
+
     def trailing_stop_long(self, symbol, activation_price, size):
         params = {
             "symbol": symbol,
@@ -277,25 +424,13 @@ class Binance():
         return response
 
     def get_decimal_coin(self, symbol):
-        response = self.client.historical_trades(symbol=symbol, limit=1)
-        # print(response)
-        qty = response[0]['qty']
-
-        # if not decimal
-        if float(qty) % 1 == 0.0:
-            qty = int(float(qty))
-
-        _decimal = decimal.Decimal(str(qty)).as_tuple().exponent
-
-        return abs(_decimal)
+        return symbol_cache.get(symbol, self.client).quantity_precision
 
     def get_decimal_coin_price(self, symbol):
-        response = self.client.historical_trades(symbol=symbol, limit=1)
-        qty = float(response[0]['price'])
-
-        _decimal = decimal.Decimal(str(qty)).as_tuple().exponent
+        return symbol_cache.get(symbol, self.client).price_precision
 
-        return abs(_decimal)
+    def get_min_notional(self, symbol):
+        return symbol_cache.get(symbol, self.client).min_notional
 
     def get_position(self, symbol):
         response = self.client.get_position_risk(symbol=symbol)
@@ -337,7 +472,166 @@ class Binance():
         return req
 
 
+# Long-lived clients, one per account/proxy pair. Each UMFutures client owns
+# a requests.Session for its API key header; the sessions of one proxy share
+# one HTTPAdapter, so keep-alive connections (and the TLS handshakes through
+# the proxy) are pooled per proxy and survive between jobs.
+_clients = {}
+_adapters = {}
+_clients_lock = threading.Lock()
+
+
+def get_binance(key: str = "", secret: str = "", proxy: str = None) -> Binance:
+    client_key = (key, proxy)
+    binance = _clients.get(client_key)
+    if binance is not None:
+        return binance
+
+    with _clients_lock:
+        binance = _clients.get(client_key)
+        if binance is None:
+            binance = Binance(key=key, secret=secret, proxy=proxy)
+            adapter = _adapters.get(proxy)
+            if adapter is None:
+                # as many kept-alive connections as jobs in flight per proxy
+                adapter = _adapters[proxy] = requests.adapters.HTTPAdapter(
+                    pool_maxsize=POOL_SIZE)
+            binance.client.session.mount('https://', adapter)
+            _clients[client_key] = binance
+    return binance
+
+
+def keep_alive_clients(accounts=()):
+    """
+    Ping Binance once per proxy so its pooled connections are not dropped.
+
+    Clients left on a proxy that failover no longer routes their account
+    through are dropped first; direct (proxy-less) clients are kept.
+
+    Args:
+        accounts: Roster, for the proxy every account is routed through
+    """
+    routes = {account.key: account.current_proxy for account in accounts}
+    with _clients_lock:
+        for key, proxy in list(_clients):
+            if proxy is not None and key in routes and routes[key] != proxy:
+                del _clients[(key, proxy)]
+        # one unsigned ping keeps the shared pool of a proxy warm
+        per_proxy = {}
+        for (_, proxy), binance in _clients.items():
+            per_proxy.setdefault(proxy, binance)
+
+    for proxy, binance in per_proxy.items():
+        try:
+            binance.client.ping()
+        except Exception as e:
+            logging.warning(f"Keep-alive ping via {proxy} failed: {e}")
+
+
+# Local fake exchange for comparing order lookups without network access:
+#
+#     python src/binance_api.py [history] [lookups]
+
+class _FakeResponse:
+    def __init__(self, body, status_code=200, headers=None):
+        self.text = body
+        self.status_code = status_code
+        self.headers = headers or {}
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class _FakeExchange:
+    """
+    Stand-in for the connector's requests.Session, answering the order
+    endpoints from an in-memory history and counting request weight.
+
+    Args:
+        history: Orders per symbol
+        pruned: Share of orders the single-order endpoint no longer knows
+    """
+
+    def __init__(self, history: int = 1000, pruned: float = 0.05):
+        from rate_limit import endpoint_cost
+        self._cost = endpoint_cost
+        self.orders = [{
+            'orderId': i, 'clientOrderId': f"C{i:021d}", 'symbol': 'BTCUSDT',
+            'status': 'FILLED', 'origQty': '0.010', 'executedQty': '0.010',
+            'avgPrice': '30000.0', 'type': 'LIMIT', 'side': 'BUY', 'updateTime': i,
+        } for i in range(history)]
+        self._by_client_id = {
+            order['clientOrderId']: json.dumps(order)
+            for order in self.orders[int(history * pruned):]
+        }
+        # serialized once, the benchmark measures the client side
+        self._history = json.dumps(self.orders)
+        self.weight = 0
+        self.requests = 0
+        self.bytes = 0
+
+    def _answer(self, method, url, params=None, **kwargs):
+        from urllib.parse import parse_qs, urlparse
+        path = urlparse(url).path
+        query = {key: values[0] for key, values in parse_qs(params or '').items()}
+        self.weight += self._cost(method, path, query)[0]
+        self.requests += 1
+        headers = {'x-mbx-used-weight-1m': str(self.weight)}
+
+        if path == '/fapi/v1/order':
+            body = self._by_client_id.get(query.get('origClientOrderId'))
+            if body is None:
+                return _FakeResponse(
+                    '{"code": -2013, "msg": "Order does not exist."}', 400, headers)
+        elif path == '/fapi/v1/allOrders':
+            body = self._history
+        else:
+            body = '{}'
+        self.bytes += len(body)
+        return _FakeResponse(body, 200, headers)
+
+    def get(self, url, **kwargs):
+        return self._answer('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self._answer('POST', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self._answer('PUT', url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self._answer('DELETE', url, **kwargs)
+
+
+def _benchmark(history: int = 1000, lookups: int = 200) -> None:
+    import random
+
+    def measure(name, lookup):
+        exchange = _FakeExchange(history)
+        binance = Binance(key='bench', secret='bench', proxy=f'bench-{name}')
+        binance.client.session = exchange
+        client_ids = [order['clientOrderId'] for order in exchange.orders]
+        start_time = time.perf_counter()
+        for _ in range(lookups):
+            assert lookup(binance, 'BTCUSDT', random.choice(client_ids)) is not None
+        elapsed = (time.perf_counter() - start_time) / lookups
+        print(
+            f"{name:>7}: weight {exchange.weight:5d} ({exchange.weight / lookups:.2f}/lookup), "
+            f"{exchange.requests} requests, {exchange.bytes / lookups / 1024:7.1f} KiB "
+            f"and {elapsed * 1000:6.3f} ms per lookup"
+        )
+
+    print(f"{lookups} lookups, {history} orders in the symbol's history")
+    measure('history', Binance.get_order_from_history)
+    measure('single', Binance.get_order)
+
+
+if __name__ == "__main__":
+    import sys
+    _benchmark(*(int(arg) for arg in sys.argv[1:3]))
+
+
 # Example usage:
-# binance = Binance(key="your_api_key", secret="your_secret", proxy="http://proxy:port")
+# binance = get_binance(key="your_api_key", secret="your_secret", proxy="proxy:port")
 # balance = binance.get_balance()
 # print(balance)
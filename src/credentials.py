@@ -0,0 +1,79 @@
+"""
+Startup credential checks cached on disk.
+
+A restart skips accounts that were verified within the configured window,
+so only new, changed or recently failing accounts hit Binance before the
+bot starts. Entries are keyed by account name and a hash of its API key,
+so rotating a key forces a new check. Secrets are never written.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def _fingerprint(key: str) -> str:
+    return hashlib.sha256(key.encode()).hexdigest()[:16]
+
+
+class CredentialCache:
+    """
+    JSON file of the last successful verification of every account.
+
+    Args:
+        path: Cache file
+        window: Seconds a successful verification stays valid, 0 disables
+    """
+
+    def __init__(self, path: str, window: float):
+        self.path = path
+        self.window = window
+        self._entries: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def load(self) -> None:
+        try:
+            with open(self.path) as file:
+                self._entries = json.load(file)
+        except FileNotFoundError:
+            self._entries = {}
+        except ValueError as e:
+            logger.warning(f"Ignoring unreadable credential cache {self.path}: {e}")
+            self._entries = {}
+
+    def save(self) -> None:
+        with self._lock:
+            data = json.dumps(self._entries, indent=2, sort_keys=True)
+        # write then rename so a crash never leaves a half-written cache
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as file:
+            file.write(data)
+        os.replace(tmp_path, self.path)
+
+    def get(self, account) -> Optional[dict]:
+        """Cached verification of an account, None if missing, stale or for another key."""
+        entry = self._entries.get(account.name)
+        if entry is None or entry.get('key') != _fingerprint(account.key):
+            return None
+        if time.time() - entry.get('verified_at', 0) > self.window:
+            return None
+        return entry
+
+    def store(self, account, balance: float, can_trade: bool) -> None:
+        with self._lock:
+            self._entries[account.name] = {
+                'key': _fingerprint(account.key),
+                'balance': balance,
+                'can_trade': can_trade,
+                'verified_at': time.time(),
+            }
+
+    def forget(self, account) -> None:
+        with self._lock:
+            self._entries.pop(account.name, None)
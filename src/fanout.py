@@ -0,0 +1,267 @@
+"""
+Concurrent per-account fan-out engine.
+
+Sends one job per account at the same time instead of queueing them on
+the scheduler's small default thread pool. Every proxy gets its own
+concurrency cap so a single proxy is never flooded, and every account
+gets a structured result so the full fan-out can be inspected.
+"""
+
+import collections
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError, as_completed
+from typing import (
+    Any, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+)
+
+logger = logging.getLogger(__name__)
+
+# lanes of the bot process, one FanOut each (see scheduling)
+ORDERS = 'orders'
+FILLS = 'fills'
+REPORTS = 'reports'
+LANES = (ORDERS, FILLS, REPORTS)
+
+
+class AccountResult:
+    """Outcome of one job on one account."""
+
+    def __init__(
+        self,
+        account_name: str,
+        proxy: Optional[str],
+        value: Any = None,
+        error: Optional[BaseException] = None,
+        elapsed: float = 0.0
+    ):
+        self.account_name = account_name
+        self.proxy = proxy
+        self.value = value
+        self.error = error
+        self.elapsed = elapsed
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def __repr__(self) -> str:
+        state = "ok" if self.ok else f"error={self.error!r}"
+        return f"<AccountResult {self.account_name} {state} {self.elapsed:.3f}s>"
+
+
+class FanOutReport:
+    """Per-account results of a fan-out plus its wall time."""
+
+    def __init__(self, results: List[AccountResult], wall_time: float):
+        self.results = results
+        self.wall_time = wall_time
+
+    @property
+    def succeeded(self) -> List[AccountResult]:
+        return [result for result in self.results if result.ok]
+
+    @property
+    def failed(self) -> List[AccountResult]:
+        return [result for result in self.results if not result.ok]
+
+    def summary(self) -> str:
+        return (
+            f"{len(self.succeeded)}/{len(self.results)} accounts succeeded "
+            f"in {self.wall_time:.2f}s"
+        )
+
+
+class ResultCollector:
+    """
+    Thread-safe record buffer of one fan-out operation, keyed by account.
+
+    Each operation owns its collector, so concurrent operations never
+    share state. Records are rendered only once the caller is done.
+
+    Args:
+        account_names: Expected accounts, fixes the order of records()
+    """
+
+    def __init__(self, account_names: Iterable[str] = ()):
+        self._order = {name: idx for idx, name in enumerate(account_names)}
+        self._records: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def add(self, account_name: str, record: Any) -> None:
+        with self._lock:
+            self._records[account_name] = record
+
+    def records(self) -> List[Any]:
+        """Records in the order of `account_names`, unknown accounts last."""
+        with self._lock:
+            items = list(self._records.items())
+        items.sort(key=lambda item: self._order.get(item[0], len(self._order)))
+        return [record for _, record in items]
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+
+class FanOut:
+    """
+    Run a job for many accounts concurrently.
+
+    Jobs wait in a queue per proxy and only get a pool thread once their
+    proxy has a free slot, so a saturated proxy never holds threads that
+    accounts on idle proxies could use.
+
+    Args:
+        max_workers: Maximum number of jobs in flight overall
+        max_per_proxy: Maximum number of jobs in flight through one proxy
+        after_job: Called on the worker thread after every job, e.g. to
+            return its database connection to the pool
+    """
+
+    def __init__(
+        self,
+        max_workers: int = 200,
+        max_per_proxy: int = 20,
+        after_job: Optional[Callable[[], None]] = None
+    ):
+        self.max_per_proxy = max_per_proxy
+        self.after_job = after_job
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="fanout"
+        )
+        # proxy -> jobs waiting for a slot, and jobs in flight per proxy
+        self._queues: Dict[Optional[str], Deque[tuple]] = {}
+        self._in_flight: Dict[Optional[str], int] = {}
+        self._lock = threading.Lock()
+
+    def _dispatch(self, proxy: Optional[str]) -> None:
+        # hand queued jobs of a proxy to the pool while it has free slots
+        while True:
+            with self._lock:
+                queue = self._queues.get(proxy)
+                if not queue or self._in_flight.get(proxy, 0) >= self.max_per_proxy:
+                    return
+                future, fn, account_name, args = queue.popleft()
+                if not future.set_running_or_notify_cancel():
+                    # canceled (timed out) while still queued
+                    continue
+                self._in_flight[proxy] = self._in_flight.get(proxy, 0) + 1
+            self._executor.submit(self._run_one, future, fn, account_name, proxy, args)
+
+    def _run_one(
+        self,
+        future: Future,
+        fn: Callable,
+        account_name: str,
+        proxy: Optional[str],
+        args: Sequence
+    ) -> None:
+        start_time = time.perf_counter()
+        value = error = None
+        try:
+            value = fn(*args)
+        except Exception as e:
+            error = e
+        except BaseException as e:
+            # SystemExit and the like: resolve the future, then let it through
+            future.set_exception(e)
+            raise
+        finally:
+            if self.after_job is not None:
+                try:
+                    self.after_job()
+                except Exception as e:
+                    logger.warning(f"After-job hook failed on {account_name}: {e}")
+            elapsed = time.perf_counter() - start_time
+
+            # free the slot first so the proxy's next job starts right away,
+            # also when the job did not return
+            with self._lock:
+                self._in_flight[proxy] -= 1
+            self._dispatch(proxy)
+
+        if error is not None:
+            logger.debug(f"Fan-out job failed on {account_name}: {error}")
+        future.set_result(AccountResult(account_name, proxy, value, error, elapsed))
+
+    def submit(
+        self,
+        fn: Callable,
+        jobs: Iterable[Tuple[str, Optional[str], Sequence]]
+    ) -> Dict[Future, Tuple[str, Optional[str]]]:
+        """
+        Queue `fn` once per job without waiting.
+
+        Args:
+            fn: Job function, called as fn(*args)
+            jobs: (account_name, proxy, args) for every account
+
+        Returns:
+            Futures of AccountResult, mapped to their (account_name, proxy)
+        """
+        futures = {}
+        proxies = set()
+        with self._lock:
+            for account_name, proxy, args in jobs:
+                future = Future()
+                futures[future] = (account_name, proxy)
+                self._queues.setdefault(proxy, collections.deque()).append(
+                    (future, fn, account_name, args))
+                proxies.add(proxy)
+        for proxy in proxies:
+            self._dispatch(proxy)
+        return futures
+
+    def iter_results(
+        self,
+        futures: Dict[Future, Tuple[str, Optional[str]]],
+        timeout: Optional[float] = None
+    ) -> Iterator[AccountResult]:
+        """
+        Yield results as accounts finish, without busy-waiting.
+
+        Accounts still running when `timeout` expires are yielded as
+        failed results carrying a TimeoutError, so one hung proxy cannot
+        block the caller.
+
+        Args:
+            futures: Futures returned by submit()
+            timeout: Seconds to wait for the whole fan-out, None to wait forever
+        """
+        pending = set(futures)
+        try:
+            for future in as_completed(futures, timeout=timeout):
+                pending.discard(future)
+                yield future.result()
+        except TimeoutError:
+            for future in pending:
+                future.cancel()
+                account_name, proxy = futures[future]
+                logger.warning(f"Fan-out job timed out on {account_name}")
+                yield AccountResult(
+                    account_name, proxy,
+                    error=TimeoutError(f"no answer within {timeout}s"),
+                    elapsed=timeout
+                )
+
+    def run(
+        self,
+        fn: Callable,
+        jobs: Iterable[Tuple[str, Optional[str], Sequence]],
+        timeout: Optional[float] = None
+    ) -> FanOutReport:
+        """
+        Run `fn` once per job and wait for all of them.
+
+        Args:
+            fn: Job function, called as fn(*args)
+            jobs: (account_name, proxy, args) for every account
+            timeout: Seconds to wait for the whole fan-out, None to wait forever
+
+        Returns:
+            Report with one AccountResult per job, in completion order
+        """
+        start_time = time.perf_counter()
+        results = list(self.iter_results(self.submit(fn, jobs), timeout))
+        return FanOutReport(results, time.perf_counter() - start_time)
@@ -0,0 +1,193 @@
+"""
+Leverage and margin type already applied on Binance, per account/symbol.
+
+`job_open_order` used to send `marginType` and `leverage` requests for
+every account on every signal. The state Binance already has is kept in
+memory and in the `AccountSymbolSettings` table, so those requests are
+only sent when something changes, and symbols that are likely to be
+traded next are prepared in the background.
+
+Shard workers never open the database: their cache starts from a snapshot
+of the bot process's state and journals its changes, which the bot
+process applies to its own cache and writes. `models` is therefore only
+imported by the methods that run in the bot process.
+"""
+
+import configparser
+import datetime
+import logging
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from binance.error import ClientError
+
+logger = logging.getLogger(__name__)
+
+# Binance: "No need to change margin type."
+MARGIN_TYPE_UNCHANGED = -4046
+
+# (account, symbol, (leverage, margin type)), None state for a forgotten one
+Change = Tuple[str, str, Optional[Tuple[Optional[int], Optional[str]]]]
+
+
+class LeverageCache:
+    """
+    Applied (leverage, margin type) of every account/symbol.
+
+    Args:
+        margin_type: Margin type every position uses
+        persist: Write changes to the database, False to keep them for
+            drain_changes() instead
+    """
+
+    def __init__(self, margin_type: str = "CROSSED", persist: bool = True):
+        self.margin_type = margin_type
+        self.persist = persist
+        self._state: Dict[Tuple[str, str], Tuple[Optional[int], Optional[str]]] = {}
+        self._changes: List[Change] = []
+        self._lock = threading.Lock()
+
+    def load(self, state: Optional[dict] = None) -> None:
+        """
+        Read the state persisted by previous runs.
+
+        Args:
+            state: Snapshot to start from instead of the database
+        """
+        if state is None:
+            from models import INSTANCE, AccountSymbolSettings
+            state = {
+                (row.account, row.symbol): (row.leverage, row.margin_type)
+                for row in AccountSymbolSettings.select().where(
+                    AccountSymbolSettings.instance == INSTANCE)
+            }
+        with self._lock:
+            self._state = dict(state)
+        logger.info(f"Loaded leverage settings for {len(state)} account/symbols")
+
+    def snapshot(self, account_names: Iterable[str]) -> dict:
+        """State of some accounts, to hand to a shard worker."""
+        names = set(account_names)
+        with self._lock:
+            return {key: value for key, value in self._state.items() if key[0] in names}
+
+    def get(self, account_name: str, symbol: str) -> Tuple[Optional[int], Optional[str]]:
+        return self._state.get((account_name, symbol), (None, None))
+
+    def _store(self, account_name: str, symbol: str,
+               leverage: Optional[int], margin_type: Optional[str]) -> None:
+        with self._lock:
+            self._state[(account_name, symbol)] = (leverage, margin_type)
+            if not self.persist:
+                self._changes.append((account_name, symbol, (leverage, margin_type)))
+                return
+        from models import INSTANCE, AccountSymbolSettings
+        AccountSymbolSettings.insert(
+            instance=INSTANCE, account=account_name, symbol=symbol, leverage=leverage,
+            margin_type=margin_type, updated_at=datetime.datetime.now()
+        ).on_conflict(
+            conflict_target=[AccountSymbolSettings.instance, AccountSymbolSettings.account,
+                             AccountSymbolSettings.symbol],
+            preserve=[AccountSymbolSettings.leverage, AccountSymbolSettings.margin_type,
+                      AccountSymbolSettings.updated_at]
+        ).execute()
+
+    def ensure(self, account, symbol: str, leverage: Optional[int] = None) -> bool:
+        """
+        Apply margin type and leverage of a symbol, skipping what is already set.
+
+        Args:
+            account: Account to configure
+            symbol: Trading pair symbol
+            leverage: Leverage to apply, None to only apply the margin type
+
+        Returns:
+            True if a request had to be sent
+        """
+        state = self.get(account.name, symbol)
+        current_leverage, current_margin_type = state
+        if current_margin_type == self.margin_type and leverage in (None, current_leverage):
+            return False
+
+        binance = account.binance
+        if current_margin_type != self.margin_type:
+            try:
+                binance.change_margin_type(symbol, self.margin_type)
+                current_margin_type = self.margin_type
+            except ClientError as error:
+                if error.error_code == MARGIN_TYPE_UNCHANGED:
+                    current_margin_type = self.margin_type
+                # otherwise the margin type might be locked by an open
+                # position, try again next time
+
+        if leverage is not None and leverage != current_leverage:
+            binance.set_leverage(symbol, leverage)
+            current_leverage = leverage
+
+        if (current_leverage, current_margin_type) != state:
+            self._store(account.name, symbol, current_leverage, current_margin_type)
+        return True
+
+    def update_leverage(self, account_name: str, symbol: str, leverage: int) -> None:
+        """Record a leverage change reported by Binance (ACCOUNT_CONFIG_UPDATE)."""
+        _, margin_type = self.get(account_name, symbol)
+        self._store(account_name, symbol, leverage, margin_type)
+
+    def invalidate(self, account_name: str, symbol: str) -> None:
+        """Forget the state of an account/symbol so it is applied again."""
+        with self._lock:
+            self._state.pop((account_name, symbol), None)
+            if not self.persist:
+                self._changes.append((account_name, symbol, None))
+                return
+        from models import INSTANCE, AccountSymbolSettings
+        AccountSymbolSettings.delete().where(
+            (AccountSymbolSettings.instance == INSTANCE)
+            & (AccountSymbolSettings.account == account_name)
+            & (AccountSymbolSettings.symbol == symbol)
+        ).execute()
+
+    def drain_changes(self) -> List[Change]:
+        """Changes made since the last call, oldest first."""
+        with self._lock:
+            changes, self._changes = self._changes, []
+        return changes
+
+    def apply(self, changes: Iterable[Change]) -> None:
+        """Take over changes a shard worker made, in order."""
+        for account_name, symbol, state in changes:
+            if state is None:
+                self.invalidate(account_name, symbol)
+            else:
+                self._store(account_name, symbol, *state)
+
+    def last_leverage(self, account_name: str, symbol: str) -> Optional[int]:
+        return self.get(account_name, symbol)[0]
+
+
+def likely_symbols(recent_signals: int, extra: Iterable[str] = ()) -> list:
+    """
+    Symbols worth preparing: configured ones plus those of recent signals.
+
+    Args:
+        recent_signals: Number of latest signals to take symbols from
+        extra: Symbols that are always prepared
+
+    Returns:
+        Unique symbols, configured ones first
+    """
+    from models import Signals
+    symbols = list(dict.fromkeys(symbol for symbol in extra if symbol))
+    query = Signals.select(Signals.symbol).order_by(Signals.id.desc()).limit(recent_signals)
+    for signal in query:
+        if signal.symbol not in symbols:
+            symbols.append(signal.symbol)
+    return symbols
+
+
+config = configparser.ConfigParser()
+config.optionxform = str
+config.read('config/bot.ini')
+
+leverage_cache = LeverageCache(
+    margin_type=config.get('LEVERAGE', 'margin_type', fallback='CROSSED'))
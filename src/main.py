@@ -21,20 +21,36 @@ import math
 import random
 import re
 import string
+import threading
 import time
 from typing import List, Tuple, Optional
 
 import coloredlogs
 import configparser
-import pytz
-from apscheduler.schedulers.background import BackgroundScheduler
+import numpy as np
 from pyrogram import Client, filters as Filters, idle
 from pyrogram.handlers import MessageHandler, CallbackQueryHandler
 from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
-from binance_api import Binance
+from account_orders import ENTRY, STOPLOSS, order_writer, target_role
+from accounts import Account, roster, roster_jobs
+from balances import balance_cache
+from binance_api import get_binance, keep_alive_clients
 from binance.error import ClientError
-from models import Signals, Targets
+from credentials import CredentialCache
+from fanout import FanOutReport
+from leverage import leverage_cache, likely_symbols
+from market import price_feed, symbol_cache
+from models import INSTANCE, Settings, Signals, Targets
+from positions import position_ledger
+from proxy_pool import proxy_pool
+from scheduling import FILLS, ORDERS, REPORTS, fan_outs, scheduler
+from shard_worker import JOBS, job_open_entry
+from shards import ShardPool
+from signing import OrderTemplate
+from sizing import batch_sizes, is_balance_based
+from tracing import DB, FILL, PARSE, SIZING, tracer
+from user_stream import UserDataStream
 
 # Configure logging
 coloredlogs.install(level='INFO')
@@ -47,9 +63,8 @@ config = configparser.ConfigParser()
 config.optionxform = str
 config.read('config/bot.ini')
 
-# Initialize scheduler
-scheduler = BackgroundScheduler(timezone=pytz.timezone('Asia/Tehran'))
-scheduler.start()
+# Order entry/exit runs on its own pool so reporting can never delay it
+fan_out = fan_outs[ORDERS]
 
 # Load Telegram configuration
 ANALYZER_IDS = [int(x.strip()) for x in config['TELEGRAM']['analyzers'].split(',')]
@@ -65,8 +80,45 @@ bot = Client(
 )
 
 # Initialize base Binance client for price queries
-account_list = config["ACCOUNTS"]["account1"].split(",")
-base_binance = Binance(key=account_list[0], secret=account_list[1])
+base_account = roster[0]
+base_binance = get_binance(key=base_account.key, secret=base_account.secret)
+
+# Fills of the base account are pushed by its user data stream; polling in
+# check_orders only reconciles what the stream missed
+user_stream = None
+
+# Polling interval while the stream is down, and between reconciliations
+# while it is up
+POLLING_SECONDS = 10
+reconcile_seconds = config.getint('STREAMS', 'reconcile_seconds', fallback=60)
+last_reconcile = 0.0
+
+# clientOrderIds of OPEN rows whose fill is being or was handled, shared by
+# stream and polling; pruned to rows still OPEN by check_orders
+handled_fills = set()
+handled_fills_lock = threading.Lock()
+
+# Accounts verified recently are not checked again on startup
+credential_cache = CredentialCache(
+    config.get('STARTUP', 'cache_file', fallback='credentials_cache.json'),
+    config.getint('STARTUP', 'verified_window_minutes', fallback=720) * 60
+)
+startup_timeout = config.getint('STARTUP', 'timeout', fallback=120)
+
+# Worker processes running per-account jobs, None runs them in-process
+shard_pool = None
+
+# Symbols whose margin type and leverage are applied ahead of signals
+prearm_extra = [
+    symbol.strip()
+    for symbol in config.get('LEVERAGE', 'prearm_symbols', fallback='').split(',')
+]
+prearm_recent_signals = config.getint('LEVERAGE', 'prearm_recent_signals', fallback=20)
+default_leverage = config.getint('LEVERAGE', 'default_leverage', fallback=0) or None
+
+# Symbol precision/filters are shared by all accounts
+symbol_cache.ttl = config.getint('MARKET', 'symbols_ttl', fallback=3600)
+price_feed.max_age = config.getfloat('MARKET', 'price_max_age', fallback=5.0)
 
 
 def generate_unique_signal_id(length: int = 22) -> str:
@@ -151,11 +203,15 @@ def open_order_all(
     size: str,
     kind: str,
     leverage: int,
-    signal_id: str
-) -> None:
+    signal_id: str,
+    received_at: Optional[float] = None
+) -> FanOutReport:
     """
     Open orders on all configured accounts in parallel.
     
+    The first account runs alone to validate the signal, then every other
+    account is sent concurrently through the fan-out engine.
+    
     Args:
         symbol: Trading pair symbol (e.g., BTCUSDT)
         price: Entry price (0 for market orders)
@@ -163,313 +219,508 @@ def open_order_all(
         kind: Position type ('long' or 'short')
         leverage: Leverage multiplier
         signal_id: Unique signal identifier
+        received_at: Wall time the signal message arrived (SignalHandler),
+            latency spans are measured from it
+        
+    Returns:
+        Per-account results of the concurrent fan-out
     """
     start_time = datetime.datetime.now()
+    trace = tracer.start(signal_id, symbol, received_at)
+    if received_at is not None:
+        trace.record(PARSE, time.time() - received_at)
+    
+    # Size every account before the first order is sent
+    with trace.span(SIZING):
+        quantities = size_roster(symbol, price, size, leverage)
+    sized = [
+        (account, float(quantity))
+        for account, quantity in zip(roster, quantities) if quantity > 0
+    ]
+    if len(sized) < len(roster):
+        logger.warning(
+            f"{len(roster) - len(sized)} accounts skipped for {symbol}: "
+            f"size below the symbol's minimum quantity or notional"
+        )
+    if not sized:
+        raise ValueError(f"No account can open {symbol} at size {size}")
     
-    accounts = config["ACCOUNTS"].items()
-    proxies = list(config["PROXIES"].values())
+    # Order parameters are encoded once, every account only adds its
+    # quantity and signature
+    template = base_binance.entry_template(kind, symbol, price, signal_id)
     
-    # Calculate proxy distribution
-    accounts_per_proxy = max(1, len(accounts) // len(proxies))
-    current_proxy_idx = 0
+    (first_account, first_quantity), others = sized[0], sized[1:]
     
-    for idx, (account_name, account_credentials) in enumerate(accounts, 1):
-        # Rotate proxy every N accounts
-        if idx > 1 and (idx - 1) % accounts_per_proxy == 0:
-            current_proxy_idx = min(current_proxy_idx + 1, len(proxies) - 1)
-        
-        proxy = proxies[current_proxy_idx]
-        api_key, secret_key = account_credentials.split(",")
-        
-        # Execute first account synchronously to validate
-        if idx == 1:
-            try:
-                job_open_order(
-                    api_key, secret_key, symbol, price, size,
-                    kind, leverage, signal_id, account_name, proxy
-                )
-                logger.info(f"Order opened successfully for first account: {account_name}")
-            except Exception as e:
-                logger.error(f"Failed to open order on first account: {e}")
-                raise
+    # Execute first account synchronously to validate
+    try:
+        order, spans = job_open_order(
+            first_account, symbol, template, first_quantity, leverage, trace.received_at)
+        trace.add_account(spans)
+        order_writer.add(signal_id, first_account.name, ENTRY, order)
+        position_ledger.record_entry(signal_id, first_account.name, symbol, kind, order)
+        logger.info(f"Order opened successfully for first account: {first_account.name}")
+    except Exception as e:
+        logger.error(f"Failed to open order on first account: {e}")
+        raise
+    
+    # Send remaining accounts concurrently
+    report = run_for_accounts('open_entry', [
+        (account, [symbol, template, quantity, leverage, trace.received_at])
+        for account, quantity in others
+    ])
+    for result in report.succeeded:
+        order, spans = result.value
+        trace.add_account(spans)
+        order_writer.add(signal_id, result.account_name, ENTRY, order)
+        position_ledger.record_entry(signal_id, result.account_name, symbol, kind, order)
+        logger.info(
+            f"Order opened for {symbol} on {result.account_name} "
+            f"in {result.elapsed:.2f}s"
+        )
+    for result in report.failed:
+        if isinstance(result.error, ClientError):
+            _notify_open_error(result.account_name, symbol, result.error)
         else:
-            # Schedule remaining accounts asynchronously
-            scheduler.add_job(
-                job_open_order,
-                args=[
-                    api_key, secret_key, symbol, price, size,
-                    kind, leverage, signal_id, account_name, proxy
-                ],
-                misfire_grace_time=None
-            )
+            logger.error(f"Failed to open order on {result.account_name}: {result.error}")
     
     elapsed_time = datetime.datetime.now() - start_time
-    logger.info(f"Scheduled orders for all accounts in {elapsed_time.total_seconds():.2f}s")
+    logger.info(
+        f"Opened orders for {symbol}: {report.summary()}, "
+        f"total {elapsed_time.total_seconds():.2f}s"
+    )
+    flush_ledgers()
+    tracer.finish(trace)
+    return report
 
 
-def job_open_order(
-    api_key: str,
-    secret_key: str,
+def submit_signal(
+    chat_id: int,
     symbol: str,
     price: float,
     size: str,
     kind: str,
     leverage: int,
     signal_id: str,
-    account_name: str,
-    proxy: str
-) -> Optional[str]:
+    received_at: Optional[float] = None
+) -> None:
+    """
+    Queue open_order_all() on the ORDERS lane and return at once.
+    
+    The Telegram handler never waits for a fan-out, so one slow proxy
+    cannot hold up the signals that follow. Errors are reported to
+    `chat_id` like errors of the handler itself.
+    
+    Args:
+        chat_id: Chat the signal came from
+        symbol, price, size, kind, leverage, signal_id, received_at:
+            Arguments of open_order_all()
+    """
+    scheduler.add_job(
+        _open_signal, executor=ORDERS,
+        args=[chat_id, symbol, price, size, kind, leverage, signal_id, received_at],
+        # run even when the lane is busy, never drop a signal
+        misfire_grace_time=None
+    )
+
+
+def _open_signal(chat_id: int, *args) -> None:
+    try:
+        open_order_all(*args)
+    except Exception as e:
+        logger.error(f"Error opening signal {args[0]}: {e}")
+        bot.send_message(chat_id, f"Error processing signal: {str(e)}")
+
+
+def flush_ledgers() -> None:
+    """Write buffered per-account orders and positions."""
+    order_writer.flush()
+    position_ledger.flush()
+
+
+def job_open_order(
+    account: Account,
+    symbol: str,
+    template: OrderTemplate,
+    quantity: float,
+    leverage: int,
+    received_at: Optional[float] = None
+) -> Tuple[dict, dict]:
     """
     Execute order opening for a single account.
     
     Args:
-        api_key: Binance API key
-        secret_key: Binance secret key
+        account: Account to trade on
         symbol: Trading pair symbol
-        price: Entry price
-        size: Position size or percentage
-        kind: Position type
+        template: Entry order of the signal from Binance.entry_template()
+        quantity: Order quantity from size_roster()
         leverage: Leverage multiplier
-        signal_id: Unique signal identifier
-        account_name: Account name for logging
-        proxy: Proxy server address
+        received_at: Wall time the signal message arrived
         
     Returns:
-        Client order ID if successful, None otherwise
+        Entry order response and the latency spans of this account
     """
     start_time = datetime.datetime.now()
     
     try:
-        binance = Binance(key=api_key, secret=secret_key, proxy=proxy)
-        
-        # Set margin type to CROSSED
-        try:
-            binance.change_margin_type(symbol)
-        except ClientError:
-            pass  # Margin type might already be set
-        
-        # Set leverage
-        binance.set_leverage(symbol, leverage)
-        
-        # Calculate position size
-        calculated_size = _calculate_position_size(
-            binance, symbol, price, size, leverage
-        )
-        
-        # Determine order type and execute
-        if price == 0:
-            # Market order
-            if kind == "long":
-                order = binance.market_long(symbol, calculated_size, signal_id)
-            else:
-                order = binance.market_short(symbol, calculated_size, signal_id)
-        else:
-            # Limit order
-            if kind == "long":
-                order = binance.stoplimit_long(
-                    symbol, price, price, calculated_size, signal_id
-                )
-            else:
-                order = binance.stoplimit_short(
-                    symbol, price, price, calculated_size, signal_id
-                )
+        # Leverage if needed, then the entry signed with this account's key
+        order, spans = job_open_entry(
+            account, symbol, template, quantity, leverage, received_at)
         
         elapsed_time = datetime.datetime.now() - start_time
         logger.info(
-            f"Order opened for {symbol} on {account_name} "
-            f"(ID: {api_key[:10]}...) in {elapsed_time.total_seconds():.2f}s"
+            f"Order opened for {symbol} on {account.name} "
+            f"(ID: {account.key[:10]}...) in {elapsed_time.total_seconds():.2f}s"
         )
         
-        return order.get('clientOrderId')
+        return order, spans
         
     except ClientError as error:
-        error_msg = (
-            f"Binance API Error - Status: {error.status_code}, "
-            f"Code: {error.error_code}, Message: {error.error_message}"
-        )
-        logger.error(f"Failed to open order on {account_name}: {error_msg}")
-        
-        # Notify admin
-        notification = (
-            f"From {bot.get_me().first_name}\n"
-            f"**🚨 Error Opening Order**\n"
-            f"**Account:** {account_name}\n"
-            f"**Symbol:** {symbol}\n"
-            f"**Error:** `{error_msg}`"
-        )
-        bot.send_message(PRIVATE_LOG_ID, notification)
-        
+        _notify_open_error(account.name, symbol, error)
         raise
 
 
-def _calculate_position_size(
-    binance: Binance,
+def _notify_open_error(account_name: str, symbol: str, error: ClientError) -> None:
+    """
+    Log a failed entry order and notify the admin.
+    
+    Args:
+        account_name: Account the order failed on
+        symbol: Trading pair symbol
+        error: Error returned by Binance
+    """
+    error_msg = (
+        f"Binance API Error - Status: {error.status_code}, "
+        f"Code: {error.error_code}, Message: {error.error_message}"
+    )
+    logger.error(f"Failed to open order on {account_name}: {error_msg}")
+    
+    notification = (
+        f"From {bot.get_me().first_name}\n"
+        f"**🚨 Error Opening Order**\n"
+        f"**Account:** {account_name}\n"
+        f"**Symbol:** {symbol}\n"
+        f"**Error:** `{error_msg}`"
+    )
+    bot.send_message(PRIVATE_LOG_ID, notification)
+
+
+def run_for_accounts(
+    job_name: str,
+    jobs: List[Tuple[Account, list]],
+    lane: str = ORDERS
+) -> FanOutReport:
+    """
+    Run a per-account job on the shards, or in-process when sharding is off.
+    
+    Args:
+        job_name: Key of shard_worker.JOBS, called as fn(account, *args)
+        jobs: (account, args) for every account
+        lane: Fan-out lane used in-process
+        
+    Returns:
+        Per-account results
+    """
+    if shard_pool is not None:
+        return shard_pool.run(job_name, [(account.name, args) for account, args in jobs])
+    return fan_outs[lane].run(JOBS[job_name], [
+        (account.name, account.current_proxy, [account, *args])
+        for account, args in jobs
+    ])
+
+
+def size_roster(
     symbol: str,
     price: float,
     size: str,
     leverage: int
-) -> float:
+) -> np.ndarray:
     """
-    Calculate the actual position size based on size specification.
+    Calculate the order quantity of every account in one pass.
+    
+    Balances come from the balance cache, so this does no REST call
+    unless cached balances are missing or stale.
     
     Args:
-        binance: Binance API client
         symbol: Trading pair symbol
-        price: Entry price
+        price: Entry price (0 for market orders)
         size: Size specification (number, "Max", or percentage)
         leverage: Leverage multiplier
         
     Returns:
-        Calculated position size
+        Quantity per roster account, 0 for accounts that cannot trade it
     """
-    if size == "Max":
-        balance = binance.get_balance()
-        volume = balance * leverage * 0.4  # Use 40% of available balance
-        decimal_places = binance.get_decimal_coin(symbol)
-        
-        if 'market' in str(price):
-            price = float(str(price).replace('market', ''))
-        
-        calculated_size = volume / price
-        return truncate_decimal(calculated_size, decimal_places)
+    if 'market' in str(price):
+        price = float(str(price).replace('market', ''))
+    if not price:
+        price = price_feed.get_price(symbol, base_binance.client)
     
-    elif isinstance(size, str) and size.endswith('%'):
-        volume_percent = int(size.replace('%', ''))
-        balance = binance.get_balance()
-        volume = balance * leverage * (volume_percent / 100)
-        
-        # Cap maximum volume
-        volume = min(volume, 2000.0)
-        
-        decimal_places = binance.get_decimal_coin(symbol)
-        
-        if 'market' in str(price):
-            price = float(str(price).replace('market', ''))
-        
-        calculated_size = volume / price
-        return truncate_decimal(calculated_size, decimal_places)
+    info = symbol_cache.get(symbol, base_binance.client)
+    
+    balances = None
+    if is_balance_based(size):
+        balances = np.array(balance_cache.get_many(roster, fan_out))
+    
+    settings = Settings.get_or_none(Settings.id == 0)
+    limit_balance = settings.limit_balance if settings else 2000.0
     
-    else:
-        # Fixed size
-        return float(size)
+    return batch_sizes(
+        balances, len(roster), price, size, leverage, info, limit_balance
+    )
 
 
 def check_orders() -> None:
     """
     Periodically check order status and manage targets and stop losses.
     
+    Fills normally arrive through the user data stream (on_order_update);
+    this poll reconciles anything the stream missed.
+    
+    Pending signals and targets are grouped by symbol, so one tick costs
+    one openOrders call per symbol, plus one allOrders call for symbols
+    where something left the order book.
+    
     This function:
     1. Checks if open orders have been filled
     2. Sets up take-profit targets when orders fill
     3. Monitors target orders and updates stop losses
     """
     try:
-        # Check open orders
-        open_signals = Signals.select().where(Signals.status == "OPEN")
-        
-        for signal in open_signals:
-            try:
-                order = base_binance.get_order(
-                    symbol=signal.symbol,
-                    ClientOrderId=signal.id_signal
-                )
-                
-                if not order:
-                    logger.warning(
-                        f"Order {signal.id_signal} for {signal.symbol} not found"
-                    )
-                    signal.delete_instance()
-                    continue
-                
-                if order['status'] == 'FILLED':
-                    _handle_filled_order(signal, order)
-                elif order['status'] == 'CANCELED':
-                    signal.set_status('CANCELED')
-                    logger.info(f"Order {signal.id_signal} was canceled")
-                    
-            except ClientError as error:
-                if error.error_code == -2013:
-                    signal.set_status('CANCELED')
-                    logger.warning(f"Order {signal.id_signal} not found (deleted)")
-                else:
-                    logger.error(f"Error checking order {signal.id_signal}: {error}")
-        
-        # Check target orders
-        _check_target_orders()
-        
+        pending = _pending_orders_by_symbol()
     except Exception as e:
         logger.error(f"Error in check_orders: {e}")
+        return
+    
+    # fills whose row is no longer OPEN cannot come back
+    open_ids = {client_id for rows in pending.values() for client_id in rows}
+    with handled_fills_lock:
+        handled_fills.intersection_update(open_ids)
+    
+    for symbol, rows in pending.items():
+        try:
+            _reconcile_symbol(symbol, rows)
+        except Exception as e:
+            logger.error(f"Error checking orders of {symbol}: {e}")
 
 
-def _handle_filled_order(signal: Signals, order: dict) -> None:
+def poll_orders() -> None:
     """
-    Handle a filled order by setting up targets and stop loss.
+    Run check_orders every tick while the user data stream is down, and
+    every `[STREAMS] reconcile_seconds` while it pushes fills.
+    """
+    global last_reconcile
+    now = time.monotonic()
+    stream_up = user_stream is not None and user_stream.running
+    if stream_up and now - last_reconcile < reconcile_seconds:
+        return
+    last_reconcile = now
+    check_orders()
+
+
+def _pending_orders_by_symbol() -> dict:
+    """
+    Open signals and targets keyed by symbol, then by client order ID.
+    
+    Targets are joined to their signal, so `target.owner` needs no
+    extra query. Signals of other instances sharing the database are
+    left to them.
+    
+    Returns:
+        {symbol: {client_order_id: Signals or Targets record}}
+    """
+    pending = {}
+    open_signals = Signals.select().where(
+        (Signals.status == "OPEN") & (Signals.instance == INSTANCE))
+    for signal in open_signals:
+        pending.setdefault(signal.symbol, {})[signal.id_signal] = signal
+    
+    open_targets = (
+        Targets.select(Targets, Signals)
+        .join(Signals)
+        .where((Targets.status == "OPEN") & (Signals.instance == INSTANCE))
+    )
+    for target in open_targets:
+        pending.setdefault(target.owner.symbol, {})[target.id_target] = target
+    return pending
+
+
+def _reconcile_symbol(symbol: str, rows: dict) -> None:
+    """
+    Apply the Binance state of every pending order of one symbol.
     
     Args:
-        signal: Signal database record
-        order: Order details from Binance
+        symbol: Trading pair symbol
+        rows: Pending records keyed by client order ID
     """
-    logger.info(f"Order {signal.id_signal} for {signal.symbol} filled")
+    open_ids = {order['clientOrderId'] for order in base_binance.get_open_orders(symbol)}
+    closed = {client_id: row for client_id, row in rows.items() if client_id not in open_ids}
+    if not closed:
+        return
     
-    # Generate target IDs
-    target_ids = [
-        generate_unique_signal_id()
-        for _ in signal.targets_str.split("_")
-    ]
+    # one history read covers every order that left the book
+    history = {
+        order['clientOrderId']: order
+        for order in base_binance.get_recent_orders(symbol)
+        if order['clientOrderId'] in closed
+    }
     
-    # Schedule target setup for all accounts
-    accounts = config["ACCOUNTS"].items()
-    proxies = list(config["PROXIES"].values())
-    accounts_per_proxy = max(1, len(accounts) // len(proxies))
-    
-    for idx, (account_name, account_credentials) in enumerate(accounts, 1):
-        proxy_idx = min((idx - 1) // accounts_per_proxy, len(proxies) - 1)
-        proxy = proxies[proxy_idx]
-        api_key, secret_key = account_credentials.split(",")
-        
-        scheduler.add_job(
-            job_set_close,
-            args=[
-                api_key, secret_key, signal.symbol, signal.kind,
-                signal.targets_str, signal.stop_limit,
-                float(order['origQty']), signal, account_name, proxy, target_ids
-            ],
-            misfire_grace_time=None
+    for client_id, row in closed.items():
+        try:
+            order = history.get(client_id)
+            if order is None:
+                # older than the history window
+                order = base_binance.get_order(symbol=symbol, ClientOrderId=client_id)
+            if isinstance(row, Signals):
+                _apply_signal_order(row, order)
+            else:
+                _apply_target_order(row, order)
+        except ClientError as error:
+            if isinstance(row, Signals) and error.error_code == -2013:
+                row.set_status('CANCELED')
+                logger.warning(f"Order {client_id} not found (deleted)")
+            else:
+                logger.error(f"Error checking order {client_id}: {error}")
+
+
+def _apply_signal_order(signal: Signals, order: Optional[dict]) -> None:
+    """Update an open signal from the state of its entry order."""
+    if not order:
+        logger.warning(
+            f"Order {signal.id_signal} for {signal.symbol} not found"
         )
+        signal.delete_instance()
+    elif order['status'] == 'FILLED':
+        _handle_filled_order(signal, order)
+    elif order['status'] == 'CANCELED':
+        signal.set_status('CANCELED')
+        logger.info(f"Order {signal.id_signal} was canceled")
+
+
+def _apply_target_order(target: Targets, order: Optional[dict]) -> None:
+    """Update an open target from the state of its take-profit order."""
+    if not order:
+        return
+    if order['status'] == 'FILLED':
+        _handle_filled_target(target)
+    elif order['status'] in ['CANCELED', 'EXPIRED']:
+        target.set_status('CANCELED')
+        logger.info(f"Target {target.id_target} was {order['status']}")
+
+
+def _claim_fill(client_order_id: str) -> bool:
+    """
+    Claim a fill so stream and polling never handle it twice.
     
-    # Save targets to database
-    for idx, target_id in enumerate(target_ids, 1):
-        Targets.create(
-            owner=signal,
-            number=idx,
-            id_target=target_id
-        )
+    The claim is given back with _release_fill() if handling fails; after
+    success the row is no longer OPEN and check_orders prunes it.
     
-    signal.set_status('CLOSE')
+    Args:
+        client_order_id: Client order ID of the filled order
+        
+    Returns:
+        True if the caller should handle the fill, False if already handled
+    """
+    with handled_fills_lock:
+        if client_order_id in handled_fills:
+            return False
+        handled_fills.add(client_order_id)
+        return True
+
+
+def _release_fill(client_order_id: str) -> None:
+    """Give a claimed fill back after its handling failed, so it is retried."""
+    with handled_fills_lock:
+        handled_fills.discard(client_order_id)
 
 
-def _check_target_orders() -> None:
-    """Check and manage open target orders."""
-    open_targets = Targets.select().where(Targets.status == "OPEN")
+def on_order_update(order: dict) -> None:
+    """
+    Handle an ORDER_TRADE_UPDATE of the base account as soon as it arrives.
     
-    for target in open_targets:
-        try:
-            order = base_binance.get_order(
-                symbol=target.owner.symbol,
-                ClientOrderId=target.id_target
-            )
-            
-            if not order:
-                continue
-            
+    Args:
+        order: Order details from the user data stream
+    """
+    if order['status'] not in ['FILLED', 'CANCELED', 'EXPIRED']:
+        return
+    
+    try:
+        signal = Signals.get_or_none(
+            (Signals.id_signal == order['clientOrderId']) &
+            (Signals.status == "OPEN")
+        )
+        if signal:
+            if order['status'] == 'FILLED':
+                _handle_filled_order(signal, order)
+            else:
+                signal.set_status('CANCELED')
+                logger.info(f"Order {signal.id_signal} was {order['status']}")
+            return
+        
+        target = Targets.get_or_none(
+            (Targets.id_target == order['clientOrderId']) &
+            (Targets.status == "OPEN")
+        )
+        if target:
             if order['status'] == 'FILLED':
                 _handle_filled_target(target)
-            elif order['status'] in ['CANCELED', 'EXPIRED']:
+            else:
                 target.set_status('CANCELED')
                 logger.info(f"Target {target.id_target} was {order['status']}")
                 
-        except ClientError as error:
-            logger.error(f"Error checking target {target.id_target}: {error}")
+    except Exception as e:
+        logger.error(f"Error handling order update {order['clientOrderId']}: {e}")
+
+
+def _handle_filled_order(signal: Signals, order: dict) -> None:
+    """
+    Handle a filled order by setting up targets and stop loss.
+    
+    Args:
+        signal: Signal database record
+        order: Order details from Binance
+    """
+    if not _claim_fill(signal.id_signal):
+        return
+    
+    # Generate target IDs
+    target_ids = [
+        generate_unique_signal_id()
+        for _ in signal.targets_str.split("_")
+    ]
+    
+    try:
+        logger.info(f"Order {signal.id_signal} for {signal.symbol} filled")
+        position_ledger.record_fill(signal.id_signal, base_account.name, order)
+        
+        # Message-to-fill latency of the base account (T: stream, updateTime: REST)
+        trace = tracer.get(signal.id_signal)
+        if trace is not None:
+            filled_at = (order.get('T') or order.get('updateTime') or time.time() * 1000) / 1000
+            tracer.record_late(signal.id_signal, FILL, filled_at - trace.received_at)
+        
+        # Save targets and close the signal before any order is sent, so a
+        # failed write can be retried without placing the ladder twice
+        db_start = time.perf_counter()
+        for idx, target_id in enumerate(target_ids, 1):
+            Targets.create(
+                owner=signal,
+                number=idx,
+                id_target=target_id
+            )
+        signal.set_status('CLOSE')
+        tracer.record_late(signal.id_signal, DB, time.perf_counter() - db_start)
+    except Exception:
+        _release_fill(signal.id_signal)
+        try:
+            Targets.delete().where(Targets.id_target.in_(target_ids)).execute()
+        except Exception as e:
+            logger.error(f"Removing targets of {signal.id_signal} failed: {e}")
+        raise
+    
+    # Start target setup for all accounts
+    fan_out.submit(job_set_close, roster_jobs(
+        roster, signal.symbol, signal.kind, signal.targets_str,
+        signal.stop_limit, float(order['origQty']), signal, target_ids
+    ))
 
 
 def _handle_filled_target(target: Targets) -> None:
@@ -479,84 +730,76 @@ def _handle_filled_target(target: Targets) -> None:
     Args:
         target: Target database record
     """
+    if not _claim_fill(target.id_target):
+        return
+    
     logger.info(
         f"Target {target.number} for {target.owner.symbol} filled"
     )
     
-    # Schedule stop loss update for all accounts
-    accounts = config["ACCOUNTS"].items()
-    proxies = list(config["PROXIES"].values())
-    accounts_per_proxy = max(1, len(accounts) // len(proxies))
-    
-    for idx, (account_name, account_credentials) in enumerate(accounts, 1):
-        proxy_idx = min((idx - 1) // accounts_per_proxy, len(proxies) - 1)
-        proxy = proxies[proxy_idx]
-        api_key, secret_key = account_credentials.split(",")
-        
-        scheduler.add_job(
-            job_change_stoploss,
-            args=[api_key, secret_key, target, account_name, proxy],
-            misfire_grace_time=None
-        )
+    try:
+        target.set_status('CLOSE')
+    except Exception:
+        _release_fill(target.id_target)
+        raise
     
-    target.set_status('CLOSE')
+    # Start stop loss update for all accounts
+    fan_out.submit(job_change_stoploss, roster_jobs(roster, target))
 
 
 def job_set_close(
-    api_key: str,
-    secret_key: str,
+    account: Account,
     symbol: str,
     kind: str,
     targets_str: str,
     stop_limit: float,
     size: float,
     signal: Signals,
-    account_name: str,
-    proxy: str,
     target_ids: List[str]
 ) -> None:
     """
     Set up take-profit targets and stop loss for a filled order.
     
     Args:
-        api_key: Binance API key
-        secret_key: Binance secret key
+        account: Account to trade on
         symbol: Trading pair symbol
         kind: Position type
         targets_str: Target prices and percentages
         stop_limit: Stop loss price
         size: Position size
         signal: Signal database record
-        account_name: Account name for logging
-        proxy: Proxy server address
         target_ids: List of target order IDs
     """
+    account_name = account.name
     try:
-        binance = Binance(key=api_key, secret=secret_key, proxy=proxy)
+        binance = account.binance
         
         # Verify order is filled
         order = binance.get_order(symbol=symbol, ClientOrderId=signal.id_signal)
+        if order:
+            position_ledger.record_fill(signal.id_signal, account_name, order)
         if not order or order['status'] != 'FILLED':
             logger.warning(f"Order not filled for {account_name}")
             return
         
-        # Set stop loss if specified
+        # Build the whole ladder (stop loss + targets) for one batch request
+        ladder = []
+        close_side = binance.order.SELL if kind == 'long' else binance.order.BUY
+        
         if stop_limit != 0:
-            _set_stop_loss(
-                binance, symbol, kind, stop_limit,
-                signal, account_name
-            )
+            ladder.append((STOPLOSS, binance.stoploss_params(
+                close_side, symbol, stop_limit, f"{signal.id_signal}_stoploss"
+            )))
         
-        # Set take-profit targets
         targets_list = parse_targets(targets_str)
         percent_list = [p for _, p in targets_list]
         targets_list = [p for p, _ in targets_list]
         
         decimal_places = binance.get_decimal_coin(symbol)
         
-        for price_target, percent_target, target_id in zip(
+        for number, (price_target, percent_target, target_id) in enumerate(zip(
             targets_list, percent_list, target_ids
-        ):
+        ), 1):
             if percent_target == 0:
                 continue
             
@@ -580,99 +823,92 @@ def job_set_close(
             target_size = (size * percent_target) / 100
             target_size = truncate_decimal(target_size, decimal_places)
             
-            # Place target order
-            try:
-                if kind == 'long':
-                    binance.limit_short(
-                        symbol, price_target, target_size,
-                        ClientOrderId=target_id
-                    )
-                else:
-                    binance.limit_long(
-                        symbol, price_target, target_size,
-                        ClientOrderId=target_id
-                    )
-                logger.info(
-                    f"Target set: {price_target} ({percent_target}%) "
-                    f"for {symbol} on {account_name}"
+            ladder.append((target_role(number), binance.limit_params(
+                close_side, symbol, price_target, target_size, target_id
+            )))
+        
+        if not ladder:
+            return
+        
+        # Place the ladder, at most 5 orders per request; a failed request
+        # comes back as one error per order, so its stop loss is reported
+        try:
+            responses = binance.batch_orders([params for _, params in ladder])
+        except Exception as e:
+            responses = [{'code': None, 'msg': repr(e)} for _ in ladder]
+        
+        for (role, params), response in zip(ladder, responses):
+            if role == STOPLOSS:
+                _handle_stop_loss_result(
+                    response, symbol, stop_limit, signal, account_name
                 )
-            except ClientError as error:
+            elif 'code' in response:
                 logger.error(
-                    f"Failed to set target on {account_name}: {error}"
+                    f"Failed to set {role} at {params['price']} on {account_name}: "
+                    f"Code: {response['code']}, Message: {response['msg']}"
                 )
+            else:
+                order_writer.add(signal.id_signal, account_name, role, response)
+                logger.info(f"{role} set at {params['price']} for {symbol} on {account_name}")
                 
     except Exception as e:
         logger.error(f"Error in job_set_close for {account_name}: {e}")
 
 
-def _set_stop_loss(
-    binance: Binance,
+def _handle_stop_loss_result(
+    response: dict,
     symbol: str,
-    kind: str,
     stop_limit: float,
     signal: Signals,
     account_name: str
 ) -> None:
     """
-    Set stop loss order for a position.
+    Record a placed stop loss order or report why it was rejected.
     
     Args:
-        binance: Binance API client
+        response: Order or {"code", "msg"} error from the batch request
         symbol: Trading pair symbol
-        kind: Position type
         stop_limit: Stop loss price
         signal: Signal database record
         account_name: Account name for logging
     """
-    try:
-        client_order_id = f"{signal.id_signal}_stoploss"
-        
-        if kind == 'long':
-            order = binance.stoploss_short(symbol, stop_limit, client_order_id)
-        else:
-            order = binance.stoploss_long(symbol, stop_limit, client_order_id)
-        
-        signal.set_id_stoploss(order['orderId'])
-        signal.set_client_id_stoploss(order['clientOrderId'])
-        
-        logger.info(f"Stop loss set at {stop_limit} for {symbol} on {account_name}")
-        
-    except ClientError as error:
-        logger.error(f"Failed to set stop loss on {account_name}: {error}")
+    if 'code' in response:
+        error_msg = f"Code: {response['code']}, Message: {response['msg']}"
+        logger.error(f"Failed to set stop loss on {account_name}: {error_msg}")
         notification = (
             f"From {bot.get_me().first_name}\n"
             f"**🚨 Error Setting Stop Loss**\n"
             f"**Account:** {account_name}\n"
             f"**Symbol:** {symbol}\n"
-            f"**Error:** `{error}`"
+            f"**Error:** `{error_msg}`"
         )
         bot.send_message(PRIVATE_LOG_ID, notification)
+        return
+    
+    order_writer.add(signal.id_signal, account_name, STOPLOSS, response)
+    
+    logger.info(f"Stop loss set at {stop_limit} for {symbol} on {account_name}")
 
 
 def job_change_stoploss(
-    api_key: str,
-    secret_key: str,
-    target: Targets,
-    account_name: str,
-    proxy: str
+    account: Account,
+    target: Targets
 ) -> None:
     """
     Update stop loss to entry price when a target is hit.
     
     Args:
-        api_key: Binance API key
-        secret_key: Binance secret key
+        account: Account to trade on
         target: Target database record
-        account_name: Account name for logging
-        proxy: Proxy server address
     """
+    account_name = account.name
     try:
-        binance = Binance(key=api_key, secret=secret_key, proxy=proxy)
+        binance = account.binance
         
         # Get current stop loss order
         old_stop_loss = binance.get_order(
             symbol=target.owner.symbol,
-            ClientOrderId=target.owner.client_id_stoploss
+            ClientOrderId=order_writer.client_order_id(target.owner, account_name)
         )
         
         if not old_stop_loss:
@@ -686,6 +922,8 @@ def job_change_stoploss(
                 ClientOrderId=old_stop_loss['clientOrderId'],
                 orderId=old_stop_loss['orderId']
             )
+            order_writer.add(
+                target.owner.id_signal, account_name, STOPLOSS, old_stop_loss, status='CANCELED')
             logger.info(f"Canceled old stop loss for {target.owner.symbol}")
         except ClientError as error:
             logger.error(f"Failed to cancel stop loss: {error}")
@@ -694,36 +932,134 @@ def job_change_stoploss(
         logger.error(f"Error in job_change_stoploss for {account_name}: {e}")
 
 
+def job_verify_account(account: Account) -> Tuple[float, bool]:
+    """
+    Check the credentials of one account.
+    
+    Args:
+        account: Account to check
+        
+    Returns:
+        Tuple of (USDT balance, whether the key may trade futures)
+    """
+    binance = account.binance
+    return binance.get_balance(), binance.can_trade()
+
+
+def prearm_symbols() -> None:
+    """Apply margin type and leverage of likely symbols on every account."""
+    symbols = likely_symbols(prearm_recent_signals, prearm_extra)
+    
+    jobs = []
+    for symbol in symbols:
+        leverage = (
+            leverage_cache.last_leverage(base_account.name, symbol)
+            or default_leverage
+        )
+        jobs.extend((account, [symbol, leverage]) for account in roster)
+    
+    report = run_for_accounts('ensure_leverage', jobs, lane=REPORTS)
+    applied = sum(1 for result in report.succeeded if result.value)
+    logger.info(
+        f"Pre-armed {len(symbols)} symbols, {applied} account/symbols "
+        f"changed: {report.summary()}"
+    )
+
+
+def reconcile_balances() -> None:
+    """Read the balance of every account over REST into the balance cache."""
+    report = run_for_accounts(
+        'refresh_balance', [(account, []) for account in roster], lane=REPORTS
+    )
+    if shard_pool is not None:
+        # shards refreshed their own caches, sizing reads this one
+        for result in report.succeeded:
+            balance_cache.update(result.account_name, result.value)
+    for result in report.failed:
+        logger.warning(f"Balance reconcile failed on {result.account_name}: {result.error}")
+    logger.debug(f"Balances reconciled: {report.summary()}")
+
+
+def on_account_update(update: dict) -> None:
+    """
+    Track balance changes of the base account reported by its stream.
+    
+    Args:
+        update: `a` payload of an ACCOUNT_UPDATE event
+    """
+    balance_cache.on_account_update(base_account.name, update)
+
+
+def on_account_config_update(update: dict) -> None:
+    """
+    Track leverage changes of the base account reported by its stream.
+    
+    Args:
+        update: `ac` payload of an ACCOUNT_CONFIG_UPDATE event
+    """
+    leverage_cache.update_leverage(base_account.name, update['s'], int(update['l']))
+
+
 def verify_api_credentials() -> bool:
     """
     Verify that all configured API credentials are valid.
     
+    Accounts verified within `[STARTUP] verified_window_minutes` are taken
+    from the credential cache, the rest are checked concurrently.
+    
     Returns:
         True if all credentials are valid, False otherwise
     """
     logger.info("Verifying API credentials...")
+    credential_cache.load()
+    
+    pending = []
+    for account in roster:
+        if credential_cache.get(account) is None:
+            pending.append(account)
+        else:
+            # build the pooled client anyway so keep-alives warm it up
+            account.binance
     
-    accounts = config["ACCOUNTS"].items()
-    proxies = list(config["PROXIES"].values())
-    accounts_per_proxy = max(1, len(accounts) // len(proxies))
+    logger.info(
+        f"{len(roster) - len(pending)} accounts verified recently, "
+        f"checking {len(pending)}"
+    )
     
     all_valid = True
+    done = 0
+    progress_step = max(1, len(pending) // 10)
+    start_time = time.perf_counter()
     
-    for idx, (account_name, account_credentials) in enumerate(accounts, 1):
-        proxy_idx = min((idx - 1) // accounts_per_proxy, len(proxies) - 1)
-        proxy = proxies[proxy_idx]
-        api_key, secret_key = account_credentials.split(",")
+    futures = fan_out.submit(job_verify_account, roster_jobs(pending))
+    accounts = {account.name: account for account in pending}
+    for result in fan_out.iter_results(futures, timeout=startup_timeout):
+        account = accounts[result.account_name]
+        done += 1
         
-        try:
-            binance = Binance(key=api_key, secret=secret_key, proxy=proxy)
-            balance = binance.get_balance()
-            logger.info(f"✓ {account_name}: Balance = {balance} USDT")
-        except ClientError as error:
-            logger.error(
-                f"✗ {account_name}: API Error - {error.error_message}"
-            )
+        if result.ok and result.value[1]:
+            balance, can_trade = result.value
+            credential_cache.store(account, balance, can_trade)
+            balance_cache.update(account.name, balance)
+            logger.debug(f"✓ {account.name}: Balance = {balance} USDT")
+        else:
+            if isinstance(result.error, ClientError):
+                reason = f"API Error - {result.error.error_message}"
+            elif result.error is not None:
+                reason = repr(result.error)
+            else:
+                reason = "API key is not allowed to trade futures"
+            logger.error(f"✗ {account.name}: {reason}")
+            credential_cache.forget(account)
             all_valid = False
+        
+        if done % progress_step == 0 or done == len(pending):
+            logger.info(
+                f"Verified {done}/{len(pending)} accounts "
+                f"in {time.perf_counter() - start_time:.1f}s"
+            )
     
+    credential_cache.save()
     return all_valid
 
 
@@ -732,6 +1068,9 @@ class SignalHandler:
     """Handle incoming trading signals from authorized analyzers."""
     
     def __init__(self, client: Client, message):
+        # latency of the signal is measured from here; format handlers
+        # queue their orders with submit_signal() so this returns at once
+        self.received_at = time.time()
         self.client = client
         self.message = message
         self.text = message.text
@@ -781,11 +1120,41 @@ def main() -> None:
     """Start the bot and begin listening for signals."""
     logger.info("Starting Copy Trade Futures Bot...")
     
-    # Verify API credentials
+    # Verify API credentials (this also builds the pooled client of every
+    # account, so the first signal reuses warm connections)
     if not verify_api_credentials():
         logger.error("API credential verification failed")
         return
     
+    # Proxies already degraded keep their accounts unless failover is on
+    proxy_pool.probe()
+    proxy_pool.check_failover()
+    
+    # Leverage/margin type already applied by previous runs
+    leverage_cache.load()
+    
+    # Per-account jobs in worker processes, one per CPU core at most
+    global shard_pool
+    shard_workers = config.getint('SHARDS', 'workers', fallback=0)
+    if shard_workers > 0:
+        shard_pool = ShardPool(
+            shard_workers,
+            max_workers=config.getint('EXECUTION', 'orders_workers', fallback=200),
+            max_per_proxy=config.getint('EXECUTION', 'max_per_proxy', fallback=20),
+        )
+        shard_pool.start()
+    
+    # Load symbol metadata once so sizing does no extra REST calls
+    symbol_cache.refresh(base_binance.client)
+    
+    # Shared mark prices for every order path
+    price_feed.start()
+    
+    # Latency histograms for dashboards (Prometheus text / JSON)
+    tracing_port = config.getint('TRACING', 'port', fallback=0)
+    if tracing_port:
+        tracer.serve(tracing_port, config.get('TRACING', 'host', fallback='127.0.0.1'))
+    
     # Start bot
     bot.start()
     logger.info(f"Bot started. Send /start to @{bot.get_me().username}")
@@ -809,12 +1178,71 @@ def main() -> None:
     
     bot.add_handler(CallbackQueryHandler(MyCallbackHandler))
     
-    # Schedule order checking
-    scheduler.add_job(check_orders, 'interval', seconds=10)
+    # Push fills of the base account instead of waiting for polling
+    global user_stream
+    user_stream = UserDataStream(
+        base_binance, on_order_update=on_order_update,
+        on_account_update=on_account_update,
+        on_config_update=on_account_config_update, name=base_account.name
+    )
+    try:
+        user_stream.start()
+    except Exception as e:
+        logger.error(f"User data stream unavailable, polling until it is back: {e}")
+        user_stream.reconnect()
+    scheduler.add_job(user_stream.keep_alive, 'interval', minutes=30, executor=FILLS)
+    
+    # Schedule order checking (reconciliation when the stream is up)
+    scheduler.add_job(
+        poll_orders, 'interval', seconds=POLLING_SECONDS,
+        executor=FILLS, max_instances=1, coalesce=True
+    )
+    
+    # Keep cached balances of all accounts in line with Binance
+    scheduler.add_job(
+        reconcile_balances, 'interval',
+        seconds=config.getint('BALANCES', 'reconcile_seconds', fallback=60),
+        next_run_time=datetime.datetime.now(), executor=REPORTS,
+        max_instances=1, coalesce=True
+    )
+    
+    # Prepare likely symbols now and keep them prepared
+    scheduler.add_job(
+        prearm_symbols, 'interval',
+        minutes=config.getint('LEVERAGE', 'prearm_minutes', fallback=30),
+        next_run_time=datetime.datetime.now(), executor=REPORTS,
+        max_instances=1, coalesce=True
+    )
+    
+    # Reconnect the mark price stream if it dropped
+    scheduler.add_job(price_feed.start, 'interval', seconds=30)
+    
+    # Keep pooled client connections warm between signals
+    scheduler.add_job(
+        keep_alive_clients, 'interval', seconds=60, args=[roster],
+        max_instances=1, coalesce=True
+    )
+    
+    # Per-account orders and positions are written in batches
+    scheduler.add_job(
+        flush_ledgers, 'interval',
+        seconds=config.getint('ACCOUNT_ORDERS', 'flush_seconds', fallback=2),
+        max_instances=1, coalesce=True
+    )
+    
+    # Fresh health samples for idle and degraded proxies
+    scheduler.add_job(
+        proxy_pool.probe, 'interval',
+        seconds=config.getint('PROXY_POOL', 'probe_seconds', fallback=30),
+        max_instances=1, coalesce=True
+    )
     
     # Keep bot running
     idle()
     bot.stop()
+    flush_ledgers()
+    if shard_pool is not None:
+        shard_pool.stop()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,200 @@
+"""
+Process-wide market data shared by every account.
+
+Symbol filters and prices are the same for all accounts, so they are
+kept here once instead of being fetched by every account on every job:
+symbol filters come from `exchange_info` and are refreshed on a TTL,
+prices come from the mark-price websocket stream with a REST fallback.
+The stream reconnects itself after a drop (see streams); `replay()` feeds
+recorded messages instead, as a local stand-in in tests.
+"""
+
+import decimal
+import json
+import logging
+import threading
+import time
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+from binance.websocket.um_futures.websocket_client import UMFuturesWebsocketClient
+
+from streams import ReconnectingStream, close_client
+
+logger = logging.getLogger(__name__)
+
+
+def _precision(step: str) -> int:
+    """Number of decimal places allowed by a step such as '0.001'."""
+    exponent = decimal.Decimal(step).normalize().as_tuple().exponent
+    return max(0, -exponent)
+
+
+class SymbolInfo:
+    """Trading filters of one futures symbol."""
+
+    def __init__(self, data: dict):
+        filters = {_filter['filterType']: _filter for _filter in data['filters']}
+
+        self.symbol = data['symbol']
+        self.step_size = float(filters['LOT_SIZE']['stepSize'])
+        self.min_qty = float(filters['LOT_SIZE']['minQty'])
+        self.tick_size = float(filters['PRICE_FILTER']['tickSize'])
+        self.min_notional = float(
+            filters.get('MIN_NOTIONAL', {}).get('notional', 0))
+        self.quantity_precision = _precision(filters['LOT_SIZE']['stepSize'])
+        self.price_precision = _precision(filters['PRICE_FILTER']['tickSize'])
+
+
+class SymbolCache:
+    """
+    Symbol metadata loaded from `exchange_info` and refreshed on a TTL.
+
+    Args:
+        ttl: Seconds before the metadata is downloaded again
+    """
+
+    def __init__(self, ttl: int = 3600):
+        self.ttl = ttl
+        self._symbols: Dict[str, SymbolInfo] = {}
+        # symbols the last refresh did not know, not looked up again until
+        # the next one
+        self._unknown: Set[str] = set()
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def refresh(self, client) -> None:
+        """Download `exchange_info` once and replace the cached symbols."""
+        response = client.exchange_info()
+        symbols = {}
+        for data in response['symbols']:
+            try:
+                symbols[data['symbol']] = SymbolInfo(data)
+            except KeyError:
+                # symbols without the usual filters (e.g. delivery contracts)
+                continue
+
+        self._symbols = symbols
+        self._unknown = set()
+        self._loaded_at = time.monotonic()
+        logger.info(f"Loaded metadata for {len(symbols)} symbols")
+
+    def _is_stale(self) -> bool:
+        return time.monotonic() - self._loaded_at > self.ttl
+
+    def get(self, symbol: str, client) -> SymbolInfo:
+        """
+        Get metadata of a symbol, loading it through `client` when needed.
+
+        Args:
+            symbol: Trading pair symbol
+            client: Any UMFutures client, only used when the cache is cold,
+                stale or does not know the symbol yet
+
+        Returns:
+            Symbol metadata
+
+        Raises:
+            KeyError: Binance does not list the symbol (delisted or a typo)
+        """
+        info: Optional[SymbolInfo] = self._symbols.get(symbol)
+        if not self._is_stale():
+            if info is not None:
+                return info
+            if symbol in self._unknown:
+                raise KeyError(f"Unknown symbol: {symbol}")
+
+        with self._lock:
+            # another thread may have refreshed while we were waiting
+            info = self._symbols.get(symbol)
+            if (info is None and symbol not in self._unknown) or self._is_stale():
+                self.refresh(client)
+                info = self._symbols.get(symbol)
+            if info is None:
+                self._unknown.add(symbol)
+
+        if info is None:
+            raise KeyError(f"Unknown symbol: {symbol}")
+        return info
+
+
+symbol_cache = SymbolCache()
+
+
+class PriceFeed(ReconnectingStream):
+    """
+    In-memory mark prices fed by the `!markPrice@arr@1s` stream.
+
+    Prices older than `max_age` seconds are treated as stale and read
+    through REST instead, so a dropped stream only costs latency.
+
+    Args:
+        max_age: Seconds a streamed price stays usable
+    """
+
+    def __init__(self, max_age: float = 5.0):
+        super().__init__("Mark price stream")
+        self.max_age = max_age
+        self._prices: Dict[str, Tuple[float, float]] = {}
+
+    def _connect(self) -> UMFuturesWebsocketClient:
+        client = UMFuturesWebsocketClient(
+            on_message=self._on_raw_message,
+            on_close=self._on_close,
+            on_error=self._on_error,
+        )
+        try:
+            client.mark_price_all_market(speed=1)
+        except Exception:
+            close_client(client)
+            raise
+        return client
+
+    def _handle(self, message: str) -> None:
+        data = json.loads(message)
+        # subscription acks are dicts, price updates are arrays
+        if not isinstance(data, list):
+            return
+        for update in data:
+            if update.get('e') == 'markPriceUpdate':
+                self.update(update['s'], float(update['p']))
+
+    def replay(self, messages: Iterable[str]) -> None:
+        """Feed recorded raw stream messages, e.g. as a local stand-in."""
+        for message in messages:
+            self._handle(message)
+
+    def update(self, symbol: str, price: float) -> None:
+        self._prices[symbol] = (price, time.monotonic())
+
+    def age(self, symbol: str) -> Optional[float]:
+        """Seconds since the last price of a symbol, None if never seen."""
+        entry = self._prices.get(symbol)
+        if entry is None:
+            return None
+        return time.monotonic() - entry[1]
+
+    def get_price(self, symbol: str, client=None) -> float:
+        """
+        Get the latest mark price of a symbol.
+
+        Args:
+            symbol: Trading pair symbol
+            client: UMFutures client used as REST fallback when the
+                streamed price is missing or stale
+
+        Returns:
+            Mark price
+        """
+        entry = self._prices.get(symbol)
+        if entry is not None and time.monotonic() - entry[1] <= self.max_age:
+            return entry[0]
+
+        if client is None:
+            raise KeyError(f"No fresh price for {symbol}")
+
+        price = float(client.mark_price(symbol=symbol)['markPrice'])
+        self.update(symbol, price)
+        return price
+
+
+price_feed = PriceFeed()
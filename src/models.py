@@ -1,14 +1,25 @@
 from peewee import *
-from playhouse.sqliteq import SqliteQueueDatabase
 from playhouse.migrate import *
 
+import configparser
+import datetime
 import logging
 import coloredlogs
+
+from storage import create_schema, open_database, release_connection as _release
+
 logger = logging.getLogger(__name__)
 coloredlogs.install(level=logging.DEBUG, logger=logger)
 
-# db = SqliteDatabase("db")
-db = SqliteQueueDatabase("db")
+config = configparser.ConfigParser()
+config.optionxform = str
+config.read('config/bot.ini')
+
+# SQLite or pooled PostgreSQL from [DATABASE], see storage
+db = DatabaseProxy()
+
+# bot instance sharing the database, each one only reconciles its own signals
+INSTANCE = config.get('DATABASE', 'instance', fallback='default')
 
 
 class BaseModel(Model):
@@ -18,16 +29,17 @@ class BaseModel(Model):
 
 class Signals(BaseModel):
     id_signal = TextField(unique=True)
-    symbol = TextField()
+    symbol = TextField(index=True)
     #long or short
     kind = TextField()
     entry = FloatField()
     # OPEN or CLOSE or CANCELED(for manual cancel)
-    status = TextField(default="OPEN")
+    status = TextField(default="OPEN", index=True)
     targets_str = TextField()
     stop_limit = FloatField(default=0)
     id_stoploss = IntegerField(null=True)
     client_id_stoploss = TextField(null=True)
+    instance = TextField(default=INSTANCE, index=True)
 
     def set_status(self, status):
         self.status = status
@@ -45,9 +57,9 @@ class Signals(BaseModel):
 class Targets(BaseModel):
     owner = ForeignKeyField(Signals, backref='targets')
     number = IntegerField()
-    id_target = TextField()
+    id_target = TextField(index=True)
     # OPEN or CLOSE
-    status = TextField(default="OPEN")
+    status = TextField(default="OPEN", index=True)
 
     def set_status(self, status):
         self.status = status
@@ -61,15 +73,68 @@ class Settings(BaseModel):
         self.limit_balance = limit_balance
         self.save()
 
+class AccountSymbolSettings(BaseModel):
+    # leverage and margin type last applied on Binance per account/symbol,
+    # kept per instance like signals
+    instance = TextField(default=INSTANCE)
+    account = TextField()
+    symbol = TextField()
+    leverage = IntegerField(null=True)
+    margin_type = TextField(null=True)
+    updated_at = DateTimeField(default=datetime.datetime.now)
+
+    class Meta:
+        indexes = (
+            (('instance', 'account', 'symbol'), True),
+        )
+
+class AccountOrders(BaseModel):
+    # latest order of every account per signal and role, see account_orders
+    signal = TextField()
+    account = TextField()
+    # entry, stoploss or target<number>
+    role = TextField()
+    order_id = BigIntegerField(null=True)
+    client_order_id = TextField(null=True)
+    status = TextField(null=True)
+    updated_at = DateTimeField(default=datetime.datetime.now)
+
+    class Meta:
+        indexes = (
+            (('signal', 'account', 'role'), True),
+        )
+
+class Positions(BaseModel):
+    # what every account holds per signal, see positions
+    signal = TextField()
+    account = TextField()
+    symbol = TextField(null=True)
+    kind = TextField(null=True)
+    quantity = FloatField(null=True)
+    filled_qty = FloatField(null=True)
+    entry_price = FloatField(null=True)
+    # NEW, PARTIALLY_FILLED, FILLED, CLOSED or CANCELED
+    status = TextField(null=True)
+    updated_at = DateTimeField(default=datetime.datetime.now)
+
+    class Meta:
+        indexes = (
+            (('signal', 'account'), True),
+        )
+
+MODELS = [Signals, Targets, Settings, AccountSymbolSettings, AccountOrders, Positions]
+
+def release_connection():
+    # hand a pooled connection back once a job thread is done with it
+    _release(db.obj)
+
 def create_db_tables():
     logger.info("Checking database...")
-    # try:
-    # with db:
-    db.create_tables([Signals, Targets, Settings])
+    # new tables from the models, existing ones through migrations
+    create_schema(db.obj, MODELS)
     logger.info("Tables created!")
-    # except:
-    #     pass
 
+db.initialize(open_database(config))
 create_db_tables()
 
 try:
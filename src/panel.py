@@ -5,7 +5,17 @@ from pyrogram.errors import RPCError, BadRequest, NotAcceptable, Unauthorized
 from pyrogram.types import ReplyKeyboardMarkup, InlineKeyboardMarkup, InlineKeyboardButton
 from pyrogram.enums import ParseMode
 from models import *
-from binance_api import Binance
+from account_orders import STOPLOSS, order_writer
+from positions import CLOSED, FILLED, position_ledger
+from accounts import roster, roster_jobs
+from balances import balance_cache
+from binance_api import get_binance
+from fanout import ResultCollector
+from market import price_feed
+from proxy_pool import proxy_pool
+from rate_limit import rate_limiter
+from scheduling import ORDERS, REPORTS, fan_outs
+from tracing import tracer
 from binance.error import ClientError
 
 from main import PRIVATE_LOG_ID as Id_private_log, PUBLIC_LOG_ID as Id_public_log
@@ -17,10 +27,6 @@ import datetime
 from openpyxl.styles import Font, NamedStyle, Alignment, Border, Side, PatternFill, GradientFill
 from openpyxl import Workbook
 
-from apscheduler.schedulers.background import BackgroundScheduler
-scheduler = BackgroundScheduler()
-scheduler.start()
-
 coloredlogs.install(level='INFO')
 logger = logging.getLogger(__name__)
 
@@ -28,8 +34,125 @@ config = configparser.ConfigParser()
 config.optionxform = str
 config.read('config/bot.ini')
 
+# seconds a panel action waits for all accounts before giving up on the rest
+panel_timeout = config.getint('EXECUTION', 'panel_timeout', fallback=120)
+
 users_data = dict()
 
+
+class PositionRecord:
+    def __init__(self, account_name, symbol, leverage, size, pnl, liq, entry, mark, public=False):
+        self.account_name = account_name
+        self.symbol = symbol
+        self.leverage = leverage
+        self.size = size
+        self.pnl = pnl
+        self.liq = liq
+        self.entry = entry
+        self.mark = mark
+        self.public = public
+
+    def render(self):
+        if self.entry == 0.0:
+            return f"""
+📌account : {self.account_name}  📍**{self.symbol}**
+NOT FOUND ❌
+"""
+
+        pnl_percent = round(((self.mark/self.entry)-1)*self.leverage*100, 2)
+
+        margin = (self.size*self.mark)/self.leverage
+        margin = round(margin, 4)
+
+        if self.public:
+            return f"""
+📌account : {self.account_name}
+📍**XXXUSDT**      ⚓️**{self.leverage}**X
+❗️PNL:**{self.pnl}**     ❗️PNL%:**{pnl_percent}**                 
+🔸ENTRY:**X.x**     🔸MARK:**X.x**
+💰MARGIN:**{margin}**       ⚠️Liq:**{self.liq}**f
+"""
+        return f"""
+📌account : {self.account_name}
+📍**{self.symbol}**      ⚓️**{self.leverage}**X
+❗️PNL:**{self.pnl}**     ❗️PNL%:**{pnl_percent}**                 
+🔸ENTRY:**{self.entry}**     🔸MARK:**{self.mark}**
+💰MARGIN:**{margin}**       ⚠️Liq:**{self.liq}**f
+"""
+
+
+class BalanceRecord:
+    def __init__(self, account_name, balance):
+        self.account_name = account_name
+        self.balance = balance
+
+    def render(self):
+        return f"📌account : {self.account_name}\n💲balance : **{self.balance}**\n\n"
+
+
+class PnlRecord:
+    def __init__(self, account_name, day, week, month):
+        self.account_name = account_name
+        self.day = day
+        self.week = week
+        self.month = month
+
+    def row(self):
+        return [self.account_name, self.day, self.week, self.month]
+
+    def render(self):
+        return f"\n{self.account_name},{self.day},{self.week},{self.month}"
+
+
+class NoteRecord:
+    # free text reported by management jobs (errors, warnings)
+    def __init__(self, account_name, text):
+        self.account_name = account_name
+        self.text = text
+
+    def render(self):
+        return self.text
+
+
+def gather_records(job, jobs, collector=None, lane=REPORTS):
+    # yield each account's record as soon as that account finishes;
+    # order/stop actions pass lane=ORDERS so reports never hold them up
+    if collector is None:
+        collector = ResultCollector(account_name for account_name, _, _ in jobs)
+    fan_out = fan_outs[lane]
+    futures = fan_out.submit(job, jobs)
+    for result in fan_out.iter_results(futures, timeout=panel_timeout):
+        record = result.value
+        if not result.ok:
+            logger.error(
+                f"{job.__name__} failed for account {result.account_name}: {result.error!r}")
+            record = NoteRecord(result.account_name, f"""
+🚨account : {result.account_name}
+**Error :** `{result.error!r}`
+""")
+        elif isinstance(record, str):
+            record = NoteRecord(result.account_name, record)
+
+        if not record or not record.render():
+            continue
+        collector.add(result.account_name, record)
+        yield record
+
+
+def stream_records(records, send, separator="", header=""):
+    # send partial results while the other accounts are still answering
+    text = ""
+    for record in records:
+        if text != "":
+            text += separator
+        text += record.render()
+        if len(text) >= 3500:
+            send(header + text)
+            text = ""
+    if text != "":
+        send(header + text)
+
+
 B_settings = "تنظیمات ⚙"
 B_status_positions_account1 = "وضعیت پوزیشن های اکانت اول 👀"
 B_status_positions_accounts = "وضعیت پوزیشن های اکانت ها 👀"
@@ -99,10 +222,7 @@ class MyButtonHandler:
 
     def run(self):
         if self.text == B_status_positions_account1:
-            account_list = config["ACCOUNTS"]["account1"].split(",")
-            key = account_list[0]
-            secret = account_list[1]
-            base_binance = Binance(key=key, secret=secret)
+            base_binance = get_binance(key=roster[0].key, secret=roster[0].secret)
 
             signals = Signals.select().where(Signals.status == "CLOSE")
             open_position_symbols = [signal.symbol for signal in signals]
@@ -177,87 +297,21 @@ class MyButtonHandler:
 
             open_position_symbols = [open_position_symbols[-1]]
 
-            global text_positions, counter_job
-            text_positions = ""
-            counter_job = 0
-            counter = 0
             for symbol in open_position_symbols:
-                text_positions = ""
-
-                accounts = config["ACCOUNTS"].items()
-                proxies = list(config["PROXIES"].values())
-                div = int(len(accounts)/len(proxies))+1
-                proxy = proxies[0]
-                logger.info("Connecting with proxy: %s", proxy)
-                i = 0
-
-                for account_name, account in accounts:
-                    i += 1
-                    if (i % div == 0) and i != 1:
-                        proxy = proxies[proxies.index(proxy)+1]
-                        logger.info("Connecting with proxy: %s", proxy)
-
-                    account_list = account.split(",")
-                    key = account_list[0]
-                    secret = account_list[1]
-
-                    scheduler.add_job(
-                        job_status_positions,
-                        args=[self.message, symbol, key,
-                              secret, account_name, proxy, True],
-                        misfire_grace_time=None
-                    )
-                    counter += 1
-
-            while counter_job != counter:
-                if len(text_positions) >= 3500:
-                    self.client.send_message(Id_public_log, text_positions)
-                    text_positions = ""
-                pass
-            # if text_positions == "":
-            #     text_positions = """پوزیشن بازی وجود ندارد!"""
-            self.client.send_message(Id_public_log, text_positions)
+                jobs = roster_jobs(roster, self.message, symbol, True)
+                stream_records(
+                    gather_records(job_status_positions, jobs),
+                    lambda text: self.client.send_message(Id_public_log, text),
+                    separator="➰➰➰➰➰➰➰➰➰➰➰➰")
 
             self.message.reply('☑')
 
         elif self.text == B_momentary_balances:
-
-            global text_balances, counter_job_balances
-
-            text_balances = ""
-            counter_job_balances = 0
-            counter = 0
-
-            accounts = config["ACCOUNTS"].items()
-            proxies = list(config["PROXIES"].values())
-            div = int(len(accounts)/len(proxies))+1
-            proxy = proxies[0]
-            logger.info("Connecting with proxy: %s", proxy)
-            i = 0
-
-            for account_name, account in accounts:
-                i += 1
-                if (i % div == 0) and i != 1:
-                    proxy = proxies[proxies.index(proxy)+1]
-                    logger.info("Connecting with proxy: %s", proxy)
-
-                account_list = account.split(",")
-                key = account_list[0]
-                secret = account_list[1]
-
-                scheduler.add_job(
-                    job_get_balances,
-                    args=[key, secret, account_name, proxy],
-                    misfire_grace_time=None
-                )
-                counter += 1
-
-            while counter_job_balances != counter:
-                if len(text_balances) >= 3500:
-                    self.client.send_message(Id_private_log, text_balances)
-                    text_balances = ""
-
-            self.client.send_message(Id_private_log, text_balances)
+            jobs = roster_jobs(roster)
+            stream_records(
+                gather_records(job_get_balances, jobs),
+                lambda text: self.client.send_message(Id_private_log, text),
+                header="**💰All Balances💰**\n\n")
 
             self.message.reply('☑')
 
@@ -295,11 +349,8 @@ class MyButtonHandler:
             signal = Signals.get(Signals.id_signal == id_signal)
 
             # prevent to set terget that may make loss
-            account_list = config["ACCOUNTS"]["account1"].split(",")
-            key = account_list[0]
-            secret = account_list[1]
-            base_binance = Binance(key=key, secret=secret)
-            price = base_binance.get_price(signal.symbol)
+            base_binance = get_binance(key=roster[0].key, secret=roster[0].secret)
+            price = price_feed.get_price(signal.symbol, base_binance.client)
             if signal.kind == 'long':
                 if target < price:
                     text = "⚠ Target << Price !"
@@ -314,34 +365,7 @@ class MyButtonHandler:
 
             id_target = randStr()
 
-            global text_settarget, counter_job_settarget
-            text_settarget = ""
-            counter_job_settarget = 0
-            counter = 0
-
-            accounts = config["ACCOUNTS"].items()
-            proxies = list(config["PROXIES"].values())
-            div = int(len(accounts)/len(proxies))+1
-            proxy = proxies[0]
-            logger.info("Connecting with proxy: %s", proxy)
-            i = 0
-            for account_name, account in accounts:
-                i += 1
-                if (i % div == 0) and i != 1:
-                    proxy = proxies[proxies.index(proxy)+1]
-                    logger.info("Connecting with proxy: %s", proxy)
-
-                account_list = account.split(",")
-                key = account_list[0]
-                secret = account_list[1]
-
-                scheduler.add_job(
-                    job_set_target,
-                    args=[key, secret, account_name,
-                          proxy, signal, target, id_target],
-                    misfire_grace_time=None
-                )
-                counter += 1
+            jobs = roster_jobs(roster, signal, target, id_target)
 
             # Save targets in database
             number_target = 0
@@ -350,23 +374,34 @@ class MyButtonHandler:
                 id_target=id_target
             )
 
-            while counter_job_settarget != counter:
-                if len(text_settarget) >= 3500:
-                    self.client.send_message(Id_private_log, text_settarget)
-                    text_settarget = ""
-
-            if text_settarget != "":
-                self.client.send_message(Id_private_log, text_settarget)
+            stream_records(
+                gather_records(job_set_target, jobs, lane=ORDERS),
+                lambda text: self.client.send_message(Id_private_log, text))
 
             text = """تارگت تنظیم شد . ☑️"""
             # print(text)
             self.message.reply(text=text, reply_to_message_id=self.message.id)
 
+        elif self.text == '/proxy_stats':
+            text = "\n\n".join(
+                summary for summary in (proxy_pool.summary(), rate_limiter.summary())
+                if summary) or "No proxies configured."
+            self.message.reply(text=text, reply_to_message_id=self.message.id)
+
+        elif self.text == '/balance_stats':
+            text = balance_cache.summary(account.name for account in roster)
+            self.message.reply(text=text, reply_to_message_id=self.message.id)
+
+        elif self.text == '/latency':
+            traces = tracer.traces()
+            text = traces[-1].summary() if traces else "No signal traced yet."
+            self.message.reply(text=text, reply_to_message_id=self.message.id)
+
         elif self.text.startswith('/limit_balance '):
             limit_balance = self.text.replace("/limit_balance ", "")
             limit_balance = float(limit_balance)
 
-            self.settings.set_limit_balance(limit_balance)
+            Settings.get(Settings.id == 0).set_limit_balance(limit_balance)
 
             text = """ تنظیم شد . ☑️"""
             self.message.reply(text=text, reply_to_message_id=self.message.id)
@@ -386,11 +421,8 @@ class MyButtonHandler:
             signal = Signals.get(Signals.id_signal == id_signal)
 
             # prevent to set wrong stop loss
-            account_list = config["ACCOUNTS"]["account1"].split(",")
-            key = account_list[0]
-            secret = account_list[1]
-            base_binance = Binance(key=key, secret=secret)
-            price = base_binance.get_price(signal.symbol)
+            base_binance = get_binance(key=roster[0].key, secret=roster[0].secret)
+            price = price_feed.get_price(signal.symbol, base_binance.client)
             if signal.kind == 'long':
                 if stop_loss > price:
                     text = "⚠ Stop Loss >> Price !"
@@ -405,52 +437,21 @@ class MyButtonHandler:
 
             id_stop = randStr()+"_stoploss"
 
-            global text_setstop, counter_job_setstop
-            text_setstop = ""
-            counter_job_setstop = 0
-            counter = 0
-
-            accounts = config["ACCOUNTS"].items()
-            proxies = list(config["PROXIES"].values())
-            div = int(len(accounts)/len(proxies))+1
-            proxy = proxies[0]
-            logger.info("Connecting with proxy: %s", proxy)
-            i = 0
-            for account_name, account in accounts:
-                i += 1
-                if (i % div == 0) and i != 1:
-                    proxy = proxies[proxies.index(proxy)+1]
-                    logger.info("Connecting with proxy: %s", proxy)
-
-                account_list = account.split(",")
-                key = account_list[0]
-                secret = account_list[1]
-
-                scheduler.add_job(
-                     job_set_stop_loss,
-                    args=[key, secret, account_name,
-                          proxy, signal, stop_loss, id_stop],
-                    misfire_grace_time=None
-                )
-                counter += 1
-
-            while counter_job_setstop != counter:
-                if len(text_setstop) >= 3500:
-                    self.client.send_message(Id_private_log, text_setstop)
-                    text_setstop = ""
-
-            if text_setstop != "":
-                self.client.send_message(Id_private_log, text_setstop)
+            jobs = roster_jobs(roster, signal, stop_loss, id_stop)
+            stream_records(
+                gather_records(job_set_stop_loss, jobs, lane=ORDERS),
+                lambda text: self.client.send_message(Id_private_log, text))
+            order_writer.flush()
 
             text = """استاپ لاس تنظیم شد . ☑️"""
             # print(text)
             self.message.reply(text=text, reply_to_message_id=self.message.id)
 
 
-def job_status_positions(message, symbol, key, secret, account_name, proxy, public=False):
-    global text_positions, counter_job
+def job_status_positions(account, message, symbol, public=False):
+    account_name = account.name
     # logger.info(f"Getting positions, for account : {account_name} .")
-    binance = Binance(key=key, secret=secret, proxy=proxy)
+    binance = account.binance
 
     try:
         position = binance.get_position(symbol)
@@ -464,73 +465,28 @@ def job_status_positions(message, symbol, key, secret, account_name, proxy, publ
 
     except Exception as e:
         print(e)
-        counter_job += 1
-        return
-
-    if text_positions != "":
-        text_positions += "➰➰➰➰➰➰➰➰➰➰➰➰"
-
-    if entry == 0.0:
-        text_positions += f"""
-📌account : {account_name}  📍**{symbol}**
-NOT FOUND ❌
-"""
+        return None
 
-        counter_job += 1
-        return
+    return PositionRecord(account_name, symbol, leverage, size, pnl, liq, entry, mark, public)
 
-    pnl_percent = round(((mark/entry)-1)*leverage*100, 2)
-
-    margin = (size*mark)/leverage
-    margin = round(margin, 4)
-
-    if public:
-        text_positions += f"""
-📌account : {account_name}
-📍**XXXUSDT**      ⚓️**{leverage}**X
-❗️PNL:**{pnl}**     ❗️PNL%:**{pnl_percent}**                 
-🔸ENTRY:**X.x**     🔸MARK:**X.x**
-💰MARGIN:**{margin}**       ⚠️Liq:**{liq}**f
-"""
-    else:
-        text_positions += f"""
-📌account : {account_name}
-📍**{symbol}**      ⚓️**{leverage}**X
-❗️PNL:**{pnl}**     ❗️PNL%:**{pnl_percent}**                 
-🔸ENTRY:**{entry}**     🔸MARK:**{mark}**
-💰MARGIN:**{margin}**       ⚠️Liq:**{liq}**f
-"""
-
-    # print(text_positions)
-    counter_job += 1
-
-
-def job_get_balances(key, secret, account_name, proxy):
-    global text_balances, counter_job_balances
-
-    if text_balances == "":
-        text_balances += "**💰All Balances💰**\n\n"
 
+def job_get_balances(account):
     try:
-        binance = Binance(key=key, secret=secret, proxy=proxy)
+        binance = account.binance
         balance = binance.get_balance()
-        # logger.info(f"Balance for account : {key[:20]}, is : {balance}")
-        text_balances += f"📌account : {account_name}\n💲balance : **{balance}**\n\n"
+        balance_cache.update(account.name, balance)
+        # logger.info(f"Balance for account : {account.key[:20]}, is : {balance}")
+        return BalanceRecord(account.name, balance)
     except Exception as error:
         print(error)
+        return None
 
-    counter_job_balances += 1
-
-
-def job_get_pnls(symbol, start_time_lastweek_timestamp, start_time_lastmounth_timestamp,
-                 end_time_timestamp, key, secret, account_name, proxy):
-    global text_pnls, counter_job_pnls
-
-    # if text_pnls == "":
-    #     text_pnls += "**💰All PNLS**\n\n"
 
+def job_get_pnls(account, symbol, start_time_lastweek_timestamp, start_time_lastmounth_timestamp,
+                 end_time_timestamp):
+    account_name = account.name
     try:
-        binance = Binance(key=key, secret=secret, proxy=proxy)
+        binance = account.binance
         pnl_lastday = binance.get_last_pnl(
             symbol, end_time_timestamp, end_time_timestamp)
         pnl_lastday = round(pnl_lastday, 2)
@@ -545,30 +501,31 @@ def job_get_pnls(symbol, start_time_lastweek_timestamp, start_time_lastmounth_ti
         except Exception as error:
             print(error)
         # logger.info(f"Balance for account : {key[:20]}, is : {balance}")
-        # text_pnls += f"📌account : {account_name}\npnl : **{pnl}**\n\n"
-        text_pnls += f"\n{account_name},{pnl_lastday},{pnl_lastweek},{pnl_lastmounth}"
+        return PnlRecord(account_name, pnl_lastday, pnl_lastweek, pnl_lastmounth)
 
     except Exception as error:
         print(error)
+        return None
 
-    counter_job_pnls += 1
 
-
-def job_set_target(key, secret, account_name, proxy, signal, target, id_target):
-    global text_settarget, counter_job_settarget
+def job_set_target(account, signal, target, id_target):
+    account_name = account.name
     # logger.info(f"Cancelling signal from user, for account : {account_name} .")
 
-    binance = Binance(key=key, secret=secret, proxy=proxy)
+    binance = account.binance
 
-    openOrder = binance.get_order(
-        symbol=signal.symbol, ClientOrderId=signal.id_signal)
-    if not openOrder:
-        text = f'order not setted for account {account_name} yet!'
-        logger.warn(text)
-        text_settarget += text + "\n"
-        counter_job_settarget += 1
-        return
-    size = float(openOrder['origQty'])
+    # ordered size is in the ledger for entries the bot placed
+    position = position_ledger.get(signal.id_signal, account_name)
+    if position and position['quantity']:
+        size = position['quantity']
+    else:
+        openOrder = binance.get_order(
+            symbol=signal.symbol, ClientOrderId=signal.id_signal)
+        if not openOrder:
+            text = f'order not setted for account {account_name} yet!'
+            logger.warn(text)
+            return text + "\n"
+        size = float(openOrder['origQty'])
 
     decimal_coin = binance.get_decimal_coin(signal.symbol)
     price_target = target
@@ -595,17 +552,17 @@ def job_set_target(key, secret, account_name, proxy, signal, target, id_target):
 **🚨Log in setting targets.**
 **Account** : {account_name}
 **Error :** `{text}`            """
-        text_settarget += text+'\n'
+        return text+'\n'
         # bot.send_message(admin, text)
 
-    counter_job_settarget += 1
+    return ""
 
 
-def job_set_stop_loss(key, secret, account_name, proxy, signal, stop_loss, id_stop):
-    global text_setstop, counter_job_setstop
+def job_set_stop_loss(account, signal, stop_loss, id_stop):
+    account_name = account.name
     # logging.info(f"Setting stop loss with hand ...")
 
-    binance = Binance(key=key, secret=secret, proxy=proxy)
+    binance = account.binance
 
     # stop_loss
     try:
@@ -628,15 +585,11 @@ def job_set_stop_loss(key, secret, account_name, proxy, signal, stop_loss, id_st
 **Account** : {account_name}
 **Error :** `{text}`            """
 
-        text_setstop += text+'\n'
-        counter_job_setstop += 1
-
-        return
+        return text+'\n'
 
     # save clientOrderId and orderId stoploss for cancel it later
-    signal.set_id_stoploss(order['orderId'])
-    signal.set_client_id_stoploss(order['clientOrderId'])
-    counter_job_setstop += 1
+    order_writer.add(signal.id_signal, account_name, STOPLOSS, order)
+    return ""
 
 
 B_back = "برگشت 🔙"
@@ -674,45 +627,14 @@ class MyCallbackHandler:
             id_signal = self.data.replace("cancel_", "")
             signal = Signals.get(Signals.id_signal == id_signal)
 
-            global text_closepositions, counter_job_closepositions
-            text_closepositions = ""
-            counter_job_closepositions = 0
-            counter = 0
-
-            accounts = config["ACCOUNTS"].items()
-            proxies = list(config["PROXIES"].values())
-            div = int(len(accounts)/len(proxies))+1
-            proxy = proxies[0]
-            logger.info("Connecting with proxy: %s", proxy)
-            i = 0
-            for account_name, account in accounts:
-                i += 1
-                if (i % div == 0) and i != 1:
-                    proxy = proxies[proxies.index(proxy)+1]
-                    logger.info("Connecting with proxy: %s", proxy)
-
-                account_list = account.split(",")
-                key = account_list[0]
-                secret = account_list[1]
-
-                scheduler.add_job(
-                    job_close_position,
-                    args=[key, secret, account_name, proxy, signal],
-                    misfire_grace_time=None
-                )
-                counter += 1
-
-            while counter_job_closepositions != counter:
-                if len(text_closepositions) >= 3500:
-                    self.client.send_message(
-                        Id_private_log, text=text_closepositions, reply_to_message_id=self.message.id)
-                    text_closepositions = ""
-            # print(counter_job_closepositions,counter)
-
-            if text_closepositions != "":
-                self.client.send_message(
-                    Id_private_log, text=text_closepositions,
-                    parse_mode=ParseMode.MARKDOWN, reply_to_message_id=self.message.id)
+            jobs = roster_jobs(roster, signal)
+            stream_records(
+                gather_records(job_close_position, jobs, lane=ORDERS),
+                lambda text: self.client.send_message(
+                    Id_private_log, text=text,
+                    parse_mode=ParseMode.MARKDOWN, reply_to_message_id=self.message.id))
+            order_writer.flush()
+            position_ledger.flush()
 
             signal.set_status('CANCELED')
 
@@ -735,48 +657,15 @@ class MyCallbackHandler:
             id_signal = self.data.replace("closestop_", "")
             signal = Signals.get(Signals.id_signal == id_signal)
 
-            global text_closestop, counter_job_closestop
-            text_closestop = ""
-            counter_job_closestop = 0
-            counter = 0
-
-            accounts = config["ACCOUNTS"].items()
-            proxies = list(config["PROXIES"].values())
-            div = int(len(accounts)/len(proxies))+1
-            proxy = proxies[0]
-            logger.info("Connecting with proxy: %s", proxy)
-            i = 0
-            for account_name, account in accounts:
-                i += 1
-                if (i % div == 0) and i != 1:
-                    proxy = proxies[proxies.index(proxy)+1]
-                    logger.info("Connecting with proxy: %s", proxy)
-
-                account_list = account.split(",")
-                key = account_list[0]
-                secret = account_list[1]
-
-                scheduler.add_job(
-                    job_close_stop_loss,
-                    args=[key, secret, account_name, proxy, signal],
-                    misfire_grace_time=None
-                )
-                counter += 1
-
-                # pass close stop loss on other action
-                # signal.set_client_id_stoploss('a')
-
-            while counter_job_closestop != counter:
-                if len(text_closestop) >= 3500:
-                    self.client.send_message(
-                        Id_private_log, text=text_closestop,
-                        reply_to_message_id=self.message.id)
-                    text_closestop = ""
-
-            if text_closestop != "":
-                self.client.send_message(
-                    Id_private_log, text=text_closestop,
-                    parse_mode=ParseMode.MARKDOWN, reply_to_message_id=self.message.id)
+            jobs = roster_jobs(roster, signal)
+            # pass close stop loss on other action
+            # signal.set_client_id_stoploss('a')
+            stream_records(
+                gather_records(job_close_stop_loss, jobs, lane=ORDERS),
+                lambda text: self.client.send_message(
+                    Id_private_log, text=text,
+                    parse_mode=ParseMode.MARKDOWN, reply_to_message_id=self.message.id))
+            order_writer.flush()
 
             text = """استاپ لاس بسته شد . ☑️"""
             self.client.send_message(
@@ -800,45 +689,12 @@ class MyCallbackHandler:
             id_signal = self.data.replace("closetargets_", "")
             signal = Signals.get(Signals.id_signal == id_signal)
 
-            global text_closetargets, counter_job_closetargets
-            text_closetargets = ""
-            counter_job_closetargets = 0
-            counter = 0
-
-            accounts = config["ACCOUNTS"].items()
-            proxies = list(config["PROXIES"].values())
-            div = int(len(accounts)/len(proxies))+1
-            proxy = proxies[0]
-            logger.info("Connecting with proxy: %s", proxy)
-            i = 0
-            for account_name, account in accounts:
-                i += 1
-                if (i % div == 0) and i != 1:
-                    proxy = proxies[proxies.index(proxy)+1]
-                    logger.info("Connecting with proxy: %s", proxy)
-
-                account_list = account.split(",")
-                key = account_list[0]
-                secret = account_list[1]
-
-                scheduler.add_job(
-                    job_close_targets,
-                    args=[key, secret, account_name, proxy, signal],
-                    misfire_grace_time=None
-                )
-                counter += 1
-
-            while counter_job_closetargets != counter:
-                if len(text_closetargets) >= 3500:
-                    self.client.send_message(
-                        Id_private_log, text=text_closetargets,
-                        reply_to_message_id=self.message.id)
-                    text_closetargets = ""
-
-            if text_closetargets != "":
-                self.client.send_message(
-                    Id_private_log, text=text_closetargets,
-                    parse_mode=ParseMode.MARKDOWN, reply_to_message_id=self.message.id)
+            jobs = roster_jobs(roster, signal)
+            stream_records(
+                gather_records(job_close_targets, jobs, lane=ORDERS),
+                lambda text: self.client.send_message(
+                    Id_private_log, text=text,
+                    parse_mode=ParseMode.MARKDOWN, reply_to_message_id=self.message.id))
 
             text = """تارگت ها بسته شد . ☑️"""
             self.client.send_message(
@@ -854,11 +710,8 @@ class MyCallbackHandler:
             id_signal = self.data.replace("rollingstop_", "")
             signal = Signals.get(Signals.id_signal == id_signal)
 
-            account_list = config["ACCOUNTS"]["account1"].split(",")
-            key = account_list[0]
-            secret = account_list[1]
-            base_binance = Binance(key=key, secret=secret)
-            price = base_binance.get_price(signal.symbol)
+            base_binance = get_binance(key=roster[0].key, secret=roster[0].secret)
+            price = price_feed.get_price(signal.symbol, base_binance.client)
 
             entry = signal.entry
             if 'market' in str(entry):
@@ -872,45 +725,13 @@ class MyCallbackHandler:
                     text = "⚠ Entry << Price !"
                     return self.message.reply_text(text)
 
-            global text_rollingstop, counter_job_rollingstop
-            text_rollingstop = ""
-            counter_job_rollingstop = 0
-            counter = 0
-
-            accounts = config["ACCOUNTS"].items()
-            proxies = list(config["PROXIES"].values())
-            div = int(len(accounts)/len(proxies))+1
-            proxy = proxies[0]
-            logger.info("Connecting with proxy: %s", proxy)
-            i = 0
-            for account_name, account in accounts:
-                i += 1
-                if (i % div == 0) and i != 1:
-                    proxy = proxies[proxies.index(proxy)+1]
-                    logger.info("Connecting with proxy: %s", proxy)
-
-                account_list = account.split(",")
-                key = account_list[0]
-                secret = account_list[1]
-
-                scheduler.add_job(
-                    job_rolling_stop_loss,
-                    args=[key, secret, account_name, proxy, signal],
-                    misfire_grace_time=None
-                )
-                counter += 1
-
-            while counter_job_rollingstop != counter:
-                if len(text_rollingstop) >= 3500:
-                    self.client.send_message(
-                        Id_private_log, text=text_rollingstop,
-                        reply_to_message_id=self.message.id)
-                    text_rollingstop = ""
-
-            if text_rollingstop != "":
-                self.client.send_message(
-                    Id_private_log, text=text_rollingstop,
-                    parse_mode=ParseMode.MARKDOWN, reply_to_message_id=self.message.id)
+            jobs = roster_jobs(roster, signal)
+            stream_records(
+                gather_records(job_rolling_stop_loss, jobs, lane=ORDERS),
+                lambda text: self.client.send_message(
+                    Id_private_log, text=text,
+                    parse_mode=ParseMode.MARKDOWN, reply_to_message_id=self.message.id))
+            order_writer.flush()
 
             text = """استاپ لاس روی نقطه ورود تنظیم شد . ☑️"""
             self.client.send_message(
@@ -928,51 +749,16 @@ class MyCallbackHandler:
             symbol = self.data.replace('positions_', '')
             self.message.delete()
 
-            global text_positions, counter_job
-            text_positions = ""
-            counter_job = 0
-            counter = 0
-
             print(symbol)
             # # if signal is not open
             # if len(Targets.select().where((Targets.owner == symbol) and (Targets.status == 'OPEN'))) == 0:
             #     continue
 
-            text_positions = ""
-
-            accounts = config["ACCOUNTS"].items()
-            proxies = list(config["PROXIES"].values())
-            div = int(len(accounts)/len(proxies))+1
-            proxy = proxies[0]
-            logger.info("Connecting with proxy: %s", proxy)
-            i = 0
-
-            for account_name, account in accounts:
-                i += 1
-                if (i % div == 0) and i != 1:
-                    proxy = proxies[proxies.index(proxy)+1]
-                    logger.info("Connecting with proxy: %s", proxy)
-
-                account_list = account.split(",")
-                key = account_list[0]
-                secret = account_list[1]
-
-                scheduler.add_job(
-                    job_status_positions,
-                    args=[self.message, symbol, key,
-                          secret, account_name, proxy],
-                    misfire_grace_time=None
-                )
-                counter += 1
-
-            while counter_job != counter:
-                if len(text_positions) >= 3500:
-                    self.client.send_message(Id_private_log, text_positions)
-                    text_positions = ""
-                pass
-            # if text_positions == "":
-            #     text_positions = """پوزیشن بازی وجود ندارد!"""
-            self.client.send_message(Id_private_log, text_positions)
+            jobs = roster_jobs(roster, self.message, symbol)
+            stream_records(
+                gather_records(job_status_positions, jobs),
+                lambda text: self.client.send_message(Id_private_log, text),
+                separator="➰➰➰➰➰➰➰➰➰➰➰➰")
 
             self.message.reply('☑')
 
@@ -1000,44 +786,17 @@ class MyCallbackHandler:
             start_time_lastmounth_timestamp = int(
                 start_time_lastmounth.timestamp())*1000
 
-            global text_pnls, counter_job_pnls
-
-            text_pnls = ""
-            counter_job_pnls = 0
-            counter = 0
-
-            accounts = config["ACCOUNTS"].items()
-            proxies = list(config["PROXIES"].values())
-            div = int(len(accounts)/len(proxies))+1
-            proxy = proxies[0]
-            logger.info("Connecting with proxy: %s", proxy)
-            i = 0
-            for account_name, account in accounts:
-                i += 1
-                if (i % div == 0) and i != 1:
-                    proxy = proxies[proxies.index(proxy)+1]
-                    logger.info("Connecting with proxy: %s", proxy)
-
-                account_list = account.split(",")
-                key = account_list[0]
-                secret = account_list[1]
-
-                scheduler.add_job(
-                    job_get_pnls,
-                    args=[symbol, start_time_lastweek_timestamp, start_time_lastmounth_timestamp,
-                          end_time_timestamp, key, secret, account_name, proxy],
-                    misfire_grace_time=None
-                )
-                counter += 1
+            jobs = roster_jobs(roster, symbol, start_time_lastweek_timestamp,
+                               start_time_lastmounth_timestamp, end_time_timestamp)
 
-            while counter_job_pnls != counter:
+            collector = ResultCollector(account.name for account in roster)
+            for record in gather_records(job_get_pnls, jobs, collector):
                 pass
 
+            # failed accounts are notes, the sheet only holds pnl rows
             rows_exel = [['Account', 'Day', 'Week', 'Month']]
-            for account_pnl in text_pnls.split("\n"):
-                if not account_pnl:
-                    continue
-                rows_exel.append(account_pnl.split(','))
+            rows_exel += [record.row() for record in collector.records()
+                          if isinstance(record, PnlRecord)]
 
             wb = Workbook()
             ws = wb.active
@@ -1121,52 +880,55 @@ class MyCallbackHandler:
                 chat_id=self.user_id, document="pnls.xlsx",)
 
 
-def job_close_position(key, secret, account_name, proxy, signal):
-    global text_closepositions, counter_job_closepositions
+def job_close_position(account, signal):
+    account_name = account.name
     logger.info(f"Cancelling signal from user, for account : {account_name} .")
 
-    binance = Binance(key=key, secret=secret, proxy=proxy)
+    binance = account.binance
 
-    # try to cancel order if not open yet
-    try:
-        openOrder = binance.get_order(
-            symbol=signal.symbol, ClientOrderId=signal.id_signal)
-        logger.info(openOrder)
-        if openOrder:
-            binance.cancel_open_order(
-                signal.symbol,
-                ClientOrderId=openOrder['clientOrderId'],
-                orderId=openOrder['orderId']
-            )
-    except ClientError as error:
-        pass
+    # try to cancel order if not open yet, unless the ledger has it filled
+    position = position_ledger.get(signal.id_signal, account_name)
+    if position is None or position['status'] != FILLED:
+        try:
+            openOrder = binance.get_order(
+                symbol=signal.symbol, ClientOrderId=signal.id_signal)
+            logger.info(openOrder)
+            if openOrder:
+                binance.cancel_open_order(
+                    signal.symbol,
+                    ClientOrderId=openOrder['clientOrderId'],
+                    orderId=openOrder['orderId']
+                )
+        except ClientError as error:
+            pass
 
     try:
         binance.cancel_order(signal.symbol, signal.kind)
+        position_ledger.set_status(signal.id_signal, account_name, CLOSED)
     except Exception as e:
         pass
 
-    # Get old order stop_loss
-    try:
-        old_order_stoploss = binance.get_order(
-            symbol=signal.symbol, ClientOrderId=signal.client_id_stoploss)
-    except ClientError as error:
-        text = "Found error. status: {}, error code: {}, error message: {}, for account: {}".format(
-            error.status_code, error.error_code, error.error_message, account_name
-        )
-        logger.error(text)
-        text = f"""\n
+    # Get old order stop_loss, from local state when the bot placed it
+    old_order_stoploss = order_writer.open_order(signal.id_signal, account_name)
+    if old_order_stoploss is None:
+        try:
+            old_order_stoploss = binance.get_order(
+                symbol=signal.symbol,
+                ClientOrderId=order_writer.client_order_id(signal, account_name))
+        except ClientError as error:
+            text = "Found error. status: {}, error code: {}, error message: {}, for account: {}".format(
+                error.status_code, error.error_code, error.error_message, account_name
+            )
+            logger.error(text)
+            text = f"""\n
 **🚨Log in canceling with hand.**
 **Account** : {account_name}
 **Error :** `{text}`            """
-        text_closepositions += text
-        # self.client.send_message(self.user_id, text)
-        counter_job_closepositions += 1
-        return
+            # self.client.send_message(self.user_id, text)
+            return text
     # if not found order or None order
     if not old_order_stoploss:
-        counter_job_closepositions += 1
-        return
+        return ""
     # cancel stoploss
     try:
         binance.cancel_open_order(
@@ -1183,41 +945,41 @@ def job_close_position(key, secret, account_name, proxy, signal):
 **🚨Log in canceling stoploss with hand.**
 **Account** : {account_name}
 **Error :** `{text}`            """
-        text_closepositions += text
         # self.client.send_message(self.user_id, text)
+        return text
 
-    counter_job_closepositions += 1
-    # print('counter_job_closepositions', counter_job_closepositions)
+    order_writer.add(signal.id_signal, account_name, STOPLOSS, old_order_stoploss, status='CANCELED')
+    return ""
 
 
-def job_close_stop_loss(key, secret, account_name, proxy, signal):
-    global text_closestop, counter_job_closestop
+def job_close_stop_loss(account, signal):
+    account_name = account.name
     logger.info(
         f"Clossing stop loss from user, for account : {account_name} .")
 
-    binance = Binance(key=key, secret=secret, proxy=proxy)
+    binance = account.binance
 
-    # Get old order stop_loss
-    try:
-        old_order_stoploss = binance.get_order(
-            symbol=signal.symbol, ClientOrderId=signal.client_id_stoploss)
-    except ClientError as error:
-        text = "Found error. status: {}, error code: {}, error message: {}, for account: {}".format(
-            error.status_code, error.error_code, error.error_message, account_name
-        )
-        logger.error(text)
-#         text = f"""
+    # Get old order stop_loss, from local state when the bot placed it
+    old_order_stoploss = order_writer.open_order(signal.id_signal, account_name)
+    if old_order_stoploss is None:
+        try:
+            old_order_stoploss = binance.get_order(
+                symbol=signal.symbol,
+                ClientOrderId=order_writer.client_order_id(signal, account_name))
+        except ClientError as error:
+            text = "Found error. status: {}, error code: {}, error message: {}, for account: {}".format(
+                error.status_code, error.error_code, error.error_message, account_name
+            )
+            logger.error(text)
+#             text = f"""
 # **🚨Log in canceling stoploss with hand.**
 # **Account** : {account_name}
 # **Error :** `{text}`            """
-#         self.client.send_message(self.user_id, text)
-        # text_closestop += text
-        counter_job_closestop += 1
-        return
+#             self.client.send_message(self.user_id, text)
+            return ""
     # if not found order or None order
     if not old_order_stoploss:
-        counter_job_closestop += 1
-        return
+        return ""
     logger.info(old_order_stoploss)
     # cancel stoploss
     try:
@@ -1235,18 +997,19 @@ def job_close_stop_loss(key, secret, account_name, proxy, signal):
 **🚨Log in canceling stoploss with hand.**
 **Account** : {account_name}
 **Error :** `{text}`            """
-        text_closestop += text
         # self.client.send_message(self.user_id, text)
+        return text
 
-    counter_job_closestop += 1
+    order_writer.add(signal.id_signal, account_name, STOPLOSS, old_order_stoploss, status='CANCELED')
+    return ""
 
 
-def job_close_targets(key, secret, account_name, proxy, signal):
-    global text_closetargets, counter_job_closetargets
+def job_close_targets(account, signal):
+    account_name = account.name
     logger.info(
         f"Closing targets from user, for account : {account_name} .")
 
-    binance = Binance(key=key, secret=secret, proxy=proxy)
+    binance = account.binance
 
     targets = Targets.select().where(Targets.owner == signal)
     for target in targets:
@@ -1286,30 +1049,32 @@ def job_close_targets(key, secret, account_name, proxy, signal):
             )
             logger.error(text)
 
-    counter_job_closetargets += 1
+    return ""
 
 
-def job_rolling_stop_loss(key, secret, account_name, proxy, signal):
-    global text_rollingstop, counter_job_rollingstop
+def job_rolling_stop_loss(account, signal):
+    account_name = account.name
     logger.info(
         f"Rolling stop loss from user, for account : {account_name} .")
 
-    binance = Binance(key=key, secret=secret, proxy=proxy)
+    binance = account.binance
+    text_rollingstop = ""
 
-    # Get old order stop_loss
-    try:
-        old_order_stoploss = binance.get_order(
-            symbol=signal.symbol, ClientOrderId=signal.client_id_stoploss)
-    except ClientError as error:
-        text = "Found error. status: {}, error code: {}, error message: {}, for account: {}".format(
-            error.status_code, error.error_code, error.error_message, account_name
-        )
-        logger.error(text)
-        # counter_job_rollingstop += 1
-        # return
+    # Get old order stop_loss, from local state when the bot placed it
+    old_order_stoploss = order_writer.open_order(signal.id_signal, account_name)
+    if old_order_stoploss is None:
+        try:
+            old_order_stoploss = binance.get_order(
+                symbol=signal.symbol,
+                ClientOrderId=order_writer.client_order_id(signal, account_name))
+        except ClientError as error:
+            text = "Found error. status: {}, error code: {}, error message: {}, for account: {}".format(
+                error.status_code, error.error_code, error.error_message, account_name
+            )
+            logger.error(text)
+            # return
     # if not found order or None order
     if old_order_stoploss:
-        # counter_job_rollingstop += 1
         # return
         logger.info(old_order_stoploss)
         # cancel stoploss
@@ -1331,19 +1096,23 @@ def job_rolling_stop_loss(key, secret, account_name, proxy, signal):
             text_rollingstop += text
             # self.client.send_message(self.user_id, text)
 
-    openOrder = binance.get_order(
-        symbol=signal.symbol, ClientOrderId=signal.id_signal)
-    if not openOrder:
-        text = f'order not setted for account {account_name} yet!'
-        logger.warn(text)
-        text_rollingstop += text + "\n"
-        counter_job_rollingstop += 1
-        return
-    print(openOrder)
-
-    stop_loss = float(openOrder['avgPrice'])
-    if stop_loss == 0.0:
-        stop_loss = float(openOrder['price'])
+    # entry price of a filled position is in the ledger
+    position = position_ledger.get(signal.id_signal, account_name)
+    if position and position['status'] == FILLED and position['entry_price']:
+        stop_loss = position['entry_price']
+    else:
+        openOrder = binance.get_order(
+            symbol=signal.symbol, ClientOrderId=signal.id_signal)
+        if not openOrder:
+            text = f'order not setted for account {account_name} yet!'
+            logger.warn(text)
+            text_rollingstop += text + "\n"
+            return text_rollingstop
+        print(openOrder)
+
+        stop_loss = float(openOrder['avgPrice'])
+        if stop_loss == 0.0:
+            stop_loss = float(openOrder['price'])
     print("stop", stop_loss)
 
     # set stop loss on entry point
@@ -1357,11 +1126,9 @@ def job_rolling_stop_loss(key, secret, account_name, proxy, signal):
             signal.symbol, stop_loss, ClientOrderId)
 
     # save clientOrderId and orderId stoploss for cancel it later
-    signal.set_id_stoploss(order_stoploss['orderId'])
-    signal.set_client_id_stoploss(
-        order_stoploss['clientOrderId'])
+    order_writer.add(signal.id_signal, account_name, STOPLOSS, order_stoploss)
 
-    counter_job_rollingstop += 1
+    return text_rollingstop
 
 
 def randStr(chars=string.ascii_uppercase + string.ascii_lowercase + string.digits, N=22):
@@ -0,0 +1,174 @@
+"""
+Per-account position ledger: what each account actually holds per signal.
+
+Entry results and fill events are merged into one row per (signal,
+account) holding the ordered and filled quantity and the average entry
+price. Panel actions read it instead of querying every account's order
+history: the rows of a signal are loaded with one query the first time
+any account needs them and stay in memory while the signal is recent.
+Changed rows are upserted in bulk, like `account_orders.order_writer`.
+"""
+
+import collections
+import configparser
+import datetime
+import logging
+import threading
+from typing import Dict, Optional
+
+from models import Positions
+
+logger = logging.getLogger(__name__)
+
+NEW = 'NEW'
+PARTIALLY_FILLED = 'PARTIALLY_FILLED'
+FILLED = 'FILLED'
+CLOSED = 'CLOSED'
+CANCELED = 'CANCELED'
+
+# rows per INSERT, well below SQLite's bound-parameter limit
+CHUNK_SIZE = 100
+
+_FIELDS = ('symbol', 'kind', 'quantity', 'filled_qty', 'entry_price', 'status')
+
+
+class PositionLedger:
+    """
+    In-memory view of the `Positions` table with batched writes.
+
+    Args:
+        keep_signals: Signals whose rows stay cached
+    """
+
+    def __init__(self, keep_signals: int = 20):
+        self.keep_signals = keep_signals
+        # signal ID -> account name -> row
+        self._signals: Dict[str, Dict[str, dict]] = collections.OrderedDict()
+        self._dirty = set()
+        self._lock = threading.RLock()
+
+    def _rows(self, signal_id: str) -> Dict[str, dict]:
+        # caller holds the lock
+        rows = self._signals.get(signal_id)
+        if rows is None:
+            rows = {
+                record.account: {field: getattr(record, field) for field in _FIELDS}
+                for record in Positions.select().where(Positions.signal == signal_id)
+            }
+            self._signals[signal_id] = rows
+            self._evict()
+        else:
+            self._signals.move_to_end(signal_id)
+        return rows
+
+    def _evict(self) -> None:
+        # only signals without unwritten rows can be dropped
+        dirty_signals = {signal_id for signal_id, _ in self._dirty}
+        for signal_id in list(self._signals):
+            if len(self._signals) <= self.keep_signals:
+                break
+            if signal_id not in dirty_signals:
+                del self._signals[signal_id]
+
+    def get(self, signal_id: str, account_name: str) -> Optional[dict]:
+        """Position of one account, None if the ledger has none."""
+        with self._lock:
+            row = self._rows(signal_id).get(account_name)
+            return dict(row) if row is not None else None
+
+    def update(self, signal_id: str, account_name: str, **fields) -> None:
+        """Merge fields into the position of one account."""
+        with self._lock:
+            row = self._rows(signal_id).setdefault(
+                account_name, dict.fromkeys(_FIELDS))
+            row.update(fields)
+            self._dirty.add((signal_id, account_name))
+
+    def record_entry(self, signal_id: str, account_name: str, symbol: str,
+                     kind: str, order: dict) -> None:
+        """
+        Record the entry order placed for a signal on one account.
+
+        Args:
+            signal_id: Signal the entry belongs to
+            account_name: Account the order was placed on
+            symbol: Trading pair symbol
+            kind: Position type ('long' or 'short')
+            order: Binance order response
+        """
+        with self._lock:
+            current = self._rows(signal_id).get(account_name) or {}
+            fields = {'symbol': symbol, 'kind': kind}
+            # a fill pushed by the stream may have arrived first
+            if not current.get('quantity'):
+                fields['quantity'] = float(order.get('origQty') or 0)
+            if current.get('status') is None:
+                fields['status'] = NEW
+            self.update(signal_id, account_name, **fields)
+        if order.get('status') in (PARTIALLY_FILLED, FILLED):
+            self.record_fill(signal_id, account_name, order)
+
+    def record_fill(self, signal_id: str, account_name: str, order: dict) -> None:
+        """
+        Record the fill state of an entry order (REST- or stream-shaped).
+
+        Args:
+            signal_id: Signal the entry belongs to
+            account_name: Account of the order
+            order: Order with origQty, executedQty, avgPrice and status
+        """
+        fields = {
+            'quantity': float(order['origQty']),
+            'filled_qty': float(order.get('executedQty') or 0),
+            'entry_price': float(order.get('avgPrice') or 0) or None,
+        }
+        if order['status'] in (PARTIALLY_FILLED, FILLED):
+            fields['status'] = order['status']
+        elif order['status'] in ('CANCELED', 'EXPIRED'):
+            # a partly filled entry that was canceled still holds a position
+            fields['status'] = FILLED if fields['filled_qty'] else CANCELED
+        self.update(signal_id, account_name, **fields)
+
+    def set_status(self, signal_id: str, account_name: str, status: str) -> None:
+        self.update(signal_id, account_name, status=status)
+
+    def flush(self) -> int:
+        """
+        Upsert every changed position.
+
+        Returns:
+            Number of rows written
+        """
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            now = datetime.datetime.now()
+            rows = [
+                dict(self._signals[signal_id][account_name],
+                     signal=signal_id, account=account_name, updated_at=now)
+                for signal_id, account_name in dirty
+            ]
+        if not rows:
+            return 0
+
+        try:
+            for start in range(0, len(rows), CHUNK_SIZE):
+                Positions.insert_many(rows[start:start + CHUNK_SIZE]).on_conflict(
+                    conflict_target=[Positions.signal, Positions.account],
+                    preserve=[getattr(Positions, field) for field in _FIELDS]
+                    + [Positions.updated_at]
+                ).execute()
+        except Exception:
+            # keep the rows for the next flush
+            with self._lock:
+                self._dirty |= dirty
+            raise
+        logger.debug(f"Wrote {len(rows)} positions")
+        return len(rows)
+
+
+config = configparser.ConfigParser()
+config.optionxform = str
+config.read('config/bot.ini')
+
+position_ledger = PositionLedger(
+    keep_signals=config.getint('ACCOUNT_ORDERS', 'keep_signals', fallback=20))
@@ -0,0 +1,269 @@
+"""
+Proxy health tracking and latency-aware routing.
+
+Every REST call records its latency and outcome against the proxy it went
+through. A proxy is degraded while it is rate limited (HTTP 429/418, for
+`Retry-After` seconds), while its recent error rate is too high, or while
+its recent latency is too slow. Accounts keep their home proxy from the
+roster as long as it is healthy and are routed to the fastest healthy
+proxy otherwise; a periodic probe lets degraded proxies earn their
+accounts back.
+
+Failover is off unless `[PROXY_POOL] failover` enables it: Binance keys are
+usually whitelisted for one IP, and routing an account through another
+proxy would turn one slow proxy into -2015 rejections across its accounts.
+With failover enabled every API key has to be whitelisted for the IPs of
+all proxies, not only its home proxy. Health is tracked either way.
+"""
+
+import configparser
+import logging
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+from binance.um_futures import UMFutures
+
+logger = logging.getLogger(__name__)
+
+
+class ProxyStats:
+    """
+    Exponentially weighted latency and error rate of one proxy.
+
+    Args:
+        proxy: Proxy address (`IP:PORT`), None for direct connections
+        alpha: Weight of the newest sample in the moving averages
+    """
+
+    def __init__(self, proxy: Optional[str], alpha: float = 0.2):
+        self.proxy = proxy
+        self.alpha = alpha
+        self.latency = None
+        self.error_rate = 0.0
+        self.requests = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.banned_until = 0.0
+        self.last_error = None
+
+    def record(self, elapsed: float, error: Optional[BaseException] = None) -> None:
+        self.requests += 1
+        failed = 1.0 if error is not None else 0.0
+        if error is not None:
+            self.errors += 1
+            self.last_error = repr(error)
+
+        if self.latency is None:
+            self.latency = elapsed
+        else:
+            self.latency += self.alpha * (elapsed - self.latency)
+        self.error_rate += self.alpha * (failed - self.error_rate)
+
+    def ban(self, seconds: float) -> None:
+        self.rate_limited += 1
+        self.banned_until = max(self.banned_until, time.monotonic() + seconds)
+
+    @property
+    def banned(self) -> bool:
+        return time.monotonic() < self.banned_until
+
+    def as_dict(self) -> dict:
+        return {
+            'proxy': self.proxy,
+            'latency': self.latency,
+            'error_rate': self.error_rate,
+            'requests': self.requests,
+            'errors': self.errors,
+            'rate_limited': self.rate_limited,
+            'banned_for': max(0.0, self.banned_until - time.monotonic()),
+            'last_error': self.last_error,
+        }
+
+
+class ProxyPool:
+    """
+    Health of every proxy plus routing of accounts away from degraded ones.
+
+    Args:
+        failover: Route accounts off degraded proxies, False only tracks
+        max_error_rate: Error rate above which a proxy is degraded
+        max_latency: Average latency (seconds) above which a proxy is degraded
+        min_requests: Samples needed before error rate and latency count
+        ban_seconds: Degraded time after a 429/418 without `Retry-After`
+        request_timeout: Seconds a REST call may take before it fails
+        alpha: Weight of the newest sample in the moving averages
+    """
+
+    def __init__(
+        self,
+        failover: bool = False,
+        max_error_rate: float = 0.5,
+        max_latency: float = 3.0,
+        min_requests: int = 5,
+        ban_seconds: float = 60.0,
+        request_timeout: float = 10.0,
+        alpha: float = 0.2
+    ):
+        self.failover = failover
+        self.max_error_rate = max_error_rate
+        self.max_latency = max_latency
+        self.min_requests = min_requests
+        self.ban_seconds = ban_seconds
+        self.request_timeout = request_timeout
+        self.alpha = alpha
+        self._stats: Dict[Optional[str], ProxyStats] = {}
+        self._degraded = set()
+        self._probes: Dict[Optional[str], UMFutures] = {}
+        self._lock = threading.Lock()
+
+    def add(self, proxies: Iterable[Optional[str]]) -> None:
+        """Register proxies so they are routing candidates before their first call."""
+        for proxy in proxies:
+            self._get(proxy)
+
+    def _get(self, proxy: Optional[str]) -> ProxyStats:
+        stats = self._stats.get(proxy)
+        if stats is None:
+            with self._lock:
+                stats = self._stats.setdefault(proxy, ProxyStats(proxy, self.alpha))
+        return stats
+
+    def record(
+        self,
+        proxy: Optional[str],
+        elapsed: float,
+        error: Optional[BaseException] = None,
+        status_code: Optional[int] = None,
+        retry_after: Optional[float] = None
+    ) -> None:
+        """
+        Record the outcome of one REST call.
+
+        Args:
+            proxy: Proxy the call went through
+            elapsed: Seconds the call took
+            error: Transport or server error, None on success
+            status_code: HTTP status of the response, if any
+            retry_after: `Retry-After` header of a 429/418 response
+        """
+        stats = self._get(proxy)
+        with self._lock:
+            stats.record(elapsed, error)
+            if status_code in (429, 418):
+                stats.ban(retry_after or self.ban_seconds)
+        self._update_state(stats)
+
+    def _is_healthy(self, stats: ProxyStats) -> bool:
+        if stats.banned:
+            return False
+        if stats.requests < self.min_requests:
+            return True
+        if stats.error_rate > self.max_error_rate:
+            return False
+        return stats.latency is None or stats.latency <= self.max_latency
+
+    def _update_state(self, stats: ProxyStats) -> None:
+        healthy = self._is_healthy(stats)
+        if not healthy and stats.proxy not in self._degraded:
+            self._degraded.add(stats.proxy)
+            latency = f"{stats.latency:.2f}s" if stats.latency is not None else "-"
+            logger.warning(
+                f"Proxy {stats.proxy} degraded: latency={latency} "
+                f"error_rate={stats.error_rate:.0%} banned={stats.banned}"
+                + ("" if self.failover else ", failover is off so its accounts stay on it"))
+        elif healthy and stats.proxy in self._degraded:
+            self._degraded.discard(stats.proxy)
+            logger.info(f"Proxy {stats.proxy} recovered")
+
+    def is_healthy(self, proxy: Optional[str]) -> bool:
+        return self._is_healthy(self._get(proxy))
+
+    def check_failover(self) -> List[Optional[str]]:
+        """
+        Warn about degraded proxies that keep their accounts, failover being off.
+
+        Returns:
+            Those proxies, always empty with failover on
+        """
+        if self.failover:
+            return []
+        degraded = [stats.proxy for stats in list(self._stats.values())
+                    if stats.proxy is not None and not self._is_healthy(stats)]
+        for proxy in degraded:
+            logger.warning(
+                f"Proxy {proxy} is degraded and failover is off, its accounts stay on it; "
+                f"set [PROXY_POOL] failover = true once every API key is whitelisted "
+                f"for the IPs of all proxies")
+        return degraded
+
+    def route(self, home: Optional[str]) -> Optional[str]:
+        """
+        Proxy an account should use right now.
+
+        Args:
+            home: Proxy assigned to the account by the roster
+
+        Returns:
+            `home` while it is healthy, otherwise the healthy proxy with
+            the lowest latency, or `home` again if none is healthy
+        """
+        if home is None or not self.failover or self.is_healthy(home):
+            return home
+
+        candidates = [
+            stats for proxy, stats in list(self._stats.items())
+            if proxy is not None and self._is_healthy(stats)
+        ]
+        if not candidates:
+            return home
+        best = min(
+            candidates,
+            key=lambda stats: stats.latency if stats.latency is not None else 0.0)
+        return best.proxy
+
+    def probe(self) -> None:
+        """Ping Binance through every proxy so idle or degraded ones get fresh samples."""
+        for proxy in list(self._stats):
+            client = self._probes.get(proxy)
+            if client is None:
+                proxies = {'https': 'http://'+proxy} if proxy else None
+                client = UMFutures(proxies=proxies, timeout=self.request_timeout)
+                self._probes[proxy] = client
+            start_time = time.perf_counter()
+            try:
+                client.ping()
+                error = None
+            except Exception as e:
+                error = e
+            self.record(proxy, time.perf_counter() - start_time, error,
+                        getattr(error, 'status_code', None))
+
+    def stats(self) -> List[dict]:
+        with self._lock:
+            return [stats.as_dict() for stats in self._stats.values()]
+
+    def summary(self) -> str:
+        lines = []
+        for stats in self.stats():
+            latency = f"{stats['latency']*1000:.0f}ms" if stats['latency'] is not None else "-"
+            state = "ok" if self.is_healthy(stats['proxy']) else "degraded"
+            lines.append(
+                f"{stats['proxy']}: {state}, latency {latency}, "
+                f"errors {stats['error_rate']:.0%} ({stats['errors']}/{stats['requests']}), "
+                f"429/418 {stats['rate_limited']}"
+                + (f", banned {stats['banned_for']:.0f}s" if stats['banned_for'] else ""))
+        return "\n".join(lines)
+
+
+config = configparser.ConfigParser()
+config.optionxform = str
+config.read('config/bot.ini')
+
+proxy_pool = ProxyPool(
+    failover=config.getboolean('PROXY_POOL', 'failover', fallback=False),
+    max_error_rate=config.getfloat('PROXY_POOL', 'max_error_rate', fallback=0.5),
+    max_latency=config.getfloat('PROXY_POOL', 'max_latency', fallback=3.0),
+    ban_seconds=config.getfloat('PROXY_POOL', 'ban_seconds', fallback=60.0),
+    request_timeout=config.getfloat('PROXY_POOL', 'request_timeout', fallback=10.0),
+)
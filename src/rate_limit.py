@@ -0,0 +1,244 @@
+"""
+Client-side request-weight and order-rate limiting.
+
+Binance counts request weight per IP (here: per proxy) and orders per
+account. Every REST call first takes its weight from the token bucket of
+its proxy and, for order placement, its order count from the buckets of
+its account, waiting when a bucket is empty instead of running into a
+429 or an IP ban. The buckets are corrected from the `X-MBX-USED-WEIGHT-1M`
+and `X-MBX-ORDER-COUNT-*` headers Binance returns, so weight spent by
+calls the table does not know about (or by another process on the same
+IP) is accounted for too.
+"""
+
+import configparser
+import logging
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# (method, path) -> (IP weight, 10s order count, 1m order count)
+ENDPOINT_COSTS: Dict[Tuple[str, str], Tuple[int, int, int]] = {
+    ('POST', '/fapi/v1/order'): (0, 1, 1),
+    ('GET', '/fapi/v1/order'): (1, 0, 0),
+    ('DELETE', '/fapi/v1/order'): (1, 0, 0),
+    ('POST', '/fapi/v1/batchOrders'): (5, 5, 1),
+    ('DELETE', '/fapi/v1/allOpenOrders'): (1, 0, 0),
+    ('GET', '/fapi/v1/openOrders'): (1, 0, 0),
+    ('GET', '/fapi/v1/allOrders'): (5, 0, 0),
+    ('GET', '/fapi/v1/userTrades'): (5, 0, 0),
+    ('GET', '/fapi/v1/income'): (30, 0, 0),
+    ('GET', '/fapi/v3/positionRisk'): (5, 0, 0),
+    ('GET', '/fapi/v3/balance'): (5, 0, 0),
+    ('GET', '/fapi/v3/account'): (5, 0, 0),
+    ('GET', '/fapi/v1/accountConfig'): (5, 0, 0),
+    ('POST', '/fapi/v1/leverage'): (1, 0, 0),
+    ('POST', '/fapi/v1/marginType'): (1, 0, 0),
+    ('GET', '/fapi/v1/exchangeInfo'): (1, 0, 0),
+    ('GET', '/fapi/v1/ping'): (1, 0, 0),
+}
+
+# endpoints that cost more when called for all symbols
+ALL_SYMBOLS_WEIGHT = {
+    '/fapi/v1/openOrders': 40,
+    '/fapi/v1/premiumIndex': 10,
+    '/fapi/v1/ticker/price': 2,
+}
+
+DEFAULT_COST = (1, 0, 0)
+
+
+def endpoint_cost(method: str, path: str, payload: Optional[dict] = None) -> Tuple[int, int, int]:
+    """
+    Cost of one REST call.
+
+    Args:
+        method: HTTP method
+        path: URL path, an appended query string is ignored
+        payload: Request parameters
+
+    Returns:
+        (IP weight, 10s order count, 1m order count)
+    """
+    path = path.split('?', 1)[0]
+    payload = payload or {}
+    if path in ALL_SYMBOLS_WEIGHT and not payload.get('symbol'):
+        return ALL_SYMBOLS_WEIGHT[path], 0, 0
+    return ENDPOINT_COSTS.get((method, path), DEFAULT_COST)
+
+
+class TokenBucket:
+    """
+    Token bucket refilled evenly over a window.
+
+    Tokens are reserved up front, so concurrent callers queue behind each
+    other instead of all waking up at the same time.
+
+    Args:
+        capacity: Tokens per window
+        window: Window length in seconds
+    """
+
+    def __init__(self, capacity: float, window: float):
+        self.capacity = capacity
+        self.rate = capacity / window
+        self.tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount: float) -> float:
+        """Take `amount` tokens and return the seconds to wait before using them."""
+        amount = min(amount, self.capacity)
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens -= amount
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def acquire(self, amount: float) -> float:
+        wait = self.reserve(amount)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def sync(self, used: float) -> None:
+        """Lower the tokens to what the server says is left of the window."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.tokens, self.capacity - used)
+
+    def drain(self, seconds: float) -> None:
+        """Empty the bucket so nothing passes for `seconds`."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.tokens, -seconds * self.rate)
+
+    @property
+    def available(self) -> float:
+        with self._lock:
+            self._refill(time.monotonic())
+            return self.tokens
+
+
+class RateLimiter:
+    """
+    Request-weight buckets per proxy and order-rate buckets per account.
+
+    Args:
+        weight_per_minute: Binance IP weight limit per minute
+        orders_per_10s: Binance order limit per account per 10 seconds
+        orders_per_minute: Binance order limit per account per minute
+        headroom: Fraction of every limit the bot may use
+    """
+
+    def __init__(
+        self,
+        weight_per_minute: int = 2400,
+        orders_per_10s: int = 300,
+        orders_per_minute: int = 1200,
+        headroom: float = 0.9
+    ):
+        self.weight_per_minute = weight_per_minute
+        self.orders_per_10s = orders_per_10s
+        self.orders_per_minute = orders_per_minute
+        self.headroom = headroom
+        self._weights: Dict[Optional[str], TokenBucket] = {}
+        self._orders: Dict[str, Tuple[TokenBucket, TokenBucket]] = {}
+        self._lock = threading.Lock()
+
+    def _weight_bucket(self, proxy: Optional[str]) -> TokenBucket:
+        bucket = self._weights.get(proxy)
+        if bucket is None:
+            with self._lock:
+                bucket = self._weights.setdefault(proxy, TokenBucket(
+                    self.weight_per_minute * self.headroom, 60))
+        return bucket
+
+    def _order_buckets(self, account: str) -> Tuple[TokenBucket, TokenBucket]:
+        buckets = self._orders.get(account)
+        if buckets is None:
+            with self._lock:
+                buckets = self._orders.setdefault(account, (
+                    TokenBucket(self.orders_per_10s * self.headroom, 10),
+                    TokenBucket(self.orders_per_minute * self.headroom, 60),
+                ))
+        return buckets
+
+    def acquire(
+        self,
+        proxy: Optional[str],
+        account: str,
+        method: str,
+        path: str,
+        payload: Optional[dict] = None
+    ) -> float:
+        """
+        Wait until a call fits into the limits of its proxy and account.
+
+        Args:
+            proxy: Proxy the call goes through
+            account: API key of the account
+            method: HTTP method
+            path: URL path
+            payload: Request parameters
+
+        Returns:
+            Seconds waited
+        """
+        weight, orders_10s, orders_1m = endpoint_cost(method, path, payload)
+        waited = 0.0
+        if weight:
+            waited += self._weight_bucket(proxy).acquire(weight)
+        if orders_10s or orders_1m:
+            bucket_10s, bucket_1m = self._order_buckets(account)
+            wait = max(bucket_10s.reserve(orders_10s), bucket_1m.reserve(orders_1m))
+            if wait > 0:
+                time.sleep(wait)
+            waited += wait
+        if waited > 0:
+            logger.debug(f"Rate limited {method} {path} via {proxy} for {waited:.2f}s")
+        return waited
+
+    def update(self, proxy: Optional[str], account: str, limit_usage: dict) -> None:
+        """Correct the buckets from the `X-MBX-*` usage headers of a response."""
+        used_weight = limit_usage.get('x-mbx-used-weight-1m')
+        if used_weight is not None:
+            self._weight_bucket(proxy).sync(float(used_weight))
+
+        bucket_10s, bucket_1m = self._order_buckets(account)
+        orders_10s = limit_usage.get('x-mbx-order-count-10s')
+        if orders_10s is not None:
+            bucket_10s.sync(float(orders_10s))
+        orders_1m = limit_usage.get('x-mbx-order-count-1m')
+        if orders_1m is not None:
+            bucket_1m.sync(float(orders_1m))
+
+    def penalize(self, proxy: Optional[str], seconds: float) -> None:
+        """Hold back all calls through a proxy after a 429/418."""
+        self._weight_bucket(proxy).drain(seconds)
+
+    def summary(self) -> str:
+        limit = self.weight_per_minute * self.headroom
+        return "\n".join(
+            f"{proxy}: weight {limit - bucket.available:.0f}/{limit:.0f} per minute"
+            for proxy, bucket in list(self._weights.items())
+        )
+
+
+config = configparser.ConfigParser()
+config.optionxform = str
+config.read('config/bot.ini')
+
+rate_limiter = RateLimiter(
+    weight_per_minute=config.getint('RATE_LIMIT', 'weight_per_minute', fallback=2400),
+    orders_per_10s=config.getint('RATE_LIMIT', 'orders_per_10s', fallback=300),
+    orders_per_minute=config.getint('RATE_LIMIT', 'orders_per_minute', fallback=1200),
+    headroom=config.getfloat('RATE_LIMIT', 'headroom', fallback=0.9),
+)
@@ -0,0 +1,64 @@
+"""
+Single scheduler and executor pools shared by the bot and the panel.
+
+Work is split into lanes with their own, separately sized pools so a
+slow lane can never take threads from a faster one:
+
+    orders  - latency-critical order entry and exit (opening positions,
+              target ladders, stop-loss moves, panel close/stop actions)
+    fills   - fill management (check_orders, user data stream upkeep)
+    reports - panel reporting (positions, balances, PNLs) and background
+              preparation (leverage pre-arming)
+
+Housekeeping jobs (keep-alives, stream reconnects) run on the default pool.
+
+Every job returns its pooled database connection when it ends, so the
+pool is sized by jobs in flight rather than by threads.
+"""
+
+import configparser
+
+import pytz
+from apscheduler.events import EVENT_JOB_ERROR, EVENT_JOB_EXECUTED
+from apscheduler.executors.pool import ThreadPoolExecutor
+from apscheduler.schedulers.background import BackgroundScheduler
+
+from fanout import FILLS, ORDERS, REPORTS, FanOut
+from models import release_connection
+
+config = configparser.ConfigParser()
+config.optionxform = str
+config.read('config/bot.ini')
+
+_max_per_proxy = config.getint('EXECUTION', 'max_per_proxy', fallback=20)
+_workers = {
+    ORDERS: config.getint('EXECUTION', 'orders_workers', fallback=200),
+    FILLS: config.getint('EXECUTION', 'fills_workers', fallback=20),
+    REPORTS: config.getint('EXECUTION', 'reports_workers', fallback=50),
+}
+
+# Per-account fan-outs, one engine per lane
+fan_outs = {
+    lane: FanOut(max_workers=workers, max_per_proxy=_max_per_proxy,
+                 after_job=release_connection)
+    for lane, workers in _workers.items()
+}
+
+# Scheduled (interval) jobs, one executor per lane
+_executor_workers = {
+    'default': config.getint('SCHEDULING', 'default_workers', fallback=5),
+    ORDERS: config.getint('SCHEDULING', 'orders_workers', fallback=10),
+    FILLS: config.getint('SCHEDULING', 'fills_workers', fallback=5),
+    REPORTS: config.getint('SCHEDULING', 'reports_workers', fallback=5),
+}
+scheduler = BackgroundScheduler(
+    executors={
+        lane: ThreadPoolExecutor(workers)
+        for lane, workers in _executor_workers.items()
+    },
+    timezone=pytz.timezone('Asia/Tehran'),
+)
+# job events are dispatched on the thread that ran the job
+scheduler.add_listener(
+    lambda event: release_connection(), EVENT_JOB_EXECUTED | EVENT_JOB_ERROR)
+scheduler.start()
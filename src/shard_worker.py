@@ -0,0 +1,173 @@
+"""
+Worker process of a shard, see shards.
+
+Every worker is a fresh interpreter started on this file, so it imports
+only what per-account jobs need: never `main` (no Telegram client or
+scheduler of its own) and never `models` (no database connection). Jobs
+return what has to be stored and the bot process writes it: entry orders
+through `order_writer`, leverage changes through `leverage_cache.apply()`.
+
+The bot process sends the shard's setup and then its requests pickled
+over the worker's stdin; results come back over stdout, logs go to
+stderr.
+"""
+
+import logging
+import pickle
+import sys
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from binance.error import ClientError
+
+from accounts import Account, roster
+from balances import balance_cache
+from fanout import AccountResult, FanOut
+from leverage import leverage_cache
+from signing import OrderTemplate
+from tracing import ACK, LEVERAGE, collect, record, span
+
+logger = logging.getLogger(__name__)
+
+
+def job_open_entry(
+    account: Account,
+    symbol: str,
+    template: OrderTemplate,
+    quantity: float,
+    leverage: int,
+    received_at: Optional[float] = None
+) -> Tuple[dict, Dict[str, float]]:
+    """
+    Apply leverage if needed and send the entry order of one account.
+
+    Returns:
+        Entry order response and the latency spans of this account (see
+        tracing); `ack` is measured from `received_at`
+    """
+    with collect() as spans:
+        with span(LEVERAGE):
+            leverage_cache.ensure(account, symbol, leverage)
+        try:
+            order = account.binance.new_order_from_template(template, quantity)
+        except ClientError:
+            # leverage may have been changed outside the bot, apply it again
+            leverage_cache.invalidate(account.name, symbol)
+            raise
+        if received_at is not None:
+            record(ACK, time.time() - received_at)
+    return order, spans
+
+
+# jobs a shard can run, called as fn(account, *args)
+JOBS: Dict[str, Callable] = {
+    'open_entry': job_open_entry,
+    'ensure_leverage': leverage_cache.ensure,
+    'refresh_balance': balance_cache.refresh,
+}
+
+
+class PickleConnection:
+    """
+    `multiprocessing.Connection`-like send()/recv() over two byte streams.
+
+    Args:
+        reader: Stream objects are received from
+        writer: Stream objects are sent to
+    """
+
+    def __init__(self, reader, writer):
+        self._reader = reader
+        self._writer = writer
+
+    def send(self, obj) -> None:
+        pickle.dump(obj, self._writer, pickle.HIGHEST_PROTOCOL)
+        self._writer.flush()
+
+    def recv(self):
+        """Next object, EOFError once the other side closed its end."""
+        try:
+            return pickle.load(self._reader)
+        except pickle.UnpicklingError as e:
+            # the other side died in the middle of a message
+            raise EOFError(e)
+
+    def close(self) -> None:
+        for stream in (self._writer, self._reader):
+            try:
+                stream.close()
+            except OSError:
+                pass
+
+
+def _picklable(error: BaseException) -> BaseException:
+    try:
+        pickle.loads(pickle.dumps(error))
+        return error
+    except Exception:
+        return RuntimeError(repr(error))
+
+
+def shard_main(conn: PickleConnection, shard_id: int, account_names: List[str],
+               max_workers: int, max_per_proxy: int, leverage_state: dict) -> None:
+    """Run jobs for the shard's accounts until the bot process closes the pipe."""
+    import coloredlogs
+    coloredlogs.install(level='INFO')
+
+    accounts = {account.name: account for account in roster if account.name in set(account_names)}
+    for account in accounts.values():
+        # build pooled clients before the first job
+        account.binance
+    # changes go back to the bot process with every result
+    leverage_cache.persist = False
+    leverage_cache.load(leverage_state)
+    fan_out = FanOut(max_workers=max_workers, max_per_proxy=max_per_proxy)
+    send_lock = threading.Lock()
+    logger.info(f"Shard {shard_id} ready with {len(accounts)} accounts")
+
+    def handle(request_id: int, job_name: str, jobs: List[Tuple[str, Sequence]]) -> None:
+        start_time = time.perf_counter()
+        fn = JOBS[job_name]
+        results = []
+        known = []
+        for account_name, args in jobs:
+            account = accounts.get(account_name)
+            if account is None:
+                results.append(AccountResult(
+                    account_name, None, error=KeyError(f"{account_name} is not in shard {shard_id}")))
+            else:
+                known.append((account.name, account.current_proxy, [account, *args]))
+        results.extend(fan_out.run(fn, known).results)
+        for result in results:
+            if result.error is not None:
+                result.error = _picklable(result.error)
+        with send_lock:
+            # drained under the lock, so changes reach the bot process in order
+            changes = leverage_cache.drain_changes()
+            conn.send((request_id, results, time.perf_counter() - start_time, changes))
+
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+        # several requests may be in flight, each runs on its own thread
+        threading.Thread(target=handle, args=message, daemon=True).start()
+
+
+def main() -> None:
+    conn = PickleConnection(sys.stdin.buffer, sys.stdout.buffer)
+    # stdout carries results, anything printed goes to the log instead
+    sys.stdout = sys.stderr
+    try:
+        setup = conn.recv()
+    except EOFError:
+        return
+    shard_main(conn, *setup)
+
+
+if __name__ == '__main__':
+    main()
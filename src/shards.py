@@ -0,0 +1,217 @@
+"""
+Sharded execution of per-account jobs across worker processes.
+
+With `[SHARDS] workers` above 0 the roster is partitioned across that many
+worker processes. Each worker has its own connection pools, rate limiter
+and fan-out threads, so signing and JSON parsing scale with CPU cores
+instead of sharing one GIL with Pyrogram and the scheduler. Accounts are
+partitioned by home proxy, so every proxy's request weight is accounted
+for in exactly one process.
+
+The bot process sends a job name plus per-account arguments to the shards
+over a pipe and merges their per-account results into one FanOutReport.
+Jobs must be registered in `shard_worker.JOBS` and their arguments must be
+picklable; accounts are referenced by name and resolved from each
+worker's roster.
+
+Workers run `shard_worker.py` in a fresh interpreter, which imports
+neither `main` nor `models`: they start no Telegram clients or schedulers
+and never open the database. Leverage changes a worker made come back
+with its results and are applied to `leverage_cache` here before the
+results are handed out; entry orders are written by the caller through
+`order_writer` as usual.
+"""
+
+import itertools
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import Future, TimeoutError, wait
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from accounts import Account, roster
+from fanout import AccountResult, FanOutReport
+from leverage import leverage_cache
+from models import release_connection
+from shard_worker import PickleConnection
+
+logger = logging.getLogger(__name__)
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'shard_worker.py')
+
+
+def partition(accounts: Sequence[Account], shards: int) -> List[List[str]]:
+    """
+    Split accounts into shards, keeping all accounts of a proxy together.
+
+    Args:
+        accounts: Roster
+        shards: Number of shards
+
+    Returns:
+        Account names per shard
+    """
+    groups: Dict[Optional[str], List[str]] = {}
+    for account in accounts:
+        groups.setdefault(account.proxy, []).append(account.name)
+
+    parts: List[List[str]] = [[] for _ in range(shards)]
+    # largest proxy groups first, each to the currently smallest shard
+    for names in sorted(groups.values(), key=len, reverse=True):
+        min(parts, key=len).extend(names)
+    return [part for part in parts if part]
+
+
+class Shard:
+    """Bot-side handle of one worker process."""
+
+    def __init__(self, shard_id: int, account_names: List[str],
+                 max_workers: int, max_per_proxy: int):
+        self.shard_id = shard_id
+        self.account_names = account_names
+        self.max_workers = max_workers
+        self.max_per_proxy = max_per_proxy
+        self.process: Optional[subprocess.Popen] = None
+        self._conn: Optional[PickleConnection] = None
+        self._pending: Dict[int, Future] = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._reader = threading.Thread(target=self._read, daemon=True)
+
+    def start(self) -> None:
+        # the worker exits once its stdin closes, with the bot process too
+        self.process = subprocess.Popen(
+            [sys.executable, WORKER_SCRIPT], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self._conn = PickleConnection(self.process.stdout, self.process.stdin)
+        self._conn.send((self.shard_id, self.account_names, self.max_workers,
+                         self.max_per_proxy, leverage_cache.snapshot(self.account_names)))
+        self._reader.start()
+
+    def _apply(self, changes) -> None:
+        if not changes:
+            return
+        try:
+            leverage_cache.apply(changes)
+        except Exception as e:
+            # the worker keeps its own state, only this process's copy is behind
+            logger.exception(f"Storing leverage changes of shard {self.shard_id} failed: {e}")
+        finally:
+            release_connection()
+
+    def _read(self) -> None:
+        while True:
+            try:
+                request_id, results, wall_time, changes = self._conn.recv()
+            except (EOFError, OSError):
+                break
+            # before the results, so callers see what the worker applied
+            self._apply(changes)
+            with self._lock:
+                future = self._pending.pop(request_id, None)
+            if future is not None and not future.cancelled():
+                future.set_result(FanOutReport(results, wall_time))
+
+        # the worker is gone, fail whatever was still waiting for it
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for future in pending.values():
+            if not future.cancelled():
+                future.set_exception(RuntimeError(f"Shard {self.shard_id} exited"))
+
+    def submit(self, job_name: str, jobs: List[Tuple[str, Sequence]]) -> Future:
+        future = Future()
+        with self._lock:
+            request_id = next(self._ids)
+            self._pending[request_id] = future
+            try:
+                self._conn.send((request_id, job_name, jobs))
+            except (BrokenPipeError, OSError):
+                self._pending.pop(request_id, None)
+                future.set_exception(RuntimeError(f"Shard {self.shard_id} exited"))
+        return future
+
+    def stop(self) -> None:
+        try:
+            self._conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        try:
+            self.process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self._conn.close()
+
+
+class ShardPool:
+    """
+    Worker processes that together cover the whole roster.
+
+    Args:
+        workers: Number of worker processes
+        max_workers: Fan-out threads per worker
+        max_per_proxy: Jobs in flight per proxy inside a worker
+    """
+
+    def __init__(self, workers: int, max_workers: int = 200, max_per_proxy: int = 20):
+        self.shards = [
+            Shard(shard_id, names, max_workers, max_per_proxy)
+            for shard_id, names in enumerate(partition(roster, workers))
+        ]
+        self._shard_of = {
+            name: shard for shard in self.shards for name in shard.account_names
+        }
+
+    def start(self) -> None:
+        for shard in self.shards:
+            shard.start()
+        logger.info(
+            f"Started {len(self.shards)} shards: "
+            + ", ".join(f"{len(shard.account_names)} accounts" for shard in self.shards)
+        )
+
+    def stop(self) -> None:
+        for shard in self.shards:
+            shard.stop()
+
+    def run(
+        self,
+        job_name: str,
+        jobs: Sequence[Tuple[str, Sequence]],
+        timeout: Optional[float] = None
+    ) -> FanOutReport:
+        """
+        Run a registered job for many accounts on their shards and wait.
+
+        Args:
+            job_name: Key of `shard_worker.JOBS`
+            jobs: (account_name, args) per account, the job is called as
+                fn(account, *args) inside the shard
+            timeout: Seconds to wait for all shards, None to wait forever
+
+        Returns:
+            Merged per-account results of all shards
+        """
+        start_time = time.perf_counter()
+        by_shard: Dict[Shard, List[Tuple[str, Sequence]]] = {}
+        for account_name, args in jobs:
+            by_shard.setdefault(self._shard_of[account_name], []).append((account_name, list(args)))
+
+        futures = {shard.submit(job_name, shard_jobs): shard_jobs
+                   for shard, shard_jobs in by_shard.items()}
+        wait(futures, timeout=timeout)
+
+        results = []
+        for future, shard_jobs in futures.items():
+            try:
+                results.extend(future.result(timeout=0).results)
+            except (TimeoutError, RuntimeError) as error:
+                # a hung or dead shard fails only its own accounts
+                future.cancel()
+                results.extend(
+                    AccountResult(account_name, None, error=error)
+                    for account_name, _ in shard_jobs
+                )
+        return FanOutReport(results, time.perf_counter() - start_time)
@@ -0,0 +1,64 @@
+"""
+Position sizing of a signal for every account in one vectorized pass.
+
+Balances come from the balance cache, so sizing the whole roster is pure
+array math done before the first order request is sent. Quantities are
+floored to the symbol's step size, and accounts whose quantity falls
+below the symbol's minimum quantity or minimum notional get 0 (no order).
+"""
+
+from typing import Optional, Union
+
+import numpy as np
+
+from market import SymbolInfo
+
+# "Max" signals use this fraction of the balance as margin
+MAX_FRACTION = 0.4
+
+
+def is_balance_based(size: Union[str, float]) -> bool:
+    """Whether a size specification depends on account balances."""
+    return size == "Max" or (isinstance(size, str) and size.endswith('%'))
+
+
+def batch_sizes(
+    balances: Optional[np.ndarray],
+    count: int,
+    price: float,
+    size: Union[str, float],
+    leverage: int,
+    info: SymbolInfo,
+    limit_balance: float
+) -> np.ndarray:
+    """
+    Order quantity of every account.
+
+    Args:
+        balances: USDT balance of every account, None for fixed sizes
+        count: Number of accounts
+        price: Entry price used to convert volume to quantity
+        size: Size specification (number, "Max", or percentage)
+        leverage: Leverage multiplier
+        info: Filters of the traded symbol
+        limit_balance: Maximum volume (USDT) of a percentage signal
+
+    Returns:
+        Quantity per account, 0 where the order would be rejected
+    """
+    if size == "Max":
+        quantities = balances * leverage * MAX_FRACTION / price
+    elif isinstance(size, str) and size.endswith('%'):
+        volume_percent = int(size.replace('%', ''))
+        volumes = np.minimum(balances * leverage * (volume_percent / 100), limit_balance)
+        quantities = volumes / price
+    else:
+        quantities = np.full(count, float(size))
+
+    # floor to the step size; the epsilon keeps exact multiples such as
+    # 0.3 / 0.1 from flooring one step too low
+    steps = np.floor(quantities / info.step_size + 1e-9)
+    quantities = np.round(steps * info.step_size, info.quantity_precision)
+
+    tradable = (quantities >= info.min_qty) & (quantities * price >= info.min_notional)
+    return np.where(tradable, quantities, 0.0)
@@ -0,0 +1,299 @@
+"""
+Storage backends: database selection, pragmas and schema migrations.
+
+`[DATABASE] backend` in config/bot.ini picks the database the models use:
+
+    sqlite   - one file, for development and single-instance setups.
+               Writes go through `SqliteQueueDatabase`, which needs WAL
+               mode; the other pragmas trade durability of the last
+               transactions on power loss (`synchronous = normal`) for
+               fewer fsyncs, and keep hot pages in memory.
+    postgres - a shared server for production and several bot instances.
+               Every thread checks out its own connection from a bounded
+               pool; fan-out and scheduler threads hand it back after each
+               job with `release_connection()`. Needs psycopg2.
+
+Tables that do not exist yet are created from the models with all their
+indexes. Tables of an existing database are only changed by the
+migrations in `MIGRATIONS`, each applied once and recorded in
+`schema_migrations`.
+
+Run this module to time the bot's queries on a generated database:
+
+    python src/storage.py [signals]
+"""
+
+import configparser
+import contextlib
+import datetime
+import logging
+import os
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple
+
+from peewee import Database, DateTimeField, Model, SqliteDatabase, TextField
+from playhouse.migrate import SchemaMigrator, migrate
+from playhouse.pool import PooledDatabase, PooledPostgresqlDatabase
+from playhouse.sqliteq import SqliteQueueDatabase
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    # negative: KiB
+    'cache_size': -64000,
+    'mmap_size': 256 * 1024 * 1024,
+}
+
+
+def pragmas_from_config(config: configparser.ConfigParser) -> Dict[str, object]:
+    """`DEFAULT_PRAGMAS` overridden by the options of `[DATABASE]`."""
+    pragmas = {}
+    for name, default in DEFAULT_PRAGMAS.items():
+        value = config.get('DATABASE', name, fallback=str(default))
+        pragmas[name] = int(value) if value.lstrip('-').isdigit() else value
+    return pragmas
+
+
+def open_database(config: configparser.ConfigParser) -> Database:
+    """
+    Database configured by `[DATABASE]`.
+
+    Raises:
+        ValueError: Unknown backend
+    """
+    backend = config.get('DATABASE', 'backend', fallback='sqlite')
+    if backend == 'postgres':
+        return PooledPostgresqlDatabase(
+            config.get('DATABASE', 'name', fallback='copytrade'),
+            host=config.get('DATABASE', 'host', fallback='localhost'),
+            port=config.getint('DATABASE', 'port', fallback=5432),
+            user=config.get('DATABASE', 'user', fallback='copytrade'),
+            password=config.get('DATABASE', 'password', fallback=''),
+            max_connections=config.getint('DATABASE', 'max_connections', fallback=32),
+            # connections idle longer than this are reopened
+            stale_timeout=config.getint('DATABASE', 'stale_timeout', fallback=300),
+            # seconds a thread waits for a free connection before failing
+            timeout=config.getint('DATABASE', 'pool_timeout', fallback=10),
+        )
+    if backend != 'sqlite':
+        raise ValueError(f"Unknown [DATABASE] backend: {backend}")
+
+    # the SQLite file, its directory created if needed
+    path = config.get('DATABASE', 'path', fallback='db')
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    # started by create_schema(): the writer switches to WAL when it
+    # connects, which fails while the schema is being changed
+    return SqliteQueueDatabase(path, pragmas=pragmas_from_config(config), autostart=False)
+
+
+def release_connection(database: Database) -> None:
+    """
+    Return the calling thread's connection to the pool.
+
+    No-op for unpooled databases and inside a transaction, so it is safe
+    to call after every job.
+    """
+    if isinstance(database, PooledDatabase) and not database.is_closed() \
+            and not database.in_transaction():
+        database.close()
+
+
+def _add_missing_indexes(migrator: SchemaMigrator, indexes: Sequence[Tuple[str, Tuple[str, ...]]]):
+    # indexes may already exist on databases created by newer models
+    database = migrator.database
+    operations = []
+    for table, columns in indexes:
+        existing = {tuple(index.columns) for index in database.get_indexes(table)}
+        if tuple(columns) not in existing:
+            operations.append(migrator.add_index(table, columns, False))
+    return operations
+
+
+def _status_indexes(migrator: SchemaMigrator):
+    return _add_missing_indexes(migrator, [
+        ('signals', ('status',)),
+        ('targets', ('status',)),
+    ])
+
+
+def _lookup_indexes(migrator: SchemaMigrator):
+    return _add_missing_indexes(migrator, [
+        ('signals', ('symbol',)),
+        ('targets', ('owner_id',)),
+        ('targets', ('id_target',)),
+    ])
+
+
+def _signal_instance(migrator: SchemaMigrator):
+    # signals created before instances existed belong to the default one
+    operations = []
+    columns = {column.name for column in migrator.database.get_columns('signals')}
+    if 'instance' not in columns:
+        operations.append(migrator.add_column(
+            'signals', 'instance', TextField(default='default')))
+    return operations + _add_missing_indexes(migrator, [
+        ('signals', ('instance',)),
+    ])
+
+
+def _account_settings_instance(migrator: SchemaMigrator):
+    # settings stored before instances existed belong to the default one,
+    # and every instance gets its own row per account/symbol
+    database = migrator.database
+    table = 'accountsymbolsettings'
+    operations = []
+    columns = {column.name for column in database.get_columns(table)}
+    if 'instance' not in columns:
+        operations.append(migrator.add_column(
+            table, 'instance', TextField(default='default')))
+    indexes = {tuple(index.columns): index for index in database.get_indexes(table)}
+    old = indexes.get(('account', 'symbol'))
+    if old is not None and old.unique:
+        operations.append(migrator.drop_index(table, old.name))
+    if ('instance', 'account', 'symbol') not in indexes:
+        operations.append(migrator.add_index(table, ('instance', 'account', 'symbol'), True))
+    return operations
+
+
+# (name, fn(migrator) -> operations), applied in order
+MIGRATIONS: List[Tuple[str, Callable]] = [
+    ('0001_status_indexes', _status_indexes),
+    ('0002_lookup_indexes', _lookup_indexes),
+    ('0003_signal_instance', _signal_instance),
+    ('0004_account_settings_instance', _account_settings_instance),
+]
+
+
+class SchemaMigrations(Model):
+    # migrations already applied to the database
+    name = TextField(unique=True)
+    applied_at = DateTimeField(default=datetime.datetime.now)
+
+    class Meta:
+        table_name = 'schema_migrations'
+
+
+# pg_advisory_lock key held while an instance changes the schema
+SCHEMA_LOCK = 0x636f7079
+
+
+@contextlib.contextmanager
+def _schema_lock(database: Database) -> Iterator[None]:
+    # instances starting together must not create the same tables twice
+    if not isinstance(database, PooledPostgresqlDatabase):
+        yield
+        return
+    database.execute_sql('SELECT pg_advisory_lock(%s)', (SCHEMA_LOCK,))
+    try:
+        yield
+    finally:
+        database.execute_sql('SELECT pg_advisory_unlock(%s)', (SCHEMA_LOCK,))
+
+
+def create_schema(database: Database, models: Sequence) -> None:
+    """
+    Create missing tables and bring existing ones up to date.
+
+    SQLite schema changes run on a direct connection: writes through the
+    queue database are asynchronous, so a later step could not see the
+    tables an earlier one created. Its write queue is started afterwards.
+    On PostgreSQL they run under an advisory lock, one instance at a time.
+
+    Args:
+        database: Database the models are bound to
+        models: Every model of the bot
+    """
+    if isinstance(database, SqliteDatabase):
+        direct = SqliteDatabase(database.database)
+    else:
+        direct = database
+    with direct.bind_ctx([SchemaMigrations, *models]), _schema_lock(direct):
+        fresh = not any(model.table_exists() for model in models)
+
+        # new tables get every index from their model definition
+        direct.create_tables([SchemaMigrations] + [
+            model for model in models if not model.table_exists()])
+
+        applied = {row.name for row in SchemaMigrations.select()}
+        migrator = SchemaMigrator.from_database(direct)
+        for name, migration in MIGRATIONS:
+            if name in applied:
+                continue
+            if not fresh:
+                logger.info(f"Applying migration {name}")
+                with direct.atomic():
+                    migrate(*migration(migrator))
+            SchemaMigrations.create(name=name)
+    if direct is database:
+        release_connection(direct)
+    else:
+        direct.close()
+    if isinstance(database, SqliteQueueDatabase):
+        database.start()
+
+
+def _benchmark(signals: int = 100_000, rounds: int = 200) -> None:
+    import random
+    import tempfile
+    import time
+
+    from peewee import SqliteDatabase
+
+    from models import MODELS, Signals, Targets
+
+    with tempfile.TemporaryDirectory() as directory:
+        database = SqliteDatabase(os.path.join(directory, 'bench.db'), pragmas=DEFAULT_PRAGMAS)
+        with database.bind_ctx(MODELS):
+            database.create_tables(MODELS)
+            symbols = [f"COIN{i}USDT" for i in range(200)]
+
+            start_time = time.perf_counter()
+            with database.atomic():
+                rows = [{
+                    'id_signal': f"S{i:022d}", 'symbol': random.choice(symbols),
+                    'kind': 'long', 'entry': 1.0, 'targets_str': '1',
+                    # a few hundred signals are still open
+                    'status': 'OPEN' if i % 500 == 0 else 'CLOSE',
+                } for i in range(signals)]
+                for start in range(0, len(rows), 1000):
+                    Signals.insert_many(rows[start:start + 1000]).execute()
+                targets = [{
+                    'owner': i + 1, 'number': 1, 'id_target': f"T{i:022d}",
+                    'status': 'OPEN' if i % 500 == 0 else 'CLOSE',
+                } for i in range(signals)]
+                for start in range(0, len(targets), 1000):
+                    Targets.insert_many(targets[start:start + 1000]).execute()
+            print(f"inserted {signals} signals and targets in {time.perf_counter() - start_time:.2f}s")
+
+            queries = {
+                'open signals': lambda: list(Signals.select().where(Signals.status == "OPEN")),
+                'open targets + signal': lambda: list(
+                    Targets.select(Targets, Signals).join(Signals).where(Targets.status == "OPEN")),
+                'signals of a symbol': lambda: list(
+                    Signals.select().where(Signals.symbol == random.choice(symbols))),
+                'target by id': lambda: Targets.get_or_none(
+                    Targets.id_target == f"T{random.randrange(signals):022d}"),
+            }
+
+            def measure(label):
+                for name, query in queries.items():
+                    start_time = time.perf_counter()
+                    for _ in range(rounds):
+                        query()
+                    elapsed = (time.perf_counter() - start_time) / rounds
+                    print(f"{label:>9} {name:>22}: {elapsed * 1000:8.3f} ms")
+
+            measure('indexed')
+            for table in ('signals', 'targets'):
+                for index in database.get_indexes(table):
+                    if not index.unique:
+                        database.execute_sql(f'DROP INDEX "{index.name}"')
+            measure('unindexed')
+
+
+if __name__ == "__main__":
+    import sys
+    _benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
@@ -0,0 +1,144 @@
+"""
+Websocket subscriptions that reconnect themselves.
+
+The connector calls `on_error` both when one of our callbacks raises (the
+socket keeps running) and when the connection is lost (its reader thread
+ends without calling `on_close`). `ReconnectingStream` keeps the two
+apart: message handlers run inside their own try/except, so their errors
+are logged and never reach `on_error`, which then only reports read
+failures. A lost or closed connection stops the old client and reconnects
+right away, with growing pauses while Binance cannot be reached. Only the
+current client can trigger a reconnect, so closing an old one never
+starts a second socket.
+"""
+
+import logging
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Optional
+
+from binance.websocket.um_futures.websocket_client import UMFuturesWebsocketClient
+
+logger = logging.getLogger(__name__)
+
+# seconds between reconnect attempts after a drop
+RECONNECT_DELAYS = (1, 2, 5, 10, 30, 60)
+
+
+def close_client(client: Optional[UMFuturesWebsocketClient], timeout: float = 5.0) -> None:
+    """Close a websocket client and wait for its reader thread, never forever."""
+    if client is None:
+        return
+    manager = client.socket_manager
+    try:
+        manager.close()
+    except Exception as e:
+        logger.debug(f"Closing websocket failed: {e}")
+    if manager is threading.current_thread():
+        return
+    manager.join(timeout)
+    if manager.is_alive():
+        # no CLOSE frame came back, drop the connection
+        manager.ws.shutdown()
+
+
+class ReconnectingStream(ABC):
+    """
+    Base class of one websocket subscription.
+
+    Subclasses implement `_connect()`, which opens and subscribes a client
+    built with `on_message=self._on_raw_message`, `on_close=self._on_close`
+    and `on_error=self._on_error`, and `_handle(message)` for every message.
+
+    Args:
+        name: Stream name for logging
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._ws_client: Optional[UMFuturesWebsocketClient] = None
+        self._lock = threading.RLock()
+        self._reconnecting = False
+        self._reconnect_lock = threading.Lock()
+
+    @abstractmethod
+    def _connect(self) -> UMFuturesWebsocketClient:
+        """Open and subscribe a new client."""
+
+    @abstractmethod
+    def _handle(self, message: str) -> None:
+        """Process one raw message."""
+
+    @property
+    def running(self) -> bool:
+        client = self._ws_client
+        return client is not None and client.socket_manager.is_alive()
+
+    def start(self) -> None:
+        """Connect, replacing a client whose connection is gone."""
+        with self._lock:
+            if self.running:
+                return
+            old, self._ws_client = self._ws_client, None
+            close_client(old)
+            self._ws_client = self._connect()
+        logger.info(f"{self.name} started")
+
+    def stop(self) -> None:
+        with self._lock:
+            old, self._ws_client = self._ws_client, None
+            close_client(old)
+
+    def restart(self) -> None:
+        with self._lock:
+            self.stop()
+            self.start()
+
+    def _is_current(self, socket_manager) -> bool:
+        client = self._ws_client
+        return client is not None and client.socket_manager is socket_manager
+
+    def _on_raw_message(self, _, message: str) -> None:
+        try:
+            self._handle(message)
+        except Exception as e:
+            # the socket is fine, only this message is lost
+            logger.exception(f"Error handling a {self.name} message: {e!r}")
+
+    def _on_error(self, socket_manager, error) -> None:
+        # handler errors never get here: the read loop failed and its
+        # thread is ending without an on_close
+        logger.error(f"{self.name} read failed: {error!r}")
+        self._on_close(socket_manager, error)
+
+    def _on_close(self, socket_manager, error=None) -> None:
+        if not self._is_current(socket_manager):
+            # a client we stopped ourselves
+            return
+        logger.warning(f"{self.name} closed: {error}")
+        self.reconnect()
+
+    def reconnect(self) -> None:
+        """Restart the stream on a separate thread, retrying until it is back."""
+        with self._reconnect_lock:
+            if self._reconnecting:
+                return
+            self._reconnecting = True
+        # the socket's own thread cannot join itself
+        threading.Thread(target=self._reconnect, name=f"{self.name} reconnect",
+                         daemon=True).start()
+
+    def _reconnect(self) -> None:
+        try:
+            for delay in RECONNECT_DELAYS:
+                try:
+                    self.restart()
+                    return
+                except Exception as e:
+                    logger.warning(f"Reconnecting {self.name} failed, retrying in {delay}s: {e}")
+                    time.sleep(delay)
+            logger.error(f"{self.name} still down, leaving it to the periodic restart")
+        finally:
+            with self._reconnect_lock:
+                self._reconnecting = False
@@ -0,0 +1,274 @@
+"""
+Latency of every signal, from the Telegram message to the exchange ack.
+
+Each signal gets a `SignalTrace` holding named spans: signal-level spans
+(parse, sizing) have one value, per-account spans (leverage, signing,
+network, ack) have one value per account, and spans recorded after the
+fan-out (fill, db) are added to the trace while it is still retained.
+Per-account spans are collected on the job's own thread with `collect()`
+and `span()`, so they also come back from shard worker processes.
+
+The latest traces are summarized as p50/p95/p99 per span and exported as
+Prometheus text (`/metrics`) and JSON (`/traces`) over a local HTTP port.
+"""
+
+import collections
+import configparser
+import contextlib
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+PARSE = 'parse'
+SIZING = 'sizing'
+LEVERAGE = 'leverage'
+SIGNING = 'signing'
+NETWORK = 'network'
+ACK = 'ack'
+FILL = 'fill'
+DB = 'db'
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+# upper bounds (seconds) of the cumulative Prometheus histogram
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_local = threading.local()
+
+
+@contextlib.contextmanager
+def collect() -> Iterator[Dict[str, float]]:
+    """Collect the spans recorded on this thread into a dict."""
+    _local.spans = spans = {}
+    try:
+        yield spans
+    finally:
+        _local.spans = None
+
+
+def record(name: str, seconds: float) -> None:
+    """Add to a span of the current collect() block, if any."""
+    spans = getattr(_local, 'spans', None)
+    if spans is not None:
+        spans[name] = spans.get(name, 0.0) + seconds
+
+
+@contextlib.contextmanager
+def span(name: str) -> Iterator[None]:
+    """Time a block into the current collect() block."""
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start_time)
+
+
+class SignalTrace:
+    """
+    Spans of one signal.
+
+    Args:
+        signal_id: Client order ID of the signal's entry orders
+        symbol: Trading pair symbol
+        received_at: Wall time the message arrived, defaults to now
+    """
+
+    def __init__(self, signal_id: str, symbol: str, received_at: Optional[float] = None):
+        self.signal_id = signal_id
+        self.symbol = symbol
+        self.received_at = received_at or time.time()
+        self.spans: Dict[str, List[float]] = collections.defaultdict(list)
+        self._lock = threading.Lock()
+
+    def record(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.spans[name].append(seconds)
+
+    @contextlib.contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start_time)
+
+    def add_account(self, spans: Dict[str, float], acked_at: Optional[float] = None) -> None:
+        """
+        Record the spans of one account's job.
+
+        Args:
+            spans: Spans returned by the job's collect() block
+            acked_at: Wall time the exchange acknowledged the order
+        """
+        for name, seconds in spans.items():
+            self.record(name, seconds)
+        if acked_at is not None:
+            self.record(ACK, acked_at - self.received_at)
+
+    def percentiles(self) -> Dict[str, Dict[str, float]]:
+        """Count, sum and p50/p95/p99 of every span, in seconds."""
+        with self._lock:
+            spans = {name: list(values) for name, values in self.spans.items()}
+        summary = {}
+        for name, values in spans.items():
+            quantiles = np.percentile(values, [q * 100 for q in QUANTILES])
+            summary[name] = {
+                'count': len(values),
+                'sum': float(sum(values)),
+                **{f"p{int(q * 100)}": float(value) for q, value in zip(QUANTILES, quantiles)},
+            }
+        return summary
+
+    def to_dict(self) -> dict:
+        return {
+            'signal_id': self.signal_id,
+            'symbol': self.symbol,
+            'received_at': self.received_at,
+            'spans': self.percentiles(),
+        }
+
+    def summary(self) -> str:
+        lines = [f"Latency of {self.symbol} ({self.signal_id}):"]
+        for name, stats in self.percentiles().items():
+            if stats['count'] == 1:
+                lines.append(f"{name}: {stats['p50'] * 1000:.1f}ms")
+            else:
+                lines.append(
+                    f"{name}: p50 {stats['p50'] * 1000:.1f}ms, "
+                    f"p95 {stats['p95'] * 1000:.1f}ms, "
+                    f"p99 {stats['p99'] * 1000:.1f}ms ({stats['count']} accounts)"
+                )
+        return "\n".join(lines)
+
+
+class Tracer:
+    """
+    Traces of the latest signals plus all-time span histograms.
+
+    Args:
+        keep: Number of signal traces retained for export and late spans
+    """
+
+    def __init__(self, keep: int = 50):
+        self._traces: Dict[str, SignalTrace] = collections.OrderedDict()
+        self.keep = keep
+        self._lock = threading.Lock()
+        # span -> (bucket counts, count, sum) over every finished signal
+        self._histograms: Dict[str, list] = {}
+        self._server = None
+
+    def start(self, signal_id: str, symbol: str, received_at: Optional[float] = None) -> SignalTrace:
+        trace = SignalTrace(signal_id, symbol, received_at)
+        with self._lock:
+            self._traces[signal_id] = trace
+            while len(self._traces) > self.keep:
+                self._traces.popitem(last=False)
+        return trace
+
+    def get(self, signal_id: str) -> Optional[SignalTrace]:
+        return self._traces.get(signal_id)
+
+    def _observe(self, spans: Dict[str, List[float]]) -> None:
+        with self._lock:
+            for name, values in spans.items():
+                buckets, count, total = self._histograms.setdefault(
+                    name, [[0] * len(BUCKETS), 0, 0.0])
+                for value in values:
+                    for idx, bound in enumerate(BUCKETS):
+                        if value <= bound:
+                            buckets[idx] += 1
+                self._histograms[name] = [buckets, count + len(values), total + sum(values)]
+
+    def finish(self, trace: SignalTrace) -> None:
+        """Add the spans of a signal's fan-out to the all-time histograms."""
+        with trace._lock:
+            spans = {name: list(values) for name, values in trace.spans.items()}
+        self._observe(spans)
+        logger.info(trace.summary())
+
+    def record_late(self, signal_id: str, name: str, seconds: float) -> None:
+        """Record a span of a signal after its fan-out (fills, DB writes)."""
+        trace = self.get(signal_id)
+        if trace is None:
+            return
+        trace.record(name, seconds)
+        self._observe({name: [seconds]})
+
+    def traces(self) -> List[SignalTrace]:
+        with self._lock:
+            return list(self._traces.values())
+
+    def to_json(self) -> str:
+        return json.dumps({'traces': [trace.to_dict() for trace in self.traces()]})
+
+    def to_prometheus(self) -> str:
+        lines = [
+            "# HELP copytrade_span_seconds Span latency over all signals.",
+            "# TYPE copytrade_span_seconds histogram",
+        ]
+        with self._lock:
+            histograms = {name: (list(buckets), count, total)
+                          for name, (buckets, count, total) in self._histograms.items()}
+        for name, (buckets, count, total) in sorted(histograms.items()):
+            for bound, value in zip(BUCKETS, buckets):
+                lines.append(f'copytrade_span_seconds_bucket{{span="{name}",le="{bound}"}} {value}')
+            lines.append(f'copytrade_span_seconds_bucket{{span="{name}",le="+Inf"}} {count}')
+            lines.append(f'copytrade_span_seconds_count{{span="{name}"}} {count}')
+            lines.append(f'copytrade_span_seconds_sum{{span="{name}"}} {total}')
+
+        lines += [
+            "# HELP copytrade_signal_span_seconds Span latency across accounts of recent signals.",
+            "# TYPE copytrade_signal_span_seconds summary",
+        ]
+        for trace in self.traces():
+            labels = f'signal="{trace.signal_id}",symbol="{trace.symbol}"'
+            for name, stats in trace.percentiles().items():
+                for q in QUANTILES:
+                    lines.append(
+                        f'copytrade_signal_span_seconds{{{labels},span="{name}",quantile="{q}"}} '
+                        f'{stats[f"p{int(q * 100)}"]}'
+                    )
+                lines.append(f'copytrade_signal_span_seconds_count{{{labels},span="{name}"}} {stats["count"]}')
+                lines.append(f'copytrade_signal_span_seconds_sum{{{labels},span="{name}"}} {stats["sum"]}')
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int, host: str = '127.0.0.1') -> None:
+        """Serve /metrics (Prometheus text) and /traces (JSON) on a thread."""
+        tracer = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == '/metrics':
+                    body, content_type = tracer.to_prometheus(), 'text/plain; version=0.0.4'
+                elif self.path == '/traces':
+                    body, content_type = tracer.to_json(), 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                data = body.encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self._server.serve_forever, name="tracing", daemon=True).start()
+        logger.info(f"Latency metrics on http://{host}:{port}/metrics and /traces")
+
+
+config = configparser.ConfigParser()
+config.optionxform = str
+config.read('config/bot.ini')
+
+tracer = Tracer(keep=config.getint('TRACING', 'keep_signals', fallback=50))
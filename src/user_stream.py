@@ -0,0 +1,120 @@
+"""
+Futures user-data stream of one account.
+
+Pushes order and account updates the moment Binance emits them, so fills
+do not wait for the next polling tick. The stream reconnects itself with a
+new listen key after a drop (see streams); while it is down, check_orders
+polls at its fallback interval.
+"""
+
+import json
+import logging
+from typing import Callable, Optional
+
+from binance.websocket.um_futures.websocket_client import UMFuturesWebsocketClient
+
+from binance_api import Binance
+from streams import ReconnectingStream, close_client
+
+logger = logging.getLogger(__name__)
+
+
+def order_from_event(event: dict) -> dict:
+    """
+    Convert the `o` payload of ORDER_TRADE_UPDATE to the REST order shape.
+
+    Args:
+        event: Order payload of the stream event
+
+    Returns:
+        Order dict with the same keys `Binance.get_order` returns
+    """
+    return {
+        'symbol': event['s'],
+        'clientOrderId': event['c'],
+        'orderId': event['i'],
+        'side': event['S'],
+        'type': event['o'],
+        'status': event['X'],
+        'price': event['p'],
+        'avgPrice': event['ap'],
+        'origQty': event['q'],
+        'executedQty': event['z'],
+        'stopPrice': event['sp'],
+        'updateTime': event['T'],
+    }
+
+
+class UserDataStream(ReconnectingStream):
+    """
+    Listen to the user-data stream of one account.
+
+    Args:
+        binance: Client of the account
+        on_order_update: Called with a REST-shaped order on every
+            ORDER_TRADE_UPDATE event
+        on_account_update: Called with the `a` payload of every
+            ACCOUNT_UPDATE event
+        on_config_update: Called with the `ac` payload of every
+            ACCOUNT_CONFIG_UPDATE event (leverage changes)
+        name: Account name for logging
+    """
+
+    def __init__(
+        self,
+        binance: Binance,
+        on_order_update: Optional[Callable[[dict], None]] = None,
+        on_account_update: Optional[Callable[[dict], None]] = None,
+        on_config_update: Optional[Callable[[dict], None]] = None,
+        name: str = ""
+    ):
+        super().__init__(f"User data stream of {name}")
+        self.binance = binance
+        self.on_order_update = on_order_update
+        self.on_account_update = on_account_update
+        self.on_config_update = on_config_update
+        self.listen_key = None
+
+    def _connect(self) -> UMFuturesWebsocketClient:
+        # a fresh listen key, the old one may have expired with the socket
+        self.listen_key = self.binance.client.new_listen_key()['listenKey']
+        client = UMFuturesWebsocketClient(
+            on_message=self._on_raw_message,
+            on_close=self._on_close,
+            on_error=self._on_error,
+        )
+        try:
+            client.user_data(listen_key=self.listen_key)
+        except Exception:
+            close_client(client)
+            raise
+        return client
+
+    def keep_alive(self) -> None:
+        """Renew the listen key (valid for 60 minutes) or restart the stream."""
+        if not self.running:
+            self.start()
+            return
+        try:
+            self.binance.client.renew_listen_key(self.listen_key)
+        except Exception as e:
+            logger.warning(f"Renewing the listen key failed, restarting {self.name}: {e}")
+            self.restart()
+
+    def _handle(self, message: str) -> None:
+        data = json.loads(message)
+        event_type = data.get('e')
+
+        if event_type == 'ORDER_TRADE_UPDATE':
+            if self.on_order_update:
+                self.on_order_update(order_from_event(data['o']))
+        elif event_type == 'ACCOUNT_UPDATE':
+            if self.on_account_update:
+                self.on_account_update(data['a'])
+        elif event_type == 'ACCOUNT_CONFIG_UPDATE':
+            # 'ac' carries leverage changes, 'ai' multi-assets mode changes
+            if self.on_config_update and 'ac' in data:
+                self.on_config_update(data['ac'])
+        elif event_type == 'listenKeyExpired':
+            logger.warning(f"Listen key of {self.name} expired")
+            self.reconnect()
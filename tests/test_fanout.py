@@ -0,0 +1,24 @@
+import pytest
+
+from fanout import FanOut
+
+
+def test_base_exception_does_not_stall_the_proxy():
+    fan_out = FanOut(max_workers=4, max_per_proxy=1)
+
+    def job(name):
+        if name == 'a':
+            raise SystemExit("job exited")
+        return name
+
+    futures = fan_out.submit(job, [
+        (name, 'proxy1', [name]) for name in ('a', 'b', 'c')
+    ])
+    by_name = {account_name: future for future, (account_name, _) in futures.items()}
+
+    with pytest.raises(SystemExit):
+        by_name['a'].result(timeout=5)
+    # the slot of the failed job went to the next ones in the queue
+    assert by_name['b'].result(timeout=5).value == 'b'
+    assert by_name['c'].result(timeout=5).value == 'c'
+    assert fan_out._in_flight['proxy1'] == 0
@@ -0,0 +1,63 @@
+import os
+import subprocess
+import sys
+
+import leverage
+from leverage import LeverageCache
+
+
+class FakeBinance:
+    def __init__(self):
+        self.requests = []
+
+    def change_margin_type(self, symbol, margin_type):
+        self.requests.append(('marginType', symbol, margin_type))
+
+    def set_leverage(self, symbol, leverage):
+        self.requests.append(('leverage', symbol, leverage))
+
+
+class FakeAccount:
+    def __init__(self, name):
+        self.name = name
+        self.binance = FakeBinance()
+
+
+def test_worker_changes_reach_the_bot_process_cache():
+    # what a shard worker does: start from a snapshot, journal changes
+    bot = LeverageCache(persist=False)
+    bot.load({('a', 'BTCUSDT'): (5, 'CROSSED'), ('b', 'BTCUSDT'): (3, 'CROSSED')})
+    worker = LeverageCache(persist=False)
+    worker.load(bot.snapshot(['a']))
+    assert worker.get('b', 'BTCUSDT') == (None, None)
+
+    account = FakeAccount('a')
+    assert worker.ensure(account, 'BTCUSDT', 5) is False
+    assert worker.ensure(account, 'BTCUSDT', 10) is True
+    assert worker.ensure(account, 'ETHUSDT', 2) is True
+    worker.invalidate('a', 'BTCUSDT')
+    assert account.binance.requests == [
+        ('leverage', 'BTCUSDT', 10),
+        ('marginType', 'ETHUSDT', 'CROSSED'),
+        ('leverage', 'ETHUSDT', 2),
+    ]
+
+    changes = worker.drain_changes()
+    assert worker.drain_changes() == []
+    bot.apply(changes)
+    assert bot.get('a', 'BTCUSDT') == (None, None)
+    assert bot.get('a', 'ETHUSDT') == (2, 'CROSSED')
+    assert bot.get('b', 'BTCUSDT') == (3, 'CROSSED')
+
+
+def test_shard_worker_does_not_import_main_or_models():
+    code = (
+        "import sys\n"
+        "import shard_worker\n"
+        "print(sorted({'main', 'models', 'peewee'} & set(sys.modules)))\n"
+    )
+    output = subprocess.run(
+        [sys.executable, '-c', code], capture_output=True, text=True, check=True,
+        env=dict(os.environ, PYTHONPATH=os.path.dirname(leverage.__file__)),
+    ).stdout
+    assert output.strip() == '[]'
@@ -0,0 +1,88 @@
+import json
+
+import pytest
+
+from binance_api import Binance
+from market import PriceFeed, price_feed
+
+
+def mark_prices(**prices):
+    # one `!markPrice@arr` message as Binance sends it
+    return json.dumps([
+        {'e': 'markPriceUpdate', 's': symbol, 'p': str(price)}
+        for symbol, price in prices.items()
+    ])
+
+
+@pytest.fixture
+def binance():
+    binance = Binance(key='test', secret='test')
+    # capture orders instead of sending them
+    binance.client.new_order = lambda **params: params
+
+    def no_rest(**params):
+        raise AssertionError("price read through REST instead of the replayed stream")
+
+    binance.client.mark_price = no_rest
+    return binance
+
+
+def test_replay_updates_prices():
+    feed = PriceFeed()
+    feed.replay([
+        json.dumps({'result': None, 'id': 1}),
+        mark_prices(BTCUSDT=30000.5, ETHUSDT=2000),
+    ])
+    assert feed.get_price('BTCUSDT') == 30000.5
+    assert feed.get_price('ETHUSDT') == 2000.0
+    with pytest.raises(KeyError):
+        feed.get_price('XRPUSDT')
+
+
+@pytest.mark.parametrize('mark, stop_price, order_type', [
+    (100.0, 110.0, 'STOP'),
+    (120.0, 110.0, 'TAKE_PROFIT'),
+])
+def test_stoplimit_long_follows_replayed_price(binance, mark, stop_price, order_type):
+    price_feed.replay([mark_prices(REPLAYUSDT=mark)])
+    order = binance.stoplimit_long('REPLAYUSDT', stop_price, stop_price, 1.0, 'CID')
+    assert order['type'] == order_type
+    assert order['side'] == 'BUY'
+    assert order['stopPrice'] == stop_price
+
+
+@pytest.mark.parametrize('mark, stop_price, order_type', [
+    (120.0, 110.0, 'STOP'),
+    (100.0, 110.0, 'TAKE_PROFIT'),
+])
+def test_stoplimit_short_follows_replayed_price(binance, mark, stop_price, order_type):
+    price_feed.replay([mark_prices(REPLAYUSDT=mark)])
+    order = binance.stoplimit_short('REPLAYUSDT', stop_price, stop_price, 1.0, 'CID')
+    assert order['type'] == order_type
+    assert order['side'] == 'SELL'
+
+
+def test_stale_price_falls_back_to_rest(binance):
+    feed = PriceFeed(max_age=0)
+    feed.replay([mark_prices(REPLAYUSDT=100.0)])
+    binance.client.mark_price = lambda symbol: {'symbol': symbol, 'markPrice': '105.0'}
+    assert feed.get_price('REPLAYUSDT', binance.client) == 105.0
+
+
+@pytest.mark.parametrize('kind, mark, last, order_type', [
+    # mark below the stop, last price already above it
+    ('long', 109.0, 111.0, 'STOP'),
+    # mark above the stop, last price already below it
+    ('short', 111.0, 109.0, 'STOP'),
+])
+def test_orders_trigger_on_the_price_they_were_chosen_by(binance, kind, mark, last, order_type):
+    # on the last price the order would trigger at once; Binance has to
+    # compare the stop with the same mark price the type was chosen by
+    price_feed.replay([mark_prices(REPLAYUSDT=mark)])
+    binance.client.ticker_price = lambda symbol: {'symbol': symbol, 'price': str(last)}
+    stoplimit = binance.stoplimit_long if kind == 'long' else binance.stoplimit_short
+    order = stoplimit('REPLAYUSDT', 110.0, 110.0, 1.0, 'CID')
+    template = binance.entry_template(kind, 'REPLAYUSDT', 110.0, 'CID')
+    for params in (order, template.params):
+        assert params['type'] == order_type
+        assert params['workingType'] == 'MARK_PRICE'
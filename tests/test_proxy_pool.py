@@ -0,0 +1,42 @@
+import logging
+
+import pytest
+
+from proxy_pool import ProxyPool
+
+HOME = '10.0.0.1:8080'
+SLOW = '10.0.0.2:8080'
+FAST = '10.0.0.3:8080'
+
+
+def make_pool(failover):
+    pool = ProxyPool(failover=failover, min_requests=1)
+    pool.record(SLOW, 1.0)
+    pool.record(FAST, 0.1)
+    # rate limited, degraded for a minute
+    pool.record(HOME, 0.2, error=RuntimeError("429"), status_code=429, retry_after=60)
+    return pool
+
+
+def test_route_moves_accounts_off_an_unhealthy_home_with_failover():
+    pool = make_pool(failover=True)
+    assert not pool.is_healthy(HOME)
+    assert pool.route(HOME) == FAST
+    assert pool.route(SLOW) == SLOW
+    assert pool.check_failover() == []
+
+
+def test_route_keeps_the_home_proxy_without_failover(caplog):
+    pool = make_pool(failover=False)
+    assert pool.route(HOME) == HOME
+    with caplog.at_level(logging.WARNING, logger='proxy_pool'):
+        assert pool.check_failover() == [HOME]
+    assert "failover is off" in caplog.text
+
+
+@pytest.mark.parametrize('failover', [True, False])
+def test_route_keeps_the_home_proxy_when_none_is_healthy(failover):
+    pool = ProxyPool(failover=failover)
+    pool.record(HOME, 0.2, status_code=418, retry_after=60)
+    pool.record(FAST, 0.1, status_code=429, retry_after=60)
+    assert pool.route(HOME) == HOME
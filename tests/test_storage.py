@@ -0,0 +1,144 @@
+import configparser
+import os
+import sqlite3
+
+import pytest
+from peewee import SqliteDatabase
+
+import storage
+
+
+@pytest.fixture(scope='module')
+def models(tmp_path_factory):
+    # models opens the database of config/bot.ini on import, keep it out of the tree
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp('bot'))
+    try:
+        import models
+    finally:
+        os.chdir(cwd)
+    return models
+
+
+def make_config(**options) -> configparser.ConfigParser:
+    config = configparser.ConfigParser()
+    config['DATABASE'] = options
+    return config
+
+
+def sqlite_config(tmp_path) -> configparser.ConfigParser:
+    return make_config(backend='sqlite', path=str(tmp_path / 'data' / 'db'))
+
+
+def postgres_config() -> configparser.ConfigParser:
+    # e.g. against `docker-compose --profile postgres up`
+    if 'COPYTRADE_TEST_POSTGRES_HOST' not in os.environ:
+        pytest.skip("COPYTRADE_TEST_POSTGRES_HOST is not set")
+    pytest.importorskip('psycopg2')
+    return make_config(
+        backend='postgres',
+        host=os.environ['COPYTRADE_TEST_POSTGRES_HOST'],
+        port=os.environ.get('COPYTRADE_TEST_POSTGRES_PORT', '5432'),
+        name=os.environ.get('COPYTRADE_TEST_POSTGRES_DB', 'copytrade'),
+        user=os.environ.get('COPYTRADE_TEST_POSTGRES_USER', 'copytrade'),
+        password=os.environ.get('COPYTRADE_TEST_POSTGRES_PASSWORD', 'copytrade'),
+    )
+
+
+def close(database) -> None:
+    if hasattr(database, 'stop'):
+        # the SQLite write queue
+        database.stop()
+    database.close()
+
+
+def direct(database):
+    # queued SQLite writes are asynchronous, read and write on a direct connection
+    if isinstance(database, SqliteDatabase):
+        return SqliteDatabase(database.database)
+    return database
+
+
+def drop_tables(database, models) -> None:
+    with database.bind_ctx([storage.SchemaMigrations, *models.MODELS]):
+        database.drop_tables([storage.SchemaMigrations, *models.MODELS])
+    storage.release_connection(database)
+
+
+def settings_index(database):
+    return {tuple(index.columns): index.unique
+            for index in database.get_indexes('accountsymbolsettings')}
+
+
+@pytest.fixture(params=['sqlite', 'postgres'])
+def database(request, tmp_path, models):
+    config = sqlite_config(tmp_path) if request.param == 'sqlite' else postgres_config()
+    database = storage.open_database(config)
+    if request.param == 'postgres':
+        drop_tables(database, models)
+    yield database
+    if request.param == 'postgres':
+        drop_tables(database, models)
+    close(database)
+
+
+def test_open_database_rejects_unknown_backend():
+    with pytest.raises(ValueError):
+        storage.open_database(make_config(backend='mysql'))
+
+
+def test_fresh_schema_records_every_migration(database, models):
+    storage.create_schema(database, models.MODELS)
+    # a second start finds nothing to do
+    storage.create_schema(database, models.MODELS)
+
+    connection = direct(database)
+    with connection.bind_ctx([storage.SchemaMigrations, *models.MODELS]):
+        applied = [row.name for row in storage.SchemaMigrations.select()]
+        assert applied == [name for name, _ in storage.MIGRATIONS]
+        assert settings_index(connection)[('instance', 'account', 'symbol')] is True
+
+        for instance in ('default', 'second'):
+            models.AccountSymbolSettings.create(
+                instance=instance, account='a', symbol='BTCUSDT', leverage=5)
+        assert models.AccountSymbolSettings.select().count() == 2
+    if connection is database:
+        storage.release_connection(database)
+    else:
+        connection.close()
+
+
+def test_settings_of_older_databases_move_to_the_default_instance(tmp_path, models):
+    config = sqlite_config(tmp_path)
+    path = config.get('DATABASE', 'path')
+    database = storage.open_database(config)
+    storage.create_schema(database, models.MODELS)
+    close(database)
+
+    # accountsymbolsettings as the bot created it before instances existed
+    connection = sqlite3.connect(path)
+    connection.executescript("""
+        DROP TABLE accountsymbolsettings;
+        CREATE TABLE accountsymbolsettings (
+            id INTEGER NOT NULL PRIMARY KEY, account TEXT NOT NULL,
+            symbol TEXT NOT NULL, leverage INTEGER, margin_type TEXT,
+            updated_at DATETIME NOT NULL);
+        CREATE UNIQUE INDEX accountsymbolsettings_account_symbol
+            ON accountsymbolsettings (account, symbol);
+        INSERT INTO accountsymbolsettings VALUES (1, 'a', 'BTCUSDT', 5, 'CROSSED', '2026-01-01');
+        DELETE FROM schema_migrations WHERE name = '0004_account_settings_instance';
+    """)
+    connection.close()
+
+    database = storage.open_database(config)
+    storage.create_schema(database, models.MODELS)
+    close(database)
+
+    connection = SqliteDatabase(path)
+    indexes = settings_index(connection)
+    assert indexes[('instance', 'account', 'symbol')] is True
+    assert ('account', 'symbol') not in indexes
+    with connection.bind_ctx(models.MODELS):
+        row = models.AccountSymbolSettings.get()
+        assert (row.instance, row.account, row.leverage) == ('default', 'a', 5)
+    connection.close()
@@ -0,0 +1,113 @@
+import threading
+import time
+
+import pytest
+
+import streams
+
+
+class FakeSocket:
+    def shutdown(self):
+        pass
+
+
+class FakeSocketManager(threading.Thread):
+    # reader thread of one connection, alive until closed
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.ws = FakeSocket()
+        self.closed = threading.Event()
+        self.start()
+
+    def run(self):
+        self.closed.wait()
+
+    def close(self):
+        self.closed.set()
+
+
+class FakeClient:
+    def __init__(self):
+        self.socket_manager = FakeSocketManager()
+
+
+class FakeStream(streams.ReconnectingStream):
+    def __init__(self):
+        super().__init__("test stream")
+        self.connects = 0
+        self.messages = []
+
+    def _connect(self):
+        self.connects += 1
+        return FakeClient()
+
+    def _handle(self, message):
+        if message == 'bad':
+            raise ValueError(message)
+        self.messages.append(message)
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            pytest.fail("condition not met in time")
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def stream():
+    stream = FakeStream()
+    stream.start()
+    yield stream
+    stream.stop()
+
+
+def test_handler_error_keeps_socket(stream):
+    client = stream._ws_client
+    stream._on_raw_message(None, 'bad')
+    stream._on_raw_message(None, 'good')
+    assert stream._ws_client is client
+    assert stream.running
+    assert stream.connects == 1
+    assert stream.messages == ['good']
+
+
+def test_start_is_noop_while_running(stream):
+    stream.start()
+    assert stream.connects == 1
+
+
+def test_lost_connection_reconnects_at_once(stream):
+    old = stream._ws_client
+    stream._on_error(old.socket_manager, ConnectionError("lost"))
+    wait_for(lambda: stream.connects == 2 and stream.running)
+    assert stream._ws_client is not old
+    assert not old.socket_manager.is_alive()
+
+
+def test_close_of_stopped_client_is_ignored(stream):
+    old = stream._ws_client
+    stream.restart()
+    stream._on_close(old.socket_manager)
+    time.sleep(0.1)
+    assert stream.connects == 2
+
+
+def test_start_replaces_dead_client(stream):
+    old = stream._ws_client
+    old.socket_manager.close()
+    old.socket_manager.join()
+    assert not stream.running
+    stream.start()
+    assert stream.running
+    assert stream._ws_client is not old
+
+
+def test_stream_without_a_hook_fails_when_created():
+    class NoHandler(streams.ReconnectingStream):
+        def _connect(self):
+            return FakeClient()
+
+    with pytest.raises(TypeError):
+        NoHandler("incomplete")